@@ -0,0 +1,183 @@
+"""
+A 2-dimensional vector class that keeps both coordinates in one ``complex``
+
+Same behavior as ``vector2d_v3.py`` and ``vector2d_v3_slots.py``:
+
+    >>> v1 = Vector2d(3, 4)
+    >>> print(v1.x, v1.y)
+    3.0 4.0
+    >>> x, y = v1
+    >>> x, y
+    (3.0, 4.0)
+    >>> v1
+    Vector2d(3.0, 4.0)
+    >>> v1_clone = eval(repr(v1))
+    >>> v1 == v1_clone
+    True
+    >>> print(v1)
+    (3.0, 4.0)
+    >>> octets = bytes(v1)
+    >>> octets
+    b'd\\x00\\x00\\x00\\x00\\x00\\x00\\x08@\\x00\\x00\\x00\\x00\\x00\\x00\\x10@'
+    >>> abs(v1)
+    5.0
+    >>> bool(v1), bool(Vector2d(0, 0))
+    (True, False)
+
+
+Test of ``.frombytes()`` class method:
+
+    >>> v1_clone = Vector2d.frombytes(bytes(v1))
+    >>> v1_clone
+    Vector2d(3.0, 4.0)
+    >>> v1 == v1_clone
+    True
+
+
+Tests of ``format()`` with Cartesian coordinates:
+
+    >>> format(v1)
+    '(3.0, 4.0)'
+    >>> format(v1, '.2f')
+    '(3.00, 4.00)'
+    >>> format(v1, '.3e')
+    '(3.000e+00, 4.000e+00)'
+
+
+Tests of the ``angle`` method::
+
+    >>> Vector2d(0, 0).angle()
+    0.0
+    >>> Vector2d(1, 0).angle()
+    0.0
+    >>> epsilon = 10**-8
+    >>> abs(Vector2d(0, 1).angle() - cmath.pi/2) < epsilon
+    True
+    >>> abs(Vector2d(1, 1).angle() - cmath.pi/4) < epsilon
+    True
+
+
+Tests of ``format()`` with polar coordinates:
+
+    >>> format(Vector2d(1, 1), 'p')  # doctest:+ELLIPSIS
+    '<1.414213..., 0.785398...>'
+    >>> format(Vector2d(1, 1), '.3ep')
+    '<1.414e+00, 7.854e-01>'
+    >>> format(Vector2d(1, 1), '0.5fp')
+    '<1.41421, 0.78540>'
+
+
+Tests of `x` and `y` read-only properties, and of the single slot:
+
+    >>> v1.x, v1.y
+    (3.0, 4.0)
+    >>> v1.x = 123  # doctest:+IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+      ...
+    AttributeError: can't set attribute
+    >>> v1.z = 1j
+    Traceback (most recent call last):
+      ...
+    AttributeError: 'Vector2d' object has no attribute 'z'
+
+
+Tests of hashing, with the same values as the other variants:
+
+    >>> v1 = Vector2d(3, 4)
+    >>> v2 = Vector2d(3.1, 4.2)
+    >>> hash(v1), hash(v2)
+    (7, 384307168202284039)
+    >>> len(set([v1, v2]))
+    2
+    >>> v1 == (3, 4), v1 == Vector2d(3, 4.5), v1 != v2
+    (True, False, True)
+    >>> bool(Vector2d(0, -0.0)), bool(Vector2d(0, 1e-300))
+    (False, True)
+
+
+Test of the trusted bulk loader:
+
+    >>> Vector2d.fromfloats([3.0, 0.5], [4.0, -1.0])
+    [Vector2d(3.0, 4.0), Vector2d(0.5, -1.0)]
+
+"""
+
+import cmath
+from array import array
+
+
+class Vector2d:
+    __slots__ = ('__z',)  # one complex holds both coordinates: 32 bytes, not 2 floats of 24
+
+    typecode = 'd'
+
+    def __init__(self, x, y):
+        self.__z = complex(float(x), float(y))
+
+    @property
+    def x(self):
+        return self.__z.real
+
+    @property
+    def y(self):
+        return self.__z.imag
+
+    def __iter__(self):
+        z = self.__z
+        return iter((z.real, z.imag))
+
+    def __repr__(self):
+        class_name = type(self).__name__
+        return '{}({!r}, {!r})'.format(class_name, *self)
+
+    def __str__(self):
+        return str(tuple(self))
+
+    def __bytes__(self):
+        return (bytes([ord(self.typecode)]) +
+                bytes(array(self.typecode, self)))
+
+    def __eq__(self, other):
+        if isinstance(other, Vector2d):
+            return self.__z == other.__z
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        z = self.__z
+        return hash(z.real) ^ hash(z.imag)  # same hash as the other variants
+
+    def __abs__(self):
+        return abs(self.__z)  # complex abs is hypot, computed in C
+
+    def __bool__(self):
+        return bool(self.__z)
+
+    def angle(self):
+        return cmath.phase(self.__z)
+
+    def __format__(self, fmt_spec=''):
+        if fmt_spec.endswith('p'):
+            fmt_spec = fmt_spec[:-1]
+            coords = (abs(self), self.angle())
+            outer_fmt = '<{}, {}>'
+        else:
+            coords = self
+            outer_fmt = '({}, {})'
+        components = (format(c, fmt_spec) for c in coords)
+        return outer_fmt.format(*components)
+
+    @classmethod
+    def frombytes(cls, octets):
+        typecode = chr(octets[0])
+        memv = memoryview(octets[1:]).cast(typecode)
+        return cls(*memv)
+
+    @classmethod
+    def fromfloats(cls, xs, ys):  # trusted bulk loader: xs and ys must hold floats
+        new = object.__new__
+        vectors = []
+        for z in map(complex, xs, ys):  # complex() runs in C for all pairs
+            vector = new(cls)
+            vector.__z = z
+            vectors.append(vector)
+        return vectors
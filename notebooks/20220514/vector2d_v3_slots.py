@@ -59,4 +59,15 @@ class Vector2d:
     def frombytes(cls, octets):
         typecode = chr(octets[0])
         memv = memoryview(octets[1:]).cast(typecode)
-        return cls(*memv)
\ No newline at end of file
+        return cls(*memv)
+
+    @classmethod
+    def fromfloats(cls, xs, ys):  # trusted bulk loader: xs and ys must hold floats
+        new = object.__new__
+        vectors = []
+        for x, y in zip(xs, ys):
+            vector = new(cls)  # skip __init__ and its float() conversions
+            vector.__x = x
+            vector.__y = y
+            vectors.append(vector)
+        return vectors
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Compare the speed and memory of the Vector2d variants.
+
+Sample run::
+
+    $ ./vector_bench.py
+    operation       vector2d_v3 vector2d_v3_slots vector2d_v3_compact
+    construct          7.62e+05          1.30e+06            9.22e+05
+    fromfloats         9.12e+05          1.45e+06            1.18e+06
+    hash               1.65e+06          2.25e+06            2.49e+06
+    eq                 4.33e+05          3.79e+05            5.10e+06
+    format             2.97e+05          2.32e+05            2.84e+05
+    bytes/instance          136                96                  72
+
+Speeds are operations per second, best of ``REPEAT`` runs over ``-n``
+vectors. Bytes per instance are measured with ``tracemalloc`` and
+include the floats, but not the list holding the vectors. Pass module
+names as arguments to compare only those.
+"""
+
+import argparse
+import importlib
+import sys
+import time
+import tracemalloc
+
+REPEAT = 5
+MODULES = ['vector2d_v3', 'vector2d_v3_slots', 'vector2d_v3_compact']
+
+
+def best_rate(func, count):
+    best = min(timed(func) for _ in range(REPEAT))
+    return count / best
+
+
+def timed(func):
+    t0 = time.perf_counter()
+    func()
+    return time.perf_counter() - t0
+
+
+def bytes_per_instance(cls, count):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        vectors = [cls(i, -i) for i in range(count)]  # new floats from ints
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before - sys.getsizeof(vectors)) / count
+
+
+def measure(module_name, count):
+    """Return a dict mapping operation name to result for one module."""
+    cls = importlib.import_module(module_name).Vector2d
+    xs = [i * 1.5 for i in range(count)]
+    ys = [i * -2.5 for i in range(count)]
+    vectors = [cls(x, y) for x, y in zip(xs, ys)]
+    others = cls.fromfloats(xs, ys)  # equal, but not the same objects
+    return {
+        'construct': best_rate(lambda: [cls(x, y) for x, y in zip(xs, ys)],
+                               count),
+        'fromfloats': best_rate(lambda: cls.fromfloats(xs, ys), count),
+        'hash': best_rate(lambda: list(map(hash, vectors)), count),
+        'eq': best_rate(lambda: [a == b for a, b in zip(vectors, others)],
+                        count),
+        'format': best_rate(lambda: [format(v, '.2f') for v in vectors],
+                            count),
+        'bytes/instance': bytes_per_instance(cls, count),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('-n', type=int, default=100_000,
+                        help='vectors per run (default=100000)')
+    args = parser.parse_args()
+
+    results = {name: measure(name, args.n) for name in args.modules}
+    widths = [max(len(name), 10) for name in args.modules]
+    print(f'{"operation":15}',
+          *(f'{name:>{w}}' for name, w in zip(args.modules, widths)))
+    for operation in next(iter(results.values())):
+        cells = []
+        for name, w in zip(args.modules, widths):
+            value = results[name][operation]
+            cell = f'{value:.0f}' if operation == 'bytes/instance' else f'{value:.2e}'
+            cells.append(f'{cell:>{w}}')
+        print(f'{operation:15}', *cells)
+
+
+if __name__ == '__main__':
+    main()
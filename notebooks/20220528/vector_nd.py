@@ -0,0 +1,318 @@
+"""
+A multidimensional ``Vector`` class for many dimensions
+
+Like ``Vector`` in the notebook, but the components live in one buffer
+shared through ``memoryview``: slicing returns a view, not a copy.
+Elementwise operations run over the whole buffer with NumPy when it is
+installed; norms and dot products use ``math.hypot`` and ``math.fsum``
+either way, so results don't depend on NumPy. The hash is computed once.
+
+Tests with 2 dimensions (same results as ``vector2d_v3.py``)::
+
+    >>> v1 = Vector([3, 4])
+    >>> x, y = v1
+    >>> x, y
+    (3.0, 4.0)
+    >>> v1
+    Vector([3.0, 4.0])
+    >>> v1_clone = eval(repr(v1))
+    >>> v1 == v1_clone
+    True
+    >>> print(v1)
+    (3.0, 4.0)
+    >>> octets = bytes(v1)
+    >>> octets
+    b'd\\x00\\x00\\x00\\x00\\x00\\x00\\x08@\\x00\\x00\\x00\\x00\\x00\\x00\\x10@'
+    >>> abs(v1)
+    5.0
+    >>> bool(v1), bool(Vector([0, 0]))
+    (True, False)
+
+
+Test of ``.frombytes()`` class method, which shares the buffer of
+immutable octets of the same typecode, and copies any other:
+
+    >>> v1_clone = Vector.frombytes(bytes(v1))
+    >>> v1_clone
+    Vector([3.0, 4.0])
+    >>> v1 == v1_clone
+    True
+    >>> v_float = Vector.frombytes(b'f' + bytes(array('f', [1.0, 2.0])))
+    >>> v_float, Vector.frombytes(bytes(v_float)) == v_float
+    (Vector([1.0, 2.0]), True)
+    >>> buffer = bytearray(bytes(v1))
+    >>> v_copy = Vector.frombytes(buffer)
+    >>> buffer[1:] = bytes(16)
+    >>> buffer.append(0)  # not locked by an export to the vector
+    >>> v_copy, hash(v_copy) == hash(v1)
+    (Vector([3.0, 4.0]), True)
+    >>> buffer = bytearray(bytes(v1))
+    >>> v_copy = Vector.frombytes(memoryview(buffer).toreadonly())
+    >>> buffer[1:] = bytes(16)  # a read-only view, but not immutable octets
+    >>> v_copy, hash(v_copy) == hash(v1)
+    (Vector([3.0, 4.0]), True)
+
+
+Tests of sequence behavior; slices share the buffer of the original:
+
+    >>> v7 = Vector(range(7))
+    >>> v7[-1]
+    6.0
+    >>> v7[1:4]
+    Vector([1.0, 2.0, 3.0])
+    >>> v7[::-2]
+    Vector([6.0, 4.0, 2.0, 0.0])
+    >>> Vector(range(10_000))
+    Vector([0.0, 1.0, 2.0, 3.0, 4.0, 5.0, ...])
+    >>> v7[1:4].shares_memory(v7)
+    True
+    >>> v7[1, 2]
+    Traceback (most recent call last):
+      ...
+    TypeError: Vector indices must be integers
+    >>> v7.x, v7.t
+    (0.0, 3.0)
+    >>> v7.k
+    Traceback (most recent call last):
+      ...
+    AttributeError: 'Vector' object has no attribute 'k'
+
+
+Tests of bulk math:
+
+    >>> v3 = Vector([1, 2, 3])
+    >>> v3 + Vector([10, 20, 30])
+    Vector([11.0, 22.0, 33.0])
+    >>> v3 - v3
+    Vector([0.0, 0.0, 0.0])
+    >>> -v3, v3 * 2, 0.5 * v3
+    (Vector([-1.0, -2.0, -3.0]), Vector([2.0, 4.0, 6.0]), Vector([0.5, 1.0, 1.5]))
+    >>> v3 @ Vector([4, 5, 6])
+    32.0
+    >>> v3.dot([4, 5, 6])
+    32.0
+    >>> Vector([1e16, 1, -1e16]) @ Vector([1, 1, 1])  # fsum, not sum
+    1.0
+    >>> v3 + Vector([1, 2])
+    Traceback (most recent call last):
+      ...
+    ValueError: vectors of different lengths: 3 and 2
+    >>> v3 * v3
+    Traceback (most recent call last):
+      ...
+    TypeError: unsupported operand type(s) for *: 'Vector' and 'Vector'
+    >>> class Tagged(Vector):
+    ...     pass
+    >>> type(Tagged([1]) + Tagged([2])).__name__, type(2 * Tagged([1])).__name__
+    ('Tagged', 'Tagged')
+
+
+Tests of equality, including other sequences and NaN:
+
+    >>> v3 == [1, 2, 3], v3 == Vector([1, 2]), v3 == v3[:]
+    (True, False, True)
+    >>> nan = Vector([float('nan')])
+    >>> nan == nan
+    False
+
+
+Tests of hashing, with the same values as the notebook ``Vector``:
+
+    >>> v2 = Vector([3.1, 4.2])
+    >>> hash(v1), hash(v3), hash(v2)
+    (7, 0, 384307168202284039)
+    >>> big = Vector(range(10_000))
+    >>> hash(big) == hash(Vector(range(10_000))) == hash(big[:])
+    True
+    >>> len({v1, v1_clone, v2})
+    2
+    >>> import pickle
+    >>> pickle.loads(pickle.dumps(v7[::2]))
+    Vector([0.0, 2.0, 4.0, 6.0])
+
+
+Tests of ``format()`` with hyperspherical coordinates:
+
+    >>> format(Vector([1, 1]), 'h')  # doctest:+ELLIPSIS
+    '<1.414213..., 0.785398...>'
+    >>> format(Vector([1, 1, 1, 1]), '.3eh')
+    '<2.000e+00, 1.047e+00, 9.553e-01, 7.854e-01>'
+    >>> format(v3, '.1f')
+    '(1.0, 2.0, 3.0)'
+
+"""
+
+from array import array
+import functools
+import itertools
+import math
+import numbers
+import operator
+import reprlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Vector:
+    __slots__ = ('_components', '_hash')
+
+    typecode = 'd'
+
+    def __init__(self, components):
+        self._components = memoryview(array(self.typecode, components))
+        self._hash = None
+
+    @classmethod
+    def _fromview(cls, view):
+        """Wrap a memoryview of floats without copying it."""
+        vector = object.__new__(cls)
+        vector._components = view
+        vector._hash = None
+        return vector
+
+    def __iter__(self):
+        return iter(self._components)
+
+    def __repr__(self):
+        head = list(itertools.islice(self, 7))  # reprlib shows 6 and '...'
+        components = reprlib.repr(head)
+        return 'Vector({})'.format(components)
+
+    def __reduce__(self):  # memoryview can't be pickled
+        return type(self), (self._components.tolist(),)
+
+    def __str__(self):
+        return str(tuple(self))
+
+    def __bytes__(self):
+        return (bytes([ord(self.typecode)]) +
+                self._components.tobytes())
+
+    def __eq__(self, other):
+        if isinstance(other, Vector):  # elementwise in C, NaN != NaN
+            return self._components == other._components
+        return (len(self) == len(other) and
+                all(a == b for a, b in zip(self, other)))
+
+    def __hash__(self):
+        if self._hash is None:  # immutable, so compute only once
+            hashes = map(hash, self._components)
+            self._hash = functools.reduce(operator.xor, hashes, 0)
+        return self._hash
+
+    def __abs__(self):
+        return math.hypot(*self._components)
+
+    def __bool__(self):
+        return any(self._components)
+
+    def __len__(self):
+        return len(self._components)
+
+    def __getitem__(self, index):
+        cls = type(self)
+        if isinstance(index, slice):
+            return cls._fromview(self._components[index])
+        elif isinstance(index, numbers.Integral):
+            return self._components[index]
+        else:
+            msg = '{.__name__} indices must be integers'
+            raise TypeError(msg.format(cls))
+
+    def shares_memory(self, other):
+        return self._components.obj is other._components.obj
+
+    shortcut_names = 'xyzt'
+
+    def __getattr__(self, name):
+        cls = type(self)
+        if len(name) == 1:
+            pos = cls.shortcut_names.find(name)
+            if 0 <= pos < len(self._components):
+                return self._components[pos]
+        msg = '{.__name__!r} object has no attribute {!r}'
+        raise AttributeError(msg.format(cls, name))
+
+    def _elementwise(self, op, other):
+        if len(self) != len(other):
+            raise ValueError('vectors of different lengths: '
+                             f'{len(self)} and {len(other)}')
+        if np is not None:
+            result = op(np.asarray(self._components),
+                        np.asarray(other._components))
+            return type(self)._fromview(memoryview(result))
+        return type(self)(map(op, self._components, other._components))
+
+    def __add__(self, other):
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return self._elementwise(operator.add, other)
+
+    def __sub__(self, other):
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return self._elementwise(operator.sub, other)
+
+    def __mul__(self, scalar):
+        if not isinstance(scalar, numbers.Real):
+            return NotImplemented
+        if np is not None:
+            result = np.asarray(self._components) * float(scalar)
+            return type(self)._fromview(memoryview(result))
+        return type(self)(map(operator.mul, self._components,
+                              itertools.repeat(float(scalar))))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return self * -1
+
+    def dot(self, other):
+        if len(self) != len(other):
+            raise ValueError('vectors of different lengths: '
+                             f'{len(self)} and {len(other)}')
+        if isinstance(other, Vector):
+            other = other._components
+        # same exactly rounded sum with or without NumPy
+        return math.fsum(map(operator.mul, self._components, other))
+
+    def __matmul__(self, other):
+        try:
+            return self.dot(other)
+        except TypeError:
+            return NotImplemented
+
+    def angle(self, n):
+        r = math.hypot(*self._components[n:])
+        a = math.atan2(r, self[n-1])
+        if (n == len(self) - 1) and (self[-1] < 0):
+            return math.pi * 2 - a
+        else:
+            return a
+
+    def angles(self):
+        return (self.angle(n) for n in range(1, len(self)))
+
+    def __format__(self, fmt_spec=''):
+        if fmt_spec.endswith('h'):  # hyperspherical coordinates
+            fmt_spec = fmt_spec[:-1]
+            coords = itertools.chain([abs(self)],
+                                     self.angles())
+            outer_fmt = '<{}>'
+        else:
+            coords = self
+            outer_fmt = '({})'
+        components = (format(c, fmt_spec) for c in coords)
+        return outer_fmt.format(', '.join(components))
+
+    @classmethod
+    def frombytes(cls, octets):
+        typecode = chr(octets[0])
+        memv = memoryview(octets)[1:].cast(typecode)
+        if isinstance(memv.obj, bytes) and typecode == cls.typecode:
+            return cls._fromview(memv)  # immutable and same format: share
+        with memv:  # release the caller's buffer after copying it
+            return cls(memv)
@@ -0,0 +1,214 @@
+"""
+A columnar container of 2-dimensional vectors
+
+``Vector2dArray`` keeps all x coordinates in one ``array('d')`` and all y
+coordinates in another: 16 bytes per vector, instead of a ``Vector2d``
+object, its ``__dict__`` and two floats each. Bulk operations apply C
+functions like ``math.hypot`` over whole columns with ``map``, so there is
+no Python-level call per vector.
+
+    >>> va = Vector2dArray([(3, 4), (1, 1), (0, 0)])
+    >>> va
+    Vector2dArray([(3.0, 4.0), (1.0, 1.0), (0.0, 0.0)])
+    >>> len(va)
+    3
+    >>> va.nbytes
+    48
+
+
+Items are built as ``Vector2d`` on demand:
+
+    >>> va[0]
+    Vector2d(3.0, 4.0)
+    >>> va[-1]
+    Vector2d(0.0, 0.0)
+    >>> [abs(v) for v in va]
+    [5.0, 1.4142135623730951, 0.0]
+    >>> va[1:]
+    Vector2dArray([(1.0, 1.0), (0.0, 0.0)])
+    >>> va[3]
+    Traceback (most recent call last):
+      ...
+    IndexError: array index out of range
+
+
+Building from ``Vector2d`` instances and growing:
+
+    >>> vb = Vector2dArray.fromvectors([Vector2d(1, 2), Vector2d(3, 4)])
+    >>> vb.append(Vector2d(5, 6))
+    >>> vb.extend([(7, 8)])
+    >>> vb
+    Vector2dArray([(1.0, 2.0), (3.0, 4.0), (5.0, 6.0), (7.0, 8.0)])
+    >>> vb[:2] == Vector2dArray([(1, 2), (3, 4)])
+    True
+
+
+Bulk ``abs`` and ``angle`` return one ``array('d')`` for all vectors:
+
+    >>> abs(va)
+    array('d', [5.0, 1.4142135623730951, 0.0])
+    >>> va.angle()  # doctest:+ELLIPSIS
+    array('d', [0.927295..., 0.785398..., 0.0])
+
+
+Addition, scaling and dot products, elementwise:
+
+    >>> va + Vector2dArray([(1, 1), (2, 2), (3, 3)])
+    Vector2dArray([(4.0, 5.0), (3.0, 3.0), (3.0, 3.0)])
+    >>> va + Vector2d(10, 20)
+    Vector2dArray([(13.0, 24.0), (11.0, 21.0), (10.0, 20.0)])
+    >>> va * 2
+    Vector2dArray([(6.0, 8.0), (2.0, 2.0), (0.0, 0.0)])
+    >>> 0.5 * va
+    Vector2dArray([(1.5, 2.0), (0.5, 0.5), (0.0, 0.0)])
+    >>> va.dot(Vector2d(1, 0))
+    array('d', [3.0, 1.0, 0.0])
+    >>> va.dot(va)
+    array('d', [25.0, 2.0, 0.0])
+    >>> va + Vector2dArray([(1, 1)])
+    Traceback (most recent call last):
+      ...
+    ValueError: arrays of different lengths: 3 and 1
+    >>> va + 1
+    Traceback (most recent call last):
+      ...
+    TypeError: unsupported operand type(s) for +: 'Vector2dArray' and 'int'
+    >>> va * '3'
+    Traceback (most recent call last):
+      ...
+    TypeError: can't multiply sequence by non-int of type 'Vector2dArray'
+
+
+Hashes match ``Vector2d``:
+
+    >>> va.hashes() == [hash(v) for v in va]
+    True
+    >>> Vector2dArray([(3, 4), (3.1, 4.2)]).hashes()
+    [7, 384307168202284039]
+
+"""
+
+from array import array
+from itertools import repeat
+import math
+import numbers
+import operator
+import reprlib
+
+from vector2d_v3 import Vector2d
+
+
+class Vector2dArray:
+    typecode = 'd'
+
+    def __init__(self, pairs=()):
+        self.xs = array(self.typecode)
+        self.ys = array(self.typecode)
+        self.extend(pairs)
+
+    @classmethod
+    def fromcolumns(cls, xs, ys):
+        if len(xs) != len(ys):
+            raise ValueError('columns of different lengths: '
+                             f'{len(xs)} and {len(ys)}')
+        va = cls()
+        va.xs.extend(xs)
+        va.ys.extend(ys)
+        return va
+
+    @classmethod
+    def _fromarrays(cls, xs, ys):
+        """Take over two new arrays of the same length without copying."""
+        va = object.__new__(cls)
+        va.xs = xs
+        va.ys = ys
+        return va
+
+    @classmethod
+    def fromvectors(cls, vectors):
+        return cls(vectors)
+
+    def append(self, vector):
+        x, y = vector
+        self.xs.append(x)
+        self.ys.append(y)
+
+    def extend(self, pairs):
+        for x, y in pairs:
+            self.xs.append(x)
+            self.ys.append(y)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)._fromarrays(self.xs[index], self.ys[index])
+        return Vector2d(self.xs[index], self.ys[index])
+
+    def __iter__(self):
+        return map(Vector2d, self.xs, self.ys)
+
+    def __repr__(self):
+        pairs = reprlib.repr(list(zip(self.xs, self.ys)))
+        return f'{type(self).__name__}({pairs})'
+
+    def __eq__(self, other):
+        if isinstance(other, Vector2dArray):
+            return self.xs == other.xs and self.ys == other.ys
+        return NotImplemented
+
+    @property
+    def nbytes(self):
+        return (len(self.xs) + len(self.ys)) * self.xs.itemsize
+
+    def __abs__(self):
+        return array(self.typecode, map(math.hypot, self.xs, self.ys))
+
+    def angle(self):
+        return array(self.typecode, map(math.atan2, self.ys, self.xs))
+
+    def _columns(self, other):
+        """Columns of other, or a Vector2d repeated for every row."""
+        if isinstance(other, Vector2dArray):
+            if len(other) != len(self):
+                raise ValueError('arrays of different lengths: '
+                                 f'{len(self)} and {len(other)}')
+            return other.xs, other.ys
+        if isinstance(other, Vector2d):
+            return repeat(other.x), repeat(other.y)
+        return None
+
+    def __add__(self, other):
+        columns = self._columns(other)
+        if columns is None:
+            return NotImplemented
+        oxs, oys = columns
+        return type(self)._fromarrays(
+            array(self.typecode, map(operator.add, self.xs, oxs)),
+            array(self.typecode, map(operator.add, self.ys, oys)))
+
+    __radd__ = __add__
+
+    def __mul__(self, scalar):
+        if not isinstance(scalar, numbers.Real):
+            return NotImplemented
+        factor = float(scalar)
+        return type(self)._fromarrays(
+            array(self.typecode, map(operator.mul, self.xs, repeat(factor))),
+            array(self.typecode, map(operator.mul, self.ys, repeat(factor))))
+
+    __rmul__ = __mul__
+
+    def dot(self, other):
+        columns = self._columns(other)
+        if columns is None:
+            raise TypeError('dot needs a Vector2d or Vector2dArray, '
+                            f'not {type(other).__name__!r}')
+        oxs, oys = columns
+        return array(self.typecode, map(operator.add,
+                                        map(operator.mul, self.xs, oxs),
+                                        map(operator.mul, self.ys, oys)))
+
+    def hashes(self):
+        return list(map(operator.xor, map(hash, self.xs), map(hash, self.ys)))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Time the Vector2d special methods used for deduplication.
+
+Compares ``vector2d_v3.Vector2d`` with ``TupleVector2d``, which keeps the
+earlier ``__eq__``, ``__hash__``, ``__iter__`` and ``__bool__`` that
+built tuples and generators, or called ``hypot`` just to test for zero.
+
+Sample run::
+
+    $ ./vector2d_bench.py
+    operation      tuples   fields  speedup
+    eq              0.402    0.047     8.5x
+    hash            0.106    0.060     1.8x
+    iter            0.185    0.143     1.3x
+    bool            0.098    0.032     3.1x
+    dedup           0.692    0.184     3.8x
+
+Each time is the best of ``REPEAT`` runs over ``-n`` vectors, in seconds.
+``dedup`` builds a set from a list of vectors where each value appears
+twice, as distinct but equal objects.
+"""
+
+import argparse
+import math
+import time
+
+from vector2d_v3 import Vector2d
+
+REPEAT = 5
+
+
+class TupleVector2d(Vector2d):
+    """The special methods as they were before they compared fields."""
+
+    def __iter__(self):
+        return (i for i in (self.x, self.y))
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(self.x) ^ hash(self.y)
+
+    def __bool__(self):
+        return bool(abs(self))
+
+    def __abs__(self):
+        return math.hypot(self.x, self.y)
+
+
+def best_time(func):
+    best = float('inf')
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def workloads(cls, count):
+    # x ^ y hashes collide for grids like (i % 1000, i // 1000): avoid them
+    vectors = [cls(i, 2 * i + 1) for i in range(count)]
+    twins = [cls(v.x, v.y) for v in vectors]
+    return {
+        'eq': lambda: [a == b for a, b in zip(vectors, twins)],
+        'hash': lambda: list(map(hash, vectors)),
+        'iter': lambda: [tuple(v) for v in vectors],
+        'bool': lambda: list(map(bool, vectors)),
+        'dedup': lambda: set(vectors + twins),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=200_000,
+                        help='vectors per run (default=200000)')
+    args = parser.parse_args()
+
+    before = workloads(TupleVector2d, args.n)
+    after = workloads(Vector2d, args.n)
+    print(f'{"operation":12} {"tuples":>8} {"fields":>8} {"speedup":>8}')
+    for name in before:
+        old, new = best_time(before[name]), best_time(after[name])
+        print(f'{name:12} {old:8.3f} {new:8.3f} {old / new:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+A binary file format for many 2-dimensional vectors
+
+A 16-byte header is followed by the coordinates as packed machine floats
+``x0 y0 x1 y1 ...``, the same layout as ``bytes(Vector2d)`` without the
+typecode byte in front of each vector. The header fields are: magic
+``b'V2D'``, format version, typecode, byte order and vector count.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'vectors.v2d')
+    >>> vectors = (Vector2d(i, i * 2) for i in range(5))
+    >>> write_vectors(path, vectors)
+    5
+    >>> os.path.getsize(path) == HEADER.size + 5 * 16
+    True
+
+
+``MappedVectors`` maps the file to memory and reads nothing until an
+item is touched; items are built as ``Vector2d`` on demand:
+
+    >>> mv = MappedVectors(path)
+    >>> len(mv)
+    5
+    >>> mv[1], mv[-1]
+    (Vector2d(1.0, 2.0), Vector2d(4.0, 8.0))
+    >>> list(mv) == [Vector2d(i, i * 2) for i in range(5)]
+    True
+    >>> mv[5]
+    Traceback (most recent call last):
+      ...
+    IndexError: index out of bounds on dimension 1
+
+
+Slices are views of the same mapped memory, not copies:
+
+    >>> tail = mv[1::2]
+    >>> tail
+    MappedVectors('vectors.v2d', [(1.0, 2.0), (3.0, 6.0)])
+    >>> tail.xs.tolist(), tail.ys.tolist()
+    ([1.0, 3.0], [2.0, 6.0])
+
+
+``toarray()`` copies the coordinates into a ``Vector2dArray`` for bulk math:
+
+    >>> abs(mv[:2].toarray())  # doctest:+ELLIPSIS
+    array('d', [0.0, 2.236067...])
+    >>> del tail
+    >>> mv.close()
+
+
+Single precision halves the size; files are checked when opened:
+
+    >>> write_vectors(path, [(1.5, 2.5)], typecode='f')
+    1
+    >>> with MappedVectors(path) as mv:
+    ...     mv[0]
+    Vector2d(1.5, 2.5)
+    >>> with open(path, 'r+b') as fp:
+    ...     _ = fp.write(b'XYZ')
+    >>> MappedVectors(path)
+    Traceback (most recent call last):
+      ...
+    ValueError: not a vector file: 'vectors.v2d'
+    >>> open(path, 'wb').close()
+    >>> MappedVectors(path)
+    Traceback (most recent call last):
+      ...
+    ValueError: not a vector file: 'vectors.v2d'
+
+The size must match the count in the header, and every vector must have
+exactly 2 coordinates, even when the total would come out even:
+
+    >>> write_vectors(path, [(1, 2), (3, 4)])
+    2
+    >>> with open(path, 'r+b') as fp:
+    ...     fp.truncate(HEADER.size + 24)
+    40
+    >>> MappedVectors(path)
+    Traceback (most recent call last):
+      ...
+    ValueError: 'vectors.v2d' is truncated
+    >>> with open(path, 'ab') as fp:
+    ...     fp.write(bytes(16))
+    16
+    >>> MappedVectors(path)
+    Traceback (most recent call last):
+      ...
+    ValueError: 'vectors.v2d' has data after its 2 vectors
+    >>> write_vectors(path, [(1, 2, 3), (4,)])
+    Traceback (most recent call last):
+      ...
+    ValueError: vectors must have exactly 2 coordinates
+
+"""
+
+from array import array
+import itertools
+import mmap
+import os
+import reprlib
+import struct
+import sys
+
+from vector2d_v3 import Vector2d
+from vector2d_array import Vector2dArray
+
+MAGIC = b'V2D'
+VERSION = 1
+HEADER = struct.Struct('<3sBccxxQ')  # magic, version, typecode, byte order, count
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+CHUNK_SIZE = 64 * 1024  # vectors written per call to fp.write
+
+
+def write_vectors(path, vectors, typecode=Vector2d.typecode):
+    """Write vectors (or (x, y) pairs) to path in one pass; return the count.
+
+    Vectors are buffered ``CHUNK_SIZE`` at a time, so any iterable will do.
+    """
+    if typecode not in ('f', 'd'):
+        raise ValueError(f'typecode must be "f" or "d", not {typecode!r}')
+    count = 0
+    coords = _coords(vectors)
+    with open(path, 'wb') as fp:
+        fp.write(bytes(HEADER.size))  # count is not known until the end
+        while True:
+            chunk = array(typecode, itertools.islice(coords, 2 * CHUNK_SIZE))
+            if not chunk:
+                break
+            chunk.tofile(fp)
+            count += len(chunk) // 2
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, VERSION, typecode.encode(),
+                             BYTE_ORDER, count))
+    return count
+
+
+def _coords(vectors):
+    for vector in vectors:
+        try:
+            x, y = vector
+        except ValueError:  # too many or not enough values to unpack
+            msg = 'vectors must have exactly 2 coordinates'
+            raise ValueError(msg) from None
+        yield x
+        yield y
+
+
+class MappedVectors:
+    """A read-only sequence of Vector2d stored in a file written by
+    ``write_vectors``.
+
+    Opening maps the file; ``xs`` and ``ys`` are strided views of the
+    mapped floats. Close it (or use ``with``) after deleting any slices.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size < HEADER.size:  # or mmap fails
+                name = os.path.basename(self.path)
+                raise ValueError(f'not a vector file: {name!r}')
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            typecode, count = self._read_header()
+            memv = memoryview(self._mmap)[HEADER.size:]
+            coords = memv.cast(typecode)[:2 * count]
+        except BaseException:
+            self._mmap.close()
+            raise
+        self.xs = coords[0::2]
+        self.ys = coords[1::2]
+
+    def _read_header(self):
+        name = os.path.basename(self.path)
+        magic, version, typecode, byte_order, count = HEADER.unpack_from(
+            self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'not a vector file: {name!r}')
+        if version != VERSION:
+            raise ValueError(f'unsupported version {version} in {name!r}')
+        if byte_order != BYTE_ORDER:
+            raise ValueError(f'{name!r} was written on a machine with '
+                             'the other byte order')
+        typecode = typecode.decode()
+        itemsize = array(typecode).itemsize
+        size = HEADER.size + 2 * count * itemsize
+        if size > len(self._mmap):
+            raise ValueError(f'{name!r} is truncated')
+        if size < len(self._mmap):
+            raise ValueError(f'{name!r} has data after its {count} vectors')
+        return typecode, count
+
+    @classmethod
+    def _view(cls, parent, xs, ys):
+        view = cls.__new__(cls)
+        view.path = parent.path
+        view._mmap = None  # the parent owns the mapping
+        view.xs = xs
+        view.ys = ys
+        return view
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._view(self, self.xs[index], self.ys[index])
+        return Vector2d(self.xs[index], self.ys[index])
+
+    def __iter__(self):
+        return map(Vector2d, self.xs, self.ys)
+
+    def __repr__(self):
+        head = itertools.islice(zip(self.xs, self.ys), 7)  # reprlib shows 6
+        pairs = reprlib.repr(list(head))
+        name = os.path.basename(self.path)
+        return f'{type(self).__name__}({name!r}, {pairs})'
+
+    def toarray(self):
+        if self.xs.format == 'd':  # tobytes packs the strided view in C
+            return Vector2dArray.fromcolumns(array('d', self.xs.tobytes()),
+                                             array('d', self.ys.tobytes()))
+        return Vector2dArray.fromcolumns(self.xs, self.ys)
+
+    def close(self):
+        self.xs.release()
+        self.ys.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
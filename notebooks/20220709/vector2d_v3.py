@@ -83,6 +83,10 @@ Tests of hashing:
     (7, 384307168202284039)
     >>> len(set([v1, v2]))
     2
+    >>> v1 == (3, 4), v1 == Vector2d(3, 4.5), v1 != v2
+    (True, False, True)
+    >>> bool(Vector2d(0, -0.0)), bool(Vector2d(0, 1e-300))
+    (False, True)
 
 """
 
@@ -105,7 +109,8 @@ class Vector2d:
         return self.__y
 
     def __iter__(self):
-        return (i for i in (self.x, self.y))
+        yield self.__x  # one generator object, no tuple to wrap
+        yield self.__y
 
     def __repr__(self):
         class_name = type(self).__name__
@@ -119,22 +124,24 @@ class Vector2d:
                 bytes(array(self.typecode, self)))
 
     def __eq__(self, other):
+        if isinstance(other, Vector2d):  # compare fields, build no tuples
+            return self.__x == other.__x and self.__y == other.__y
         return tuple(self) == tuple(other)
 
     def __hash__(self):
-        return hash(self.x) ^ hash(self.y)
+        return hash(self.__x) ^ hash(self.__y)
 
     def __abs__(self):
-        return math.hypot(self.x, self.y)
+        return math.hypot(self.__x, self.__y)
 
     def __bool__(self):
-        return bool(abs(self))
+        return bool(self.__x or self.__y)  # nonzero iff abs(self) is
 
     def __len__(self):
         return 2
     
     def angle(self):
-        return math.atan2(self.y, self.x)
+        return math.atan2(self.__y, self.__x)
 
     def __format__(self, fmt_spec=''):
         if fmt_spec.endswith('p'):
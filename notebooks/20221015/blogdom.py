@@ -1,29 +1,62 @@
 #!/usr/bin/env python3
+
+"""Find which short domain names are taken.
+
+By default, probes ``<keyword>.dev`` for Python keywords up to
+``MAX_KEYWORD_LEN`` characters. Names can also come from a file, one
+per line. Taken names are marked ``+``, and names whose lookup failed
+``?``; the others look available::
+
+    $ ./blogdom.py
+    + def.dev
+    + for.dev
+      and.dev
+    ? try.dev
+    ...
+    $ ./blogdom.py -f names.txt --tld com -m 500
+"""
+
+import argparse
 import asyncio
-import socket
+from collections.abc import Iterable, Iterator
 from keyword import kwlist
 
+from domainlib import (DEFAULT_MAX_IN_FLIGHT, CachingResolver, multi_probe,
+                       read_domains, system_resolver)
+
 MAX_KEYWORD_LEN = 4  # limit length of keyword to use for our domain names
+MAX_LABEL_LEN = 63  # the longest DNS label
 
 
-async def probe(domain: str) -> tuple([str, bool]):  # returns a tuple with ddomain name and boolean
-    loop = asyncio.get_running_loop()  # retrieve a reference to the event loop
-    try:
-        await loop.getaddrinfo(domain, None)  # returns a 5-part tuple to connect to the given address using a socket.
-    except socket.gaierror:
-        return (domain, False)
-    return (domain, True)
+def candidates(names: Iterable[str], tld: str, max_len: int) -> Iterator[str]:
+    for name in names:  # a generator: a huge file is never all in memory
+        if len(name) <= max_len:
+            yield f'{name}.{tld}'.lower()
 
 
-async def main() -> None:  # must be a coroutine
-    names = (kw for kw in kwlist if len(kw) <= MAX_KEYWORD_LEN)  # Generator to yield Python keywords 
-    domains = (f'{name}.dev'.lower() for name in names)  # Generator to yield domain names
-    coros = [probe(domain) for domain in domains]  # Build a list of coroutine objects.
-    for coro in asyncio.as_completed(coros):  # asyncio.as_completed is a generator that yields coroutines in the order they are completed
-        domain, found = await coro  # await will not block, as the coroutines are completed.
-        mark = '+' if found else ' '
+async def main(domains: Iterable[str], max_in_flight: int) -> None:  # must be a coroutine
+    resolver = CachingResolver(system_resolver)  # repeated names resolve once
+    async for domain, found in multi_probe(domains, resolver, max_in_flight):
+        # results arrive as lookups complete; None means the lookup failed
+        mark = '?' if found is None else '+' if found else ' '
         print(f'{mark} {domain}')
 
 
 if __name__ == '__main__':
-    asyncio.run(main())  # starts the event loop
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-f', '--file', help='read names from this file')
+    parser.add_argument('--tld', default='dev',
+                        help='top level domain (default=dev)')
+    parser.add_argument('-l', '--max-len', type=int,
+                        help='longest name to try (default='
+                             f'{MAX_KEYWORD_LEN}, or {MAX_LABEL_LEN} with -f)')
+    parser.add_argument('-m', '--max-in-flight', type=int,
+                        default=DEFAULT_MAX_IN_FLIGHT,
+                        help='concurrent lookups '
+                             f'(default={DEFAULT_MAX_IN_FLIGHT})')
+    args = parser.parse_args()
+    names = read_domains(args.file) if args.file else kwlist
+    if args.max_len is None:
+        args.max_len = MAX_LABEL_LEN if args.file else MAX_KEYWORD_LEN
+    domains = candidates(names, args.tld, args.max_len)
+    asyncio.run(main(domains, args.max_in_flight))  # starts the event loop
@@ -0,0 +1,177 @@
+"""Probe many domain names concurrently, with a cache of DNS answers.
+
+``multi_probe`` takes names from any iterable or async iterable (such as
+``read_domains`` over a file), keeps at most ``max_in_flight`` lookups
+running, and yields each ``Result`` as soon as its lookup completes.
+``Result.found`` is None when the lookup failed, so the name may or may
+not be taken.
+
+The resolver is any coroutine function taking a domain and returning
+True if it resolves; ``system_resolver`` asks the OS with
+``getaddrinfo``. Wrap one in ``CachingResolver`` to remember answers::
+
+    resolver = CachingResolver(system_resolver, ttl=300, negative_ttl=60)
+    async for domain, found in multi_probe(names, resolver):
+        ...
+"""
+
+import asyncio
+import socket
+import time
+from collections import OrderedDict
+from collections.abc import (AsyncIterable, AsyncIterator, Awaitable,
+                             Callable, Iterable, Iterator)
+from pathlib import Path
+from typing import NamedTuple
+
+Resolver = Callable[[str], Awaitable[bool]]
+
+DEFAULT_MAX_IN_FLIGHT = 100
+NOT_FOUND_ERRORS = {socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', None)}
+
+
+class Result(NamedTuple):
+    domain: str
+    found: bool | None  # None: the lookup failed, no answer either way
+
+
+async def system_resolver(domain: str) -> bool:
+    """Does domain have an address? Ask the OS resolver.
+
+    Only "no such name" answers return False; other errors, like a
+    temporary failure of the DNS server, are raised.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.getaddrinfo(domain, None)
+    except socket.gaierror as exc:
+        if exc.errno in NOT_FOUND_ERRORS:
+            return False
+        raise
+    return True
+
+
+class CachingResolver:
+    """Remember the answers of a resolver for a while.
+
+    Names found are remembered for ``ttl`` seconds, names not found for
+    ``negative_ttl`` seconds. Errors are never cached. Concurrent lookups
+    of the same name share a single call to the resolver. If the caller
+    that started it is cancelled, the others start it again: one of them
+    makes a new call. At most ``maxsize`` answers are kept; the least
+    recently used go first.
+    """
+
+    def __init__(self, resolver: Resolver, ttl: float = 300,
+                 negative_ttl: float = 60, maxsize: int = 100_000,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.answers: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+        self.pending: dict[str, asyncio.Future[bool]] = {}
+        self.hits = self.misses = 0
+
+    async def __call__(self, domain: str) -> bool:
+        domain = domain.lower()
+        if (answer := self.answers.get(domain)) is not None:
+            found, expires = answer
+            if self.clock() < expires:
+                self.hits += 1
+                self.answers.move_to_end(domain)
+                return found
+            del self.answers[domain]
+        if (future := self.pending.get(domain)) is not None:
+            self.hits += 1
+            # unlike shield, wait raises only if this caller is cancelled
+            await asyncio.wait([future])
+            if future.cancelled():  # the owner was cancelled: retry
+                return await self(domain)
+            return future.result()
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[domain] = future
+        try:
+            found = await self.resolver(domain)
+        except asyncio.CancelledError:
+            future.cancel()  # not an answer: the waiters retry
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # retrieved: no warning if nobody waits
+            raise
+        else:
+            future.set_result(found)
+            self.store(domain, found)
+            return found
+        finally:
+            del self.pending[domain]
+
+    def store(self, domain: str, found: bool) -> None:
+        ttl = self.ttl if found else self.negative_ttl
+        self.answers[domain] = (found, self.clock() + ttl)
+        self.answers.move_to_end(domain)
+        while len(self.answers) > self.maxsize:
+            self.answers.popitem(last=False)
+
+
+async def probe(domain: str, resolver: Resolver = system_resolver) -> Result:
+    try:
+        return Result(domain, await resolver(domain))
+    except OSError:  # a lookup that failed is no evidence either way
+        return Result(domain, None)
+
+
+async def multi_probe(domains: Iterable[str] | AsyncIterable[str],
+                      resolver: Resolver = system_resolver,
+                      max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+                      ) -> AsyncIterator[Result]:
+    """Yield a Result for each domain, in the order lookups complete.
+
+    Names are taken from domains only as lookups finish, so domains can
+    be a huge file or an endless generator.
+    """
+    if max_in_flight < 1:
+        raise ValueError('max_in_flight must be >= 1')
+    source = aiter_domains(domains)
+    exhausted = False
+    pending: set[asyncio.Task[Result]] = set()
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    domain = await anext(source)
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.create_task(probe(domain, resolver)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:  # the consumer stopped early
+            task.cancel()
+
+
+async def aiter_domains(domains: Iterable[str] | AsyncIterable[str]
+                        ) -> AsyncIterator[str]:
+    if isinstance(domains, AsyncIterable):
+        async for domain in domains:
+            yield domain
+    else:
+        for domain in domains:
+            yield domain
+
+
+def read_domains(path: Path | str) -> Iterator[str]:
+    """Yield names from a file, one per line; skip blanks and # comments."""
+    with open(path) as fp:
+        for line in fp:
+            name = line.split('#', 1)[0].strip()
+            if name:
+                yield name
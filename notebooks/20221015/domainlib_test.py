@@ -0,0 +1,162 @@
+import asyncio
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+from pytest import raises
+
+from domainlib import (CachingResolver, Result, multi_probe, probe,
+                       read_domains)
+
+KNOWN = {'python.org', 'def.dev'}
+
+
+class StubResolver:
+    """Answers from KNOWN after a short delay; counts calls."""
+
+    def __init__(self, delay: float = 0.01) -> None:
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def __call__(self, domain: str) -> bool:
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if domain == 'flaky.dev':
+                raise OSError('temporary failure')
+            return domain in KNOWN
+        finally:
+            self.in_flight -= 1
+
+
+async def collect(aiterator: AsyncIterator[Result]) -> list[Result]:
+    return [result async for result in aiterator]
+
+
+def test_probe_reports_errors_as_unknown() -> None:
+    resolver = StubResolver()
+    assert asyncio.run(probe('def.dev', resolver)) == ('def.dev', True)
+    assert asyncio.run(probe('nope.dev', resolver)) == ('nope.dev', False)
+    assert asyncio.run(probe('flaky.dev', resolver)) == ('flaky.dev', None)
+
+
+def test_multi_probe_limits_in_flight() -> None:
+    resolver = StubResolver()
+    domains = (f'{n}.dev' for n in range(50))  # a generator, consumed lazily
+    results = asyncio.run(collect(multi_probe(domains, resolver, 7)))
+    assert len(results) == 50
+    assert resolver.peak == 7
+
+
+def test_multi_probe_streams_async_source() -> None:
+    async def names() -> AsyncIterator[str]:
+        for name in ['python.org', 'nope.dev', 'def.dev']:
+            yield name
+
+    results = asyncio.run(collect(multi_probe(names(), StubResolver())))
+    assert sorted(results) == [('def.dev', True), ('nope.dev', False),
+                               ('python.org', True)]
+
+
+def test_multi_probe_rejects_bad_limit() -> None:
+    with raises(ValueError):
+        asyncio.run(collect(multi_probe(['def.dev'], StubResolver(), 0)))
+
+
+def test_cache_ttl_and_negative_ttl() -> None:
+    now = 0.0
+    stub = StubResolver(delay=0)
+    resolver = CachingResolver(stub, ttl=100, negative_ttl=10,
+                               clock=lambda: now)
+
+    async def lookups() -> None:
+        nonlocal now
+        assert await resolver('def.dev') and not await resolver('x.dev')
+        assert await resolver('DEF.dev') and not await resolver('x.dev')
+        assert stub.calls == 2
+        now = 50  # negative answer expired, positive one still good
+        await resolver('def.dev')
+        await resolver('x.dev')
+        assert stub.calls == 3
+
+    asyncio.run(lookups())
+    assert (resolver.hits, resolver.misses) == (3, 3)
+
+
+def test_cache_shares_concurrent_lookups_and_skips_errors() -> None:
+    stub = StubResolver()
+    resolver = CachingResolver(stub)
+    domains = ['def.dev'] * 10 + ['flaky.dev'] * 2
+    results = asyncio.run(collect(multi_probe(domains, resolver)))
+    assert results.count(('def.dev', True)) == 10
+    assert stub.calls == 2  # one for def.dev, one shared by both flaky.dev
+    assert 'flaky.dev' not in resolver.answers
+
+
+def test_cache_retries_when_first_caller_is_cancelled() -> None:
+    stub = StubResolver(delay=0.05)
+    resolver = CachingResolver(stub)
+
+    async def lookups() -> list[bool]:
+        first = asyncio.create_task(resolver('def.dev'))
+        await asyncio.sleep(0)  # first owns the lookup
+        others = [asyncio.create_task(resolver('def.dev')) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with raises(asyncio.CancelledError):
+            await first
+        return await asyncio.gather(*others)
+
+    assert asyncio.run(lookups()) == [True, True, True]
+    assert stub.calls == 2  # the first call, then one retry for all others
+
+
+def test_cache_cancelled_waiter_leaves_lookup_running() -> None:
+    stub = StubResolver(delay=0.05)
+    resolver = CachingResolver(stub)
+
+    async def lookups() -> bool:
+        owner = asyncio.create_task(resolver('def.dev'))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(resolver('def.dev'))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(lookups())
+    assert stub.calls == 1
+
+
+def test_multi_probe_survives_cancelled_lookup() -> None:
+    stub = StubResolver(delay=0.05)
+    resolver = CachingResolver(stub)
+
+    async def lookups() -> list[Result]:
+        owner = asyncio.create_task(resolver('def.dev'))
+        await asyncio.sleep(0)
+        asyncio.get_running_loop().call_later(0.01, owner.cancel)
+        return await collect(multi_probe(['def.dev', 'def.dev'], resolver))
+
+    assert asyncio.run(lookups()) == [('def.dev', True)] * 2
+
+
+def test_cache_evicts_least_recently_used() -> None:
+    resolver = CachingResolver(StubResolver(delay=0), maxsize=2)
+
+    async def lookups() -> None:
+        for domain in ['a.dev', 'b.dev', 'a.dev', 'c.dev']:
+            await resolver(domain)
+
+    asyncio.run(lookups())
+    assert list(resolver.answers) == ['a.dev', 'c.dev']
+
+
+def test_read_domains(tmp_path: Path) -> None:
+    path = tmp_path / 'names.txt'
+    path.write_text('# candidates\ndef.dev\n\n  python.org  # taken\n')
+    assert list(read_domains(path)) == ['def.dev', 'python.org']
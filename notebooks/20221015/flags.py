@@ -18,11 +18,14 @@ Sample runs (first with new domain, so no caching ever)::
 
 # tag::FLAGS_PY[]
 import time
+from http import HTTPStatus
 from pathlib import Path
 from typing import Callable
 
 import httpx  # <1>
 
+from flags2_common import FlagCache, make_sync_client
+
 POP20_CC = ('CN IN US ID BR PK NG BD RU JP '
             'MX PH VN ET EG DE IR TR CD FR').split()  # <2>
 
@@ -32,18 +35,33 @@ DEST_DIR = Path('downloaded')                         # <4>
 def save_flag(img: bytes, filename: str) -> None:     # <5>
     (DEST_DIR / filename).write_bytes(img)
 
-def get_flag(cc: str) -> bytes:  # <6>
+def get_flag(client: httpx.Client,
+             cc: str,
+             headers: dict[str, str] | None = None) -> httpx.Response:  # <6>
     url = f'{BASE_URL}/{cc}/{cc}.gif'.lower()
-    resp = httpx.get(url, timeout=6.1,       # <7>
-                     follow_redirects=True)  # <8>
-    resp.raise_for_status()  # <9>
-    return resp.content
+    resp = client.get(url, headers=headers, timeout=6.1,       # <7>
+                      follow_redirects=True)  # <8>
+    if resp.status_code != HTTPStatus.NOT_MODIFIED:
+        resp.raise_for_status()  # <9>
+    return resp
 
 def download_many(cc_list: list[str]) -> int:  # <10>
-    for cc in sorted(cc_list):                 # <11>
-        image = get_flag(cc)
-        save_flag(image, f'{cc}.gif')
-        print(cc, end=' ', flush=True)         # <12>
+    cache = FlagCache(DEST_DIR)
+    # one keep-alive connection reused for every flag
+    with make_sync_client() as client:
+        try:
+            for cc in sorted(cc_list):                 # <11>
+                url = f'{BASE_URL}/{cc}/{cc}.gif'.lower()
+                headers = cache.validators(url)
+                if headers is not None:  # None: complete, nothing to revalidate
+                    resp = get_flag(client, cc, headers)
+                    if resp.status_code != HTTPStatus.NOT_MODIFIED:
+                        save_flag(resp.content, f'{cc}.gif')
+                        cache.store(url, f'{cc}.gif', resp.content,
+                                    resp.headers)
+                print(cc, end=' ', flush=True)         # <12>
+        finally:
+            cache.save()
     return len(cc_list)
 
 def main(downloader: Callable[[list[str]], int]) -> None:  # <13>
@@ -14,7 +14,10 @@ from pathlib import Path
 import httpx
 import tqdm  # type: ignore
 
-from flags2_common import main, DownloadStatus, save_flag
+from flags2_common import (main, AdaptiveLimiter, CircuitOpenError,
+                           Download, DownloadStatus, FlagCache, MemoryBudget,
+                           RequestMetrics, RetryPolicy, flag_url, limited,
+                           make_client, stream_flag)
 
 # low concurrency default to avoid errors from remote site,
 # such as 503 - Service Temporarily Unavailable
@@ -23,51 +26,96 @@ MAX_CONCUR_REQ = 1000
 
 async def get_flag(client: httpx.AsyncClient,  # <1>
                    base_url: str,
-                   cc: str) -> bytes:
-    url = f'{base_url}/{cc}/{cc}.gif'.lower()
-    resp = await client.get(url, timeout=3.1, follow_redirects=True)   # <2>
-    resp.raise_for_status()
-    return resp.content
+                   cc: str,
+                   headers: dict[str, str] | None,
+                   budget: MemoryBudget) -> Download:
+    url = flag_url(base_url, cc)
+    return await stream_flag(client, url, headers, budget)  # <2>
 
 async def download_one(client: httpx.AsyncClient,
                        cc: str,
                        base_url: str,
-                       semaphore: asyncio.Semaphore,
-                       verbose: bool) -> DownloadStatus:
+                       limiter: AdaptiveLimiter,
+                       verbose: bool,
+                       cache: FlagCache | None,
+                       retry: RetryPolicy,
+                       budget: MemoryBudget) -> DownloadStatus:
+    url = flag_url(base_url, cc)
+    headers = cache.validators(url) if cache else {}
+    if cache and cache.not_found(url):
+        status = DownloadStatus.NOT_FOUND
+        msg = f'not found (cached): {url}'
+    elif headers is None:  # complete, and nothing to revalidate it with
+        status = DownloadStatus.CACHED
+        msg = 'cached'
+    else:
+        status, msg = await fetch_one(client, cc, base_url, limiter,
+                                      headers, cache, retry, budget)
+    if verbose and msg:
+        print(cc, msg)
+    return status
+
+async def fetch_one(client: httpx.AsyncClient,
+                    cc: str,
+                    base_url: str,
+                    limiter: AdaptiveLimiter,
+                    headers: dict[str, str],
+                    cache: FlagCache | None,
+                    retry: RetryPolicy,
+                    budget: MemoryBudget) -> tuple[DownloadStatus, str]:
+    url = flag_url(base_url, cc)
     try:
-        async with semaphore:  # <3>
-            image = await get_flag(client, base_url, cc)
+        download, retries = await retry.call(url, lambda: limited(  # <3>
+            limiter, get_flag(client, base_url, cc, headers, budget)))
+    except CircuitOpenError:
+        return DownloadStatus.CIRCUIT_OPEN, 'skipped: circuit breaker open'
     except httpx.HTTPStatusError as exc:  # <4>
         res = exc.response
         if res.status_code == HTTPStatus.NOT_FOUND:
-            status = DownloadStatus.NOT_FOUND
-            msg = f'not found: {res.url}'
+            if cache:
+                cache.store_not_found(url)
+            return DownloadStatus.NOT_FOUND, f'not found: {res.url}'
         else:
             raise
-    else:
-        await asyncio.to_thread(save_flag, image, f'{cc}.gif')  # <5>
-        status = DownloadStatus.OK
-        msg = 'OK'
-    if verbose and msg:
-        print(cc, msg)
-    return status
+    if download.status_code == HTTPStatus.NOT_MODIFIED:
+        return DownloadStatus.CACHED, 'not modified'
+    filename = f'{cc}.gif'
+    download.save(filename)  # <5>
+    if cache:
+        cache.store_digest(url, filename, download.size, download.sha256,
+                           download.headers)
+    if retries:
+        return DownloadStatus.RETRIED, f'OK after {retries} retries'
+    return DownloadStatus.OK, 'OK'
 # end::FLAGS2_ASYNCIO_TOP[]
 
 # tag::FLAGS2_ASYNCIO_START[]
 async def supervisor(cc_list: list[str],
                      base_url: str,
                      verbose: bool,
-                     concur_req: int) -> Counter[DownloadStatus]:  # <1>
+                     concur_req: int,
+                     cache: FlagCache | None = None,
+                     limiter: AdaptiveLimiter | None = None,
+                     retry: RetryPolicy | None = None,
+                     budget: MemoryBudget | None = None,
+                     metrics: RequestMetrics | None = None,
+                     http2: bool = False
+                     ) -> Counter[DownloadStatus]:  # <1>
     counter: Counter[DownloadStatus] = Counter()
-    semaphore = asyncio.Semaphore(concur_req)  # <2>
-    async with httpx.AsyncClient() as client:
-        to_do = [download_one(client, cc, base_url, semaphore, verbose)
+    if limiter is None:  # fixed limit, like a semaphore
+        limiter = AdaptiveLimiter(concur_req, concur_req)  # <2>
+    budget = budget or MemoryBudget()
+    retry = retry or RetryPolicy()  # one for all flags: shared breakers
+    # one pooled connection for each request the limiter may allow
+    async with make_client(limiter.maximum, http2, metrics) as client:
+        to_do = [download_one(client, cc, base_url, limiter, verbose,
+                              cache, retry, budget)
                  for cc in sorted(cc_list)]  # <3>
         to_do_iter = asyncio.as_completed(to_do)  # <4>
         if not verbose:
             to_do_iter = tqdm.tqdm(to_do_iter, total=len(cc_list))  # <5>
-        error: httpx.HTTPError | None = None  # <6>
         for coro in to_do_iter:  # <7>
+            error: httpx.HTTPError | None = None  # <6>
             try:
                 status = await coro  # <8>
             except httpx.HTTPStatusError as exc:
@@ -87,14 +135,25 @@ async def supervisor(cc_list: list[str],
                     cc = Path(url).stem.upper()   # <13>
                     print(f'{cc} error: {error_msg}')
             counter[status] += 1
+            if not verbose:
+                to_do_iter.set_postfix(limit=limiter.current)
 
     return counter
 
 def download_many(cc_list: list[str],
                   base_url: str,
                   verbose: bool,
-                  concur_req: int) -> Counter[DownloadStatus]:
-    coro = supervisor(cc_list, base_url, verbose, concur_req)
+                  concur_req: int,
+                  *,
+                  cache: FlagCache | None = None,
+                  limiter: AdaptiveLimiter | None = None,
+                  retry: RetryPolicy | None = None,
+                  budget: MemoryBudget | None = None,
+                  metrics: RequestMetrics | None = None,
+                  http2: bool = False
+                  ) -> Counter[DownloadStatus]:
+    coro = supervisor(cc_list, base_url, verbose, concur_req,
+                      cache, limiter, retry, budget, metrics, http2)
     counts = asyncio.run(coro)  # <14>
 
     return counts
@@ -2,14 +2,34 @@
 """
 
 import argparse
+import asyncio
+import hashlib
+import importlib.util
+import json
+import math
+import os
+import random
 import string
 import sys
 import time
-from collections import Counter
+from collections import Counter, deque
+from concurrent import futures
+from collections.abc import (AsyncIterator, Awaitable, Callable, Iterator,
+                             Mapping)
+from contextlib import ExitStack, asynccontextmanager, redirect_stderr
+from dataclasses import dataclass, field, replace
 from enum import Enum
+from http import HTTPStatus
 from pathlib import Path
+from typing import TypeVar
 
-DownloadStatus = Enum('DownloadStatus', 'OK NOT_FOUND ERROR')
+import httpx
+import tqdm  # type: ignore
+
+DownloadStatus = Enum('DownloadStatus',
+                      'OK NOT_FOUND ERROR CACHED RETRIED CIRCUIT_OPEN')
+
+T = TypeVar('T')
 
 POP20_CC = ('CN IN US ID BR PK NG BD RU JP '
             'MX PH VN ET EG DE IR TR CD FR').split()
@@ -27,12 +47,1013 @@ DEFAULT_SERVER = 'LOCAL'
 
 DEST_DIR = Path('downloaded')
 COUNTRY_CODES_FILE = Path('country_codes.txt')
+CACHE_INDEX_NAME = '.cache-index.json'
+CACHE_SAVE_EVERY = 20  # index updates between saves, so a crash loses few
+KEEPALIVE_EXPIRY = 5.0  # seconds an idle pooled connection is kept open
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_MEMORY_BUDGET = 16  # MiB of response bodies buffered at once
+LATENCY_LOG_VAR = 'FLAGS_LATENCY_LOG'  # see make_client
+
+
+def share(total: int, parts: int, index: int) -> int:
+    """Size of part index when total is split as evenly as possible."""
+    return total // parts + (index < total % parts)
+
+
+def client_limits(max_req: int) -> httpx.Limits:
+    """Pool limits for at most max_req concurrent requests.
+
+    Every request in flight can have its own connection, and all of them
+    stay open for reuse until idle for ``KEEPALIVE_EXPIRY`` seconds.
+    """
+    return httpx.Limits(max_connections=max_req,
+                        max_keepalive_connections=max_req,
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+def make_client(max_req: int, http2: bool = False,
+                metrics: 'RequestMetrics | None' = None) -> httpx.AsyncClient:
+    """Shared client for the asyncio downloaders.
+
+    With http2=True, requests to an HTTP/2 server are multiplexed over
+    fewer connections; that needs the ``h2`` package. With metrics, the
+    timing of every request is recorded there. If the environment
+    variable named by ``LATENCY_LOG_VAR`` is set, the latency of each
+    request is appended to the file it names.
+    """
+    transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(
+        limits=client_limits(max_req), http2=http2)
+    if metrics is not None:
+        transport = AsyncMetricsTransport(transport, metrics)
+    if log_path := os.environ.get(LATENCY_LOG_VAR):
+        transport = AsyncLatencyLogTransport(transport, log_path)
+    return httpx.AsyncClient(transport=transport)
+
+
+def make_sync_client(max_req: int = 1, http2: bool = False,
+                     metrics: 'RequestMetrics | None' = None) -> httpx.Client:
+    """Shared client for the sequential, threaded and process downloaders."""
+    transport: httpx.BaseTransport = httpx.HTTPTransport(
+        limits=client_limits(max_req), http2=http2)
+    if metrics is not None:
+        transport = MetricsTransport(transport, metrics)
+    if log_path := os.environ.get(LATENCY_LOG_VAR):
+        transport = LatencyLogTransport(transport, log_path)
+    return httpx.Client(transport=transport)
+
+
+def log_latency(log_path: str, started: float) -> None:
+    # one short write in append mode: safe with many processes
+    with open(log_path, 'a') as fp:
+        fp.write(f'{time.perf_counter() - started:.6f}\n')
+
+
+# Called when a response is closed, with the bytes read and the seconds
+# spent waiting for them
+OnClose = Callable[[int, float], None]
+
+
+class MeasuredStream(httpx.SyncByteStream):
+    """Response body that reports its size and read time when closed."""
+
+    def __init__(self, response: httpx.Response, on_close: OnClose) -> None:
+        self.response = response
+        self.on_close = on_close
+        self.nbytes = 0
+        self.read_time = 0.0
+
+    def __iter__(self) -> Iterator[bytes]:
+        chunks = iter(self.response.stream)  # type: ignore[arg-type]
+        while True:
+            t0 = time.perf_counter()
+            chunk = next(chunks, None)
+            self.read_time += time.perf_counter() - t0
+            if chunk is None:
+                return
+            self.nbytes += len(chunk)
+            yield chunk
+
+    def close(self) -> None:
+        self.response.close()
+        self.on_close(self.nbytes, self.read_time)
+
+
+class AsyncMeasuredStream(httpx.AsyncByteStream):
+    """Async version of MeasuredStream."""
+
+    def __init__(self, response: httpx.Response, on_close: OnClose) -> None:
+        self.response = response
+        self.on_close = on_close
+        self.nbytes = 0
+        self.read_time = 0.0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        chunks = aiter(self.response.stream)  # type: ignore[arg-type]
+        while True:
+            t0 = time.perf_counter()
+            chunk = await anext(chunks, None)
+            self.read_time += time.perf_counter() - t0
+            if chunk is None:
+                return
+            self.nbytes += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+        self.on_close(self.nbytes, self.read_time)
+
+
+def measured(response: httpx.Response,
+             stream: httpx.SyncByteStream | httpx.AsyncByteStream
+             ) -> httpx.Response:
+    return httpx.Response(response.status_code, headers=response.headers,
+                          stream=stream, extensions=response.extensions)
+
+
+class LatencyLogTransport(httpx.BaseTransport):
+    """Log the time from sending each request to closing its response."""
+
+    def __init__(self, transport: httpx.BaseTransport, log_path: str) -> None:
+        self.transport = transport
+        self.log_path = log_path
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        return measured(response, MeasuredStream(
+            response, lambda *_: log_latency(self.log_path, started)))
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncLatencyLogTransport(httpx.AsyncBaseTransport):
+    """Async version of LatencyLogTransport."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport,
+                 log_path: str) -> None:
+        self.transport = transport
+        self.log_path = log_path
+
+    async def handle_async_request(self,
+                                   request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        return measured(response, AsyncMeasuredStream(
+            response, lambda *_: log_latency(self.log_path, started)))
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class Histogram:
+    """Log-linear histogram of durations, after HdrHistogram.
+
+    Durations are counted in whole microseconds. Below
+    ``2**SUB_BUCKET_BITS`` each value has its own bucket; above that every
+    power of two is split in ``2**(SUB_BUCKET_BITS - 1)`` equal buckets, so
+    a bucket is never wider than about 3% of the values in it. Buckets
+    are kept in a dict, so recording is one dict update and memory grows
+    with the spread of the values, not their number.
+    """
+
+    SUB_BUCKET_BITS = 6
+
+    def __init__(self) -> None:
+        self.counts: Counter[int] = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    @classmethod
+    def bucket(cls, micros: int) -> int:
+        bits = cls.SUB_BUCKET_BITS
+        if micros < 1 << bits:
+            return micros
+        shift = micros.bit_length() - bits
+        return (micros >> shift) + (shift << (bits - 1))
+
+    @classmethod
+    def bucket_range(cls, index: int) -> tuple[int, int]:
+        """Lowest value in bucket index, and lowest value in the next one."""
+        bits = cls.SUB_BUCKET_BITS
+        if index < 1 << bits:
+            return index, index + 1
+        shift = (index >> (bits - 1)) - 1
+        mantissa = index - (shift << (bits - 1))
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, seconds: float) -> None:
+        self.counts[self.bucket(int(seconds * 1_000_000))] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: 'Histogram') -> None:
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct: float) -> float:
+        """Seconds at or below which pct percent of the values fall."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                _, upper = self.bucket_range(index)
+                return min((upper - 1) / 1_000_000, self.max)
+        return self.max
+
+    def count_below(self, seconds: float) -> int:
+        """Values recorded in buckets entirely at or below seconds."""
+        limit = seconds * 1_000_000
+        return sum(n for index, n in self.counts.items()
+                   if self.bucket_range(index)[1] - 1 <= limit)
+
+    def summary(self) -> dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class RequestMetrics:
+    """Timing, size and status of every request sent by a client.
+
+    Each request is split in phases, all in seconds:
+
+    - ``pool``: waiting for a connection from the pool
+    - ``connect``: opening a new connection, including DNS lookup and TLS
+      (httpcore resolves the name inside its TCP connect, so DNS time is
+      not measured apart)
+    - ``ttfb``: from sending the request to receiving the response headers
+    - ``body``: waiting for the network while reading the body
+    - ``write``: the rest of the body time, spent by the downloader
+      between chunks, mostly writing to disk
+    - ``total``: from sending the request to closing the response
+    """
+
+    PHASES = ('pool', 'connect', 'ttfb', 'body', 'write', 'total')
+    PROMETHEUS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                          1, 2.5, 5, 10)
+
+    def __init__(self) -> None:
+        self.phases = {phase: Histogram() for phase in self.PHASES}
+        self.statuses: Counter[str] = Counter()
+        self.bytes = 0
+        self.requests: dict[str, dict] = {}  # by URL, the last request
+
+    def record(self, url: str, status: int, marks: dict[str, float],
+               nbytes: int, read_time: float) -> None:
+        """Record a request from the trace marks taken while sending it.
+
+        marks has perf_counter times for 'start', 'headers' (response
+        headers received) and 'closed', plus the httpcore trace events
+        seen, by name without prefix, like 'connect_tcp.started'.
+        """
+        first_event = min(marks.get('connect_tcp.started', math.inf),
+                          marks.get('send_request_headers.started', math.inf),
+                          marks['headers'])
+        sent = marks.get('send_request_headers.started', first_event)
+        connect_end = marks.get('start_tls.complete',
+                                marks.get('connect_tcp.complete'))
+        phases = {
+            'pool': first_event - marks['start'],
+            'ttfb': marks['headers'] - sent,
+            'body': read_time,
+            'write': max(0.0, marks['closed'] - marks['headers'] - read_time),
+            'total': marks['closed'] - marks['start'],
+        }
+        if connect_end is not None:
+            phases['connect'] = connect_end - marks['connect_tcp.started']
+        for phase, seconds in phases.items():
+            self.phases[phase].record(seconds)
+        self.statuses[str(status)] += 1
+        self.bytes += nbytes
+        self.requests[url] = {'status': status, 'bytes': nbytes,
+                              'seconds': round(phases['total'], 6)}
+
+    def join(self, parts: list['RequestMetrics']) -> None:
+        """Add the metrics collected by other processes."""
+        for part in parts:
+            for phase, hist in part.phases.items():
+                self.phases[phase].merge(hist)
+            self.statuses.update(part.statuses)
+            self.bytes += part.bytes
+            self.requests.update(part.requests)
+
+    def record_error(self, url: str, exc: Exception) -> None:
+        status = type(exc).__name__
+        self.statuses[status] += 1
+        self.requests[url] = {'status': status, 'bytes': 0}
+
+    def tracer(self, marks: dict[str, float]) -> Callable[[str, dict], None]:
+        def trace(name: str, info: dict) -> None:
+            # 'http11.send_request_headers.started' -> 'send_request_...'
+            marks.setdefault(name.partition('.')[2], time.perf_counter())
+        return trace
+
+    def async_tracer(self, marks: dict[str, float]
+                     ) -> Callable[[str, dict], Awaitable[None]]:
+        trace = self.tracer(marks)
+
+        async def atrace(name: str, info: dict) -> None:
+            trace(name, info)
+        return atrace
+
+    def summary(self) -> dict:
+        return {
+            'phases': {phase: hist.summary()
+                       for phase, hist in self.phases.items()},
+            'statuses': dict(self.statuses),
+            'bytes': self.bytes,
+            'requests': self.requests,
+        }
+
+    def save_json(self, path: Path) -> None:
+        path.write_text(json.dumps(self.summary(), indent=1))
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        name = 'flags_request_phase_seconds'
+        lines = [f'# HELP {name} Time spent in each phase of a request.',
+                 f'# TYPE {name} histogram']
+        for phase, hist in self.phases.items():
+            for le in self.PROMETHEUS_BUCKETS:
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{le}"}} '
+                             f'{hist.count_below(le)}')
+            lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} '
+                         f'{hist.count}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {hist.total:.6f}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {hist.count}')
+        lines += ['# HELP flags_responses_total Responses by HTTP status '
+                  'or error type.',
+                  '# TYPE flags_responses_total counter']
+        for status, count in sorted(self.statuses.items()):
+            lines.append(f'flags_responses_total{{status="{status}"}} {count}')
+        lines += ['# HELP flags_response_bytes_total Bytes of response '
+                  'bodies read.',
+                  '# TYPE flags_response_bytes_total counter',
+                  f'flags_response_bytes_total {self.bytes}']
+        return '\n'.join(lines) + '\n'
+
+    def save_prometheus(self, path: Path) -> None:
+        path.write_text(self.prometheus())
+
+
+class MetricsTransport(httpx.BaseTransport):
+    """Record the phases of every request in a RequestMetrics."""
+
+    def __init__(self, transport: httpx.BaseTransport,
+                 metrics: RequestMetrics) -> None:
+        self.transport = transport
+        self.metrics = metrics
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        marks = {'start': time.perf_counter()}
+        request.extensions['trace'] = self.metrics.tracer(marks)
+        try:
+            response = self.transport.handle_request(request)
+        except httpx.TransportError as exc:
+            self.metrics.record_error(str(request.url), exc)
+            raise
+        marks['headers'] = time.perf_counter()
+
+        def on_close(nbytes: int, read_time: float) -> None:
+            marks['closed'] = time.perf_counter()
+            self.metrics.record(str(request.url), response.status_code,
+                                marks, nbytes, read_time)
+        return measured(response, MeasuredStream(response, on_close))
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncMetricsTransport(httpx.AsyncBaseTransport):
+    """Async version of MetricsTransport."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport,
+                 metrics: RequestMetrics) -> None:
+        self.transport = transport
+        self.metrics = metrics
+
+    async def handle_async_request(self,
+                                   request: httpx.Request) -> httpx.Response:
+        marks = {'start': time.perf_counter()}
+        request.extensions['trace'] = self.metrics.async_tracer(marks)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError as exc:
+            self.metrics.record_error(str(request.url), exc)
+            raise
+        marks['headers'] = time.perf_counter()
+
+        def on_close(nbytes: int, read_time: float) -> None:
+            marks['closed'] = time.perf_counter()
+            self.metrics.record(str(request.url), response.status_code,
+                                marks, nbytes, read_time)
+        return measured(response, AsyncMeasuredStream(response, on_close))
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def flag_url(base_url: str, cc: str) -> str:
+    return f'{base_url}/{cc}/{cc}.gif'.lower()
 
 
 def save_flag(img: bytes, filename: str) -> None:
     (DEST_DIR / filename).write_bytes(img)
 
 
+class MemoryBudget:
+    """Bound the bytes of response bodies held in memory at once.
+
+    Each streaming download reserves one chunk before its request is sent,
+    so when the budget is spent new requests wait, however high the
+    concurrency limit is. A single reservation larger than the whole
+    budget is allowed when nothing else is reserved.
+    """
+
+    def __init__(self, limit: int = DEFAULT_MEMORY_BUDGET * 2**20) -> None:
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self._changed = asyncio.Condition()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['_changed']  # may be bound to an event loop
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._changed = asyncio.Condition()
+
+    def split(self, parts: int) -> list['MemoryBudget']:
+        """Budgets for parts processes sharing this one."""
+        return [MemoryBudget(share(self.limit, parts, i))
+                for i in range(parts)]
+
+    def join(self, parts: list['MemoryBudget']) -> None:
+        """Take the totals of budgets returned by split, after use."""
+        self.peak = sum(part.peak for part in parts)
+        self.waits = sum(part.waits for part in parts)
+
+    def _fits(self, size: int) -> bool:
+        return self.used == 0 or self.used + size <= self.limit
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        async with self._changed:
+            if not self._fits(size):
+                self.waits += 1
+                await self._changed.wait_for(lambda: self._fits(size))
+            self.used += size
+            self.peak = max(self.peak, self.used)
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.used -= size
+                self._changed.notify_all()
+
+
+@dataclass
+class Download:
+    """Response whose body was streamed to a temporary file in DEST_DIR.
+
+    ``temp`` is None when there is no body to keep, as in a 304 response.
+    ``save`` renames the file into place, so a flag is never seen half
+    written; ``discard`` removes it.
+    """
+    response: httpx.Response
+    temp: Path | None = None
+    size: int = 0
+    sha256: str = ''
+
+    @property
+    def status_code(self) -> int:
+        return self.response.status_code
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.response.headers
+
+    def save(self, filename: str) -> None:
+        assert self.temp is not None, 'nothing to save'
+        os.replace(self.temp, DEST_DIR / filename)
+        self.temp = None
+
+    def discard(self) -> None:
+        if self.temp is not None:
+            self.temp.unlink(missing_ok=True)
+            self.temp = None
+
+
+async def stream_flag(client: httpx.AsyncClient,
+                      url: str,
+                      headers: dict[str, str] | None,
+                      budget: MemoryBudget) -> Download:
+    """GET url, writing the body to a temp file one chunk at a time.
+
+    Raise HTTPStatusError for error responses other than 304, like
+    ``raise_for_status``. On any error the temp file is removed. The file
+    is opened, written and hashed in a worker thread, so a slow disk does
+    not stall the other downloads in the event loop.
+    """
+    async with budget.reserve(STREAM_CHUNK_SIZE):
+        request = client.build_request('GET', url, headers=headers,
+                                       timeout=3.1)
+        resp = await client.send(request, stream=True, follow_redirects=True)
+        try:
+            if resp.status_code == HTTPStatus.NOT_MODIFIED:
+                return Download(resp)
+            resp.raise_for_status()
+            temp = DEST_DIR / f'.{Path(url).name}.part'
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                fp = await asyncio.to_thread(open, temp, 'wb')
+                def write(chunk: bytes) -> None:
+                    fp.write(chunk)
+                    digest.update(chunk)  # releases the GIL for big chunks
+                try:
+                    async for chunk in resp.aiter_bytes(STREAM_CHUNK_SIZE):
+                        await asyncio.to_thread(write, chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(fp.close)
+            except BaseException:
+                temp.unlink(missing_ok=True)
+                raise
+            return Download(resp, temp, size, digest.hexdigest())
+        finally:
+            await resp.aclose()
+
+
+class FlagCache:
+    """Index of downloaded flags, saved as JSON in the destination directory.
+
+    Each URL maps to the file name, size, modification time and SHA-256 of
+    the flag saved from it, plus the ``ETag`` and ``Last-Modified`` headers
+    of the response.
+    URLs that returned 404 are recorded too, so an interrupted run can be
+    repeated without asking for them again.
+    """
+
+    def __init__(self, dest_dir: Path = DEST_DIR,
+                 autosave: bool = True) -> None:
+        self.dest_dir = dest_dir
+        self.autosave = autosave
+        self.changes: dict[str, dict] = {}  # entries updated by this run
+        self.path = dest_dir / CACHE_INDEX_NAME
+        try:
+            self.index: dict[str, dict] = json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            self.index = {}
+        self.unsaved = 0
+
+    def complete(self, url: str) -> bool:
+        """Is the file saved from url still as it was downloaded?
+
+        Compare the size and modification time recorded when it was stored:
+        one ``stat`` instead of reading and hashing the file, because this
+        runs in the event loop once per flag.
+        """
+        entry = self.index.get(url)
+        if not entry or 'filename' not in entry:
+            return False
+        try:
+            stat = (self.dest_dir / entry['filename']).stat()
+        except FileNotFoundError:
+            return False
+        return (stat.st_size == entry['size'] and
+                stat.st_mtime_ns == entry.get('mtime_ns'))
+
+    def not_found(self, url: str) -> bool:
+        return self.index.get(url, {}).get('not_found', False)
+
+    def validators(self, url: str) -> dict[str, str] | None:
+        """Headers for a conditional GET of url.
+
+        Return None if the flag is complete and the server sent no
+        validators, so there is nothing to ask: it need not be downloaded.
+        """
+        if not self.complete(url):
+            return {}
+        entry = self.index[url]
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers or None
+
+    def store(self, url: str, filename: str, content: bytes,
+              headers: Mapping[str, str]) -> None:
+        self.store_digest(url, filename, len(content),
+                          hashlib.sha256(content).hexdigest(), headers)
+
+    def store_digest(self, url: str, filename: str, size: int, sha256: str,
+                     headers: Mapping[str, str]) -> None:
+        """Like store, for a file whose content is no longer in memory."""
+        try:
+            mtime_ns = (self.dest_dir / filename).stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None  # not saved: never complete
+        self._update(url, {
+            'filename': filename,
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'sha256': sha256,
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+        })
+
+    def store_not_found(self, url: str) -> None:
+        self._update(url, {'not_found': True})
+
+    def filename(self, url: str) -> str | None:
+        """Name of the file saved from url, if any."""
+        return self.index.get(url, {}).get('filename')
+
+    def metadata(self, url: str) -> dict | None:
+        """JSON document fetched from url in an earlier run, if any."""
+        return self.index.get(url, {}).get('metadata')
+
+    def store_metadata(self, url: str, metadata: dict) -> None:
+        self._update(url, {'metadata': metadata})
+
+    def _update(self, url: str, entry: dict) -> None:
+        self.index[url] = entry
+        self.changes[url] = entry
+        self.unsaved += 1
+        if self.autosave and self.unsaved >= CACHE_SAVE_EVERY:
+            self.save()
+
+    def detached(self) -> 'FlagCache':
+        """Copy for another process, which must not write the index.
+
+        Its ``changes`` are for ``merge`` in this process.
+        """
+        self.save()  # the copy loads the index from disk
+        return FlagCache(self.dest_dir, autosave=False)
+
+    def merge(self, changes: dict[str, dict]) -> None:
+        for url, entry in changes.items():
+            self._update(url, entry)
+
+    def save(self) -> None:
+        if not self.unsaved:
+            return
+        temp = self.path.with_suffix('.tmp')
+        temp.write_text(json.dumps(self.index, indent=1, sort_keys=True))
+        os.replace(temp, self.path)  # never leave a truncated index
+        self.unsaved = 0
+
+
+class AdaptiveLimiter:
+    """Concurrency limit tuned by additive increase, multiplicative decrease.
+
+    Use ``async with limiter.slot():`` around each request, like a
+    semaphore. A request that completes in less than ``LATENCY_TOLERANCE``
+    times the fastest latency seen raises the limit by ``1/limit``, which
+    adds about one slot per round of requests, up to ``maximum``. A 5xx
+    response or a timeout multiplies the limit by ``DECREASE_FACTOR``, at
+    most once per ``cooldown`` seconds, so a burst of failures from
+    requests already in flight counts as one.
+    """
+
+    LATENCY_TOLERANCE = 2.0
+    DECREASE_FACTOR = 0.5
+
+    def __init__(self, initial: int, maximum: int,
+                 cooldown: float = 1.0) -> None:
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.peak = int(self.limit)
+        self.decreases = 0
+        self.min_latency = float('inf')
+        self._last_decrease = float('-inf')
+        self._changed = asyncio.Condition()
+
+    @property
+    def current(self) -> int:
+        return int(self.limit)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['_changed']  # may be bound to an event loop
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._changed = asyncio.Condition()
+
+    def split(self, parts: int) -> list['AdaptiveLimiter']:
+        """Limiters for parts processes sharing this one's concurrency."""
+        return [AdaptiveLimiter(max(1, share(self.current, parts, i)),
+                                max(1, share(self.maximum, parts, i)),
+                                self.cooldown)
+                for i in range(parts)]
+
+    def join(self, parts: list['AdaptiveLimiter']) -> None:
+        """Take the totals of limiters returned by split, after use."""
+        self.limit = float(sum(part.current for part in parts))
+        self.peak = sum(part.peak for part in parts)
+        self.decreases = sum(part.decreases for part in parts)
+        self.min_latency = min(part.min_latency for part in parts)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self.in_flight < self.current)
+            self.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        except (httpx.HTTPStatusError, httpx.TimeoutException) as exc:
+            self.record(time.perf_counter() - t0, overloaded(exc))
+            raise
+        else:
+            self.record(time.perf_counter() - t0, False)
+        finally:
+            async with self._changed:
+                self.in_flight -= 1
+                self._changed.notify_all()
+
+    def record(self, latency: float, overload: bool) -> None:
+        now = time.perf_counter()
+        if overload:
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(1.0, self.limit * self.DECREASE_FACTOR)
+                self.decreases += 1
+                self._last_decrease = now
+            return
+        self.min_latency = min(self.min_latency, latency)
+        if latency <= self.min_latency * self.LATENCY_TOLERANCE:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.peak = max(self.peak, self.current)
+
+
+def overloaded(exc: Exception) -> bool:
+    """Is exc a sign that the server needs fewer concurrent requests?"""
+    if isinstance(exc, httpx.TimeoutException):
+        return True
+    return (isinstance(exc, httpx.HTTPStatusError) and
+            exc.response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
+def retryable(exc: Exception) -> bool:
+    """Could the request that raised exc succeed if sent again?"""
+    return isinstance(exc, httpx.TransportError) or overloaded(exc)
+
+
+async def limited(limiter: AdaptiveLimiter, request: Awaitable[T]) -> T:
+    async with limiter.slot():
+        return await request
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a host that keeps failing."""
+
+
+class CircuitBreaker:
+    """Stops requests to a host when too many of the recent ones failed.
+
+    The breaker opens when at least ``threshold`` of the last ``window``
+    outcomes (and no fewer than ``min_calls``) were failures. While open,
+    ``check`` raises ``CircuitOpenError``. After ``reset_after`` seconds the
+    breaker is half open: ``check`` lets one trial request through and
+    keeps failing the others. The outcome of the trial closes the breaker
+    if it is a success, or opens it for another ``reset_after`` seconds,
+    which counts as another trip. A trial that never reports is replaced
+    after ``reset_after`` seconds.
+    """
+
+    def __init__(self, threshold: float = 0.5, window: int = 20,
+                 min_calls: int = 10, reset_after: float = 5.0) -> None:
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.reset_after = reset_after
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.opened_at: float | None = None
+        self.trial_at = float('-inf')  # when the last trial request started
+        self.trips = 0
+
+    def check(self) -> bool:
+        """Raise CircuitOpenError unless a request may be sent now.
+
+        Return True for the trial request of a half-open breaker; pass
+        that to ``record`` with its outcome.
+        """
+        if self.opened_at is None:
+            return False
+        now = time.perf_counter()
+        if (now - self.opened_at < self.reset_after or
+                now - self.trial_at < self.reset_after):
+            raise CircuitOpenError('circuit breaker open')
+        self.trial_at = now
+        return True
+
+    def record(self, ok: bool, trial: bool = False) -> None:
+        if self.opened_at is not None:
+            if not trial:
+                return  # a request that started before the breaker opened
+            self.trial_at = float('-inf')
+            if ok:
+                self.opened_at = None
+                self.outcomes.clear()
+            else:
+                self.opened_at = time.perf_counter()
+                self.trips += 1
+            return
+        self.outcomes.append(ok)
+        failures = self.outcomes.count(False)
+        if (len(self.outcomes) >= self.min_calls and
+                failures / len(self.outcomes) >= self.threshold):
+            self.opened_at = time.perf_counter()
+            self.trips += 1
+
+
+@dataclass
+class RetryPolicy:
+    """Retries with exponential backoff and full jitter, per-host breakers.
+
+    A request is sent at most ``max_attempts`` times. Before attempt n+1 it
+    waits a random time between 0 and ``base_delay * 2**n`` seconds, capped
+    at ``max_delay``, unless that would end after ``deadline`` seconds from
+    the first attempt. Only transport errors, timeouts and 5xx responses
+    are retried.
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 0.2
+    max_delay: float = 5.0
+    deadline: float = 15.0
+    retries: int = 0
+    breakers: dict[str, CircuitBreaker] = field(default_factory=dict)
+
+    @property
+    def trips(self) -> int:
+        return sum(breaker.trips for breaker in self.breakers.values())
+
+    def split(self, parts: int) -> list['RetryPolicy']:
+        """Policies with the same settings, for parts processes."""
+        return [replace(self, retries=0, breakers={}) for _ in range(parts)]
+
+    def join(self, parts: list['RetryPolicy']) -> None:
+        """Add the retries and breaker trips of policies from split."""
+        for part in parts:
+            self.retries += part.retries
+            for host, breaker in part.breakers.items():
+                self.breakers.setdefault(host, CircuitBreaker()).trips += (
+                    breaker.trips)
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        return self.breakers.setdefault(httpx.URL(url).host, CircuitBreaker())
+
+    def delay(self, attempt: int) -> float:
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, backoff)
+
+    async def call(self, url: str,
+                   request: Callable[[], Awaitable[T]]) -> tuple[T, int]:
+        """Await request() until it succeeds; return result and retries.
+
+        request must return a new awaitable on each call.
+        """
+        breaker = self.breaker(url)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            trial = breaker.check()
+            try:
+                result = await request()
+            except (httpx.HTTPStatusError, httpx.RequestError) as exc:
+                failed = retryable(exc)
+                breaker.record(not failed, trial)  # a 404: the host is fine
+                delay = self.delay(attempt)
+                elapsed = time.perf_counter() - start
+                if (not failed or attempt + 1 >= self.max_attempts or
+                        elapsed + delay > self.deadline):
+                    raise
+            else:
+                breaker.record(True, trial)
+                return result, attempt
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+
+def run_shard(download_many: Callable, cc_list: list[str], base_url: str,
+              verbose: bool, concur_req: int, options: dict) -> tuple:
+    """Call download_many in a worker process; return what it changed."""
+    with ExitStack() as stack:
+        if not verbose:  # one progress bar, in the parent
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(redirect_stderr(devnull))
+        counter = download_many(cc_list, base_url, verbose, concur_req,
+                                **options)
+    cache = options['cache']
+    return (counter, cache.changes if cache else {}, options['limiter'],
+            options['retry'], options['budget'], options['metrics'])
+
+
+def sharded(download_many: Callable, processes: int) -> Callable:
+    """Wrap download_many to split the codes among processes.
+
+    Each process runs download_many on every n-th code with its share of
+    the concurrency limit and memory budget, so several event loops use
+    several cores. The counters, cache updates, limiter, retry, budget
+    and metrics of all processes are merged into the objects passed in,
+    for ``final_report``. Each process's results are merged as soon as it
+    finishes, and the cache is saved even if another process fails or the
+    run is interrupted, so ``--processes`` keeps the progress of a run.
+    """
+    def download_sharded(cc_list: list[str],
+                         base_url: str,
+                         verbose: bool,
+                         concur_req: int,
+                         *,
+                         cache: FlagCache | None = None,
+                         limiter: AdaptiveLimiter | None = None,
+                         retry: RetryPolicy | None = None,
+                         budget: MemoryBudget | None = None,
+                         metrics: RequestMetrics | None = None,
+                         **options) -> Counter[DownloadStatus]:
+        parts = min(processes, len(cc_list))
+        limiter = limiter or AdaptiveLimiter(concur_req, concur_req)
+        retry = retry or RetryPolicy()
+        budget = budget or MemoryBudget()
+        metrics = metrics or RequestMetrics()
+        limiters = limiter.split(parts)
+        retries = retry.split(parts)
+        budgets = budget.split(parts)
+        counter: Counter[DownloadStatus] = Counter()
+        to_do: list[futures.Future] = []
+        results: dict[futures.Future, tuple] = {}
+
+        def merge(future: futures.Future) -> None:
+            result = results[future] = future.result()
+            shard_counter, changes, *_ = result
+            counter.update(shard_counter)
+            if cache:
+                cache.merge(changes)
+
+        try:
+            with futures.ProcessPoolExecutor(parts) as executor:
+                for i in range(parts):
+                    shard_options = dict(
+                        options, cache=cache.detached() if cache else None,
+                        limiter=limiters[i], retry=retries[i],
+                        budget=budgets[i], metrics=RequestMetrics())
+                    to_do.append(executor.submit(
+                        run_shard, download_many, cc_list[i::parts],
+                        base_url, verbose, share(concur_req, parts, i) or 1,
+                        shard_options))
+                done_iter = futures.as_completed(to_do)
+                if not verbose:
+                    done_iter = tqdm.tqdm(done_iter, total=parts,
+                                          unit='process')
+                for future in done_iter:
+                    merge(future)
+        finally:  # keep the work of the shards that finished
+            for future in to_do:
+                if (future not in results and future.done() and
+                        not future.cancelled() and
+                        future.exception() is None):
+                    merge(future)
+            if cache:
+                cache.save()
+            done = list(results.values())
+            if done:
+                limiter.join([result[2] for result in done])
+                retry.join([result[3] for result in done])
+                budget.join([result[4] for result in done])
+                metrics.join([result[5] for result in done])
+        return counter
+
+    return download_sharded
+
+
 def initial_report(cc_list: list[str],
                    actual_req: int,
                    server_label: str) -> None:
@@ -44,23 +1065,52 @@ def initial_report(cc_list: list[str],
     plural = 's' if len(cc_list) != 1 else ''
     print(f'Searching for {len(cc_list)} flag{plural}: {cc_msg}')
     if actual_req == 1:
-        print('1 connection will be used.')
+        print('1 connection will be used at first.')
     else:
-        print(f'{actual_req} concurrent connections will be used.')
+        print(f'{actual_req} concurrent connections will be used at first.')
 
 
 def final_report(cc_list: list[str],
                  counter: Counter[DownloadStatus],
-                 start_time: float) -> None:
+                 start_time: float,
+                 limiter: AdaptiveLimiter | None = None,
+                 retry: RetryPolicy | None = None,
+                 budget: MemoryBudget | None = None,
+                 metrics: RequestMetrics | None = None) -> None:
     elapsed = time.perf_counter() - start_time
     print('-' * 20)
-    plural = 's' if counter[DownloadStatus.OK] != 1 else ''
-    print(f'{counter[DownloadStatus.OK]:3} flag{plural} downloaded.')
+    downloaded = counter[DownloadStatus.OK] + counter[DownloadStatus.RETRIED]
+    plural = 's' if downloaded != 1 else ''
+    print(f'{downloaded:3} flag{plural} downloaded.')
+    if counter[DownloadStatus.RETRIED]:
+        print(f'{counter[DownloadStatus.RETRIED]:3} of them after retries.')
+    if counter[DownloadStatus.CACHED]:
+        print(f'{counter[DownloadStatus.CACHED]:3} already in cache.')
     if counter[DownloadStatus.NOT_FOUND]:
         print(f'{counter[DownloadStatus.NOT_FOUND]:3} not found.')
     if counter[DownloadStatus.ERROR]:
         plural = 's' if counter[DownloadStatus.ERROR] != 1 else ''
         print(f'{counter[DownloadStatus.ERROR]:3} error{plural}.')
+    if counter[DownloadStatus.CIRCUIT_OPEN]:
+        print(f'{counter[DownloadStatus.CIRCUIT_OPEN]:3} skipped: '
+              f'circuit breaker open.')
+    if retry:
+        print(f'Retries: {retry.retries}, '
+              f'circuit breaker trips: {retry.trips}.')
+    if limiter:
+        print(f'Concurrency limit: {limiter.current} at the end, '
+              f'{limiter.peak} at peak, {limiter.decreases} decreases.')
+    if budget:
+        print(f'Memory budget: {budget.peak / 2**20:.1f} of '
+              f'{budget.limit / 2**20:.1f} MiB at peak, '
+              f'{budget.waits} requests waited.')
+    if metrics and metrics.phases['total'].count:
+        print(f'{"phase":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8}')
+        for phase, hist in metrics.phases.items():
+            if hist.count:
+                p50, p90, p99 = (hist.percentile(pct) * 1000
+                                 for pct in (50, 90, 99))
+                print(f'{phase:>8} {p50:8.1f} {p90:8.1f} {p99:8.1f}')
     print(f'Elapsed time: {elapsed:.2f}s')
 
 
@@ -87,7 +1137,7 @@ def expand_cc_args(every_cc: bool,
     return sorted(codes)[:limit]
 
 
-def process_args(default_concur_req):
+def process_args(default_concur_req, metadata=False):
     server_options = ', '.join(sorted(SERVERS))
     parser = argparse.ArgumentParser(
         description='Download flags for country codes. '
@@ -107,7 +1157,9 @@ def process_args(default_concur_req):
     parser.add_argument(
         '-m', '--max_req', metavar='CONCURRENT', type=int,
         default=default_concur_req,
-        help=f'maximum concurrent requests (default={default_concur_req})')
+        help='concurrent requests to start with; the limit then adapts to '
+             'the server, up to the number of codes and the maximum of '
+             f'each script (default={default_concur_req})')
     parser.add_argument(
         '-s', '--server', metavar='LABEL', default=DEFAULT_SERVER,
         help=f'Server to hit; one of {server_options} '
@@ -115,6 +1167,36 @@ def process_args(default_concur_req):
     parser.add_argument(
         '-v', '--verbose', action='store_true',
         help='output detailed progress info')
+    parser.add_argument(
+        '-r', '--retries', metavar='ATTEMPTS', type=int, default=3,
+        help='maximum attempts per request (default=3)')
+    parser.add_argument(
+        '-d', '--deadline', metavar='SECONDS', type=float, default=15.0,
+        help='time limit for all attempts of a request (default=15)')
+    parser.add_argument(
+        '-p', '--processes', metavar='N', type=int, default=1,
+        help='split the codes among N processes, each with its own '
+             'event loop and share of --max_req (default=1)')
+    parser.add_argument(
+        '--http2', action='store_true',
+        help='use HTTP/2 if the server supports it (needs h2 package)')
+    parser.add_argument(
+        '--memory', metavar='MiB', type=float, default=DEFAULT_MEMORY_BUDGET,
+        help='response bodies buffered at once, in MiB '
+             f'(default={DEFAULT_MEMORY_BUDGET})')
+    parser.add_argument(
+        '--metrics', metavar='FILE', type=Path,
+        help='save request timing, sizes and statuses as JSON')
+    parser.add_argument(
+        '--prometheus', metavar='FILE', type=Path,
+        help='save request metrics in Prometheus text format')
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help=f'ignore and do not update {DEST_DIR / CACHE_INDEX_NAME}')
+    if metadata:
+        parser.add_argument(
+            '-b', '--batch-metadata', action='store_true',
+            help='fetch metadata for all codes in one pass before the flags')
     args = parser.parse_args()
     if args.max_req < 1:
         print('*** Usage error: --max_req CONCURRENT must be >= 1')
@@ -126,6 +1208,23 @@ def process_args(default_concur_req):
         print('*** Usage error: --limit N must be >= 1')
         parser.print_usage()
         sys.exit(2)  # command line usage error
+    if args.retries < 1:
+        print('*** Usage error: --retries ATTEMPTS must be >= 1')
+        parser.print_usage()
+        sys.exit(2)  # command line usage error
+    if args.processes < 1:
+        print('*** Usage error: --processes N must be >= 1')
+        parser.print_usage()
+        sys.exit(2)  # command line usage error
+    if args.memory <= 0:
+        print('*** Usage error: --memory MiB must be > 0')
+        parser.print_usage()
+        sys.exit(2)  # command line usage error
+    if args.http2 and importlib.util.find_spec('h2') is None:
+        print('*** Usage error: --http2 needs the h2 package: '
+              'pip install httpx[http2]')
+        parser.print_usage()
+        sys.exit(2)  # command line usage error
     args.server = args.server.upper()
     if args.server not in SERVERS:
         print(f'*** Usage error: --server LABEL '
@@ -144,12 +1243,32 @@ def process_args(default_concur_req):
     return args, cc_list
 
 
-def main(download_many, default_concur_req, max_concur_req):
-    args, cc_list = process_args(default_concur_req)
+def main(download_many, default_concur_req, max_concur_req, metadata=False):
+    args, cc_list = process_args(default_concur_req, metadata)
     actual_req = min(args.max_req, max_concur_req, len(cc_list))
     initial_report(cc_list, actual_req, args.server)
+    if args.processes > 1:
+        print(f'{args.processes} processes will share them.')
+        download_many = sharded(download_many, args.processes)
     base_url = SERVERS[args.server]
     DEST_DIR.mkdir(exist_ok=True)
+    cache = None if args.no_cache else FlagCache()
+    limiter = AdaptiveLimiter(actual_req, min(max_concur_req, len(cc_list)))
+    retry = RetryPolicy(max_attempts=args.retries, deadline=args.deadline)
+    budget = MemoryBudget(int(args.memory * 2**20))
+    metrics = RequestMetrics()
+    options = {'batch_metadata': args.batch_metadata} if metadata else {}
     t0 = time.perf_counter()
-    counter = download_many(cc_list, base_url, args.verbose, actual_req)
-    final_report(cc_list, counter, t0)
+    try:
+        counter = download_many(cc_list, base_url, args.verbose, actual_req,
+                                cache=cache, limiter=limiter, retry=retry,
+                                budget=budget, metrics=metrics,
+                                http2=args.http2, **options)
+    finally:
+        if cache:
+            cache.save()  # keep progress, even if interrupted
+    final_report(cc_list, counter, t0, limiter, retry, budget, metrics)
+    if args.metrics:
+        metrics.save_json(args.metrics)
+    if args.prometheus:
+        metrics.save_prometheus(args.prometheus)
@@ -0,0 +1,318 @@
+import asyncio
+import os
+import pickle
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+from pytest import fixture, raises
+
+import flags2_asyncio
+from flags2_common import (DEST_DIR, AdaptiveLimiter, CircuitBreaker,
+                           CircuitOpenError, DownloadStatus, FlagCache,
+                           Histogram, MemoryBudget, MetricsTransport,
+                           RequestMetrics, RetryPolicy, sharded)
+from flags_server import start_server
+
+URL = 'http://localhost:8000/flags/br/br.gif'
+
+
+def test_cache_validators(tmp_path: Path) -> None:
+    cache = FlagCache(tmp_path)
+    assert cache.validators(URL) == {}
+    (tmp_path / 'BR.gif').write_bytes(b'GIF89a')
+    cache.store(URL, 'BR.gif', b'GIF89a', {'etag': '"abc"'})
+    assert cache.validators(URL) == {'If-None-Match': '"abc"'}
+
+
+def test_cache_skips_complete_file_without_validators(tmp_path: Path) -> None:
+    cache = FlagCache(tmp_path)
+    (tmp_path / 'BR.gif').write_bytes(b'GIF89a')
+    cache.store(URL, 'BR.gif', b'GIF89a', {})
+    assert cache.validators(URL) is None
+
+
+def test_cache_detects_changed_file(tmp_path: Path) -> None:
+    cache = FlagCache(tmp_path)
+    cache.store(URL, 'BR.gif', b'GIF89a', {'etag': '"abc"'})
+    (tmp_path / 'BR.gif').write_bytes(b'GIF8')  # interrupted write
+    assert not cache.complete(URL)
+    assert cache.validators(URL) == {}
+
+
+def test_cache_checks_file_without_reading_it(tmp_path: Path,
+                                             monkeypatch) -> None:
+    cache = FlagCache(tmp_path)
+    path = tmp_path / 'BR.gif'
+    path.write_bytes(b'GIF89a')
+    cache.store(URL, 'BR.gif', b'GIF89a', {})
+    def fail(self: Path) -> bytes:
+        raise AssertionError('file was read')
+    monkeypatch.setattr(Path, 'read_bytes', fail)
+    assert cache.complete(URL)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))  # rewritten
+    assert not cache.complete(URL)
+
+
+def test_cache_index_persists(tmp_path: Path) -> None:
+    cache = FlagCache(tmp_path)
+    cache.store_not_found(URL)
+    cache.save()
+    assert FlagCache(tmp_path).not_found(URL)
+
+
+def test_cache_metadata(tmp_path: Path) -> None:
+    meta_url = 'http://localhost:8000/flags/br/metadata.json'
+    cache = FlagCache(tmp_path)
+    assert cache.metadata(meta_url) is None
+    cache.store_metadata(meta_url, {'country': 'Brazil'})
+    cache.save()
+    assert FlagCache(tmp_path).metadata(meta_url) == {'country': 'Brazil'}
+
+
+def test_cache_merges_changes_from_detached_copy(tmp_path: Path) -> None:
+    cache = FlagCache(tmp_path)
+    copy = cache.detached()
+    copy.store_not_found(URL)
+    assert not (tmp_path / '.cache-index.json').exists()  # no autosave
+    cache.merge(copy.changes)
+    assert cache.not_found(URL)
+
+
+def test_limiter_increases_while_healthy() -> None:
+    limiter = AdaptiveLimiter(2, 4)
+    for _ in range(20):
+        limiter.record(0.1, overload=False)
+    assert limiter.current == 4  # capped by maximum
+
+
+def test_limiter_ignores_slow_successes() -> None:
+    limiter = AdaptiveLimiter(2, 10)
+    limiter.record(0.1, overload=False)
+    for _ in range(20):
+        limiter.record(0.5, overload=False)  # 5x the best latency
+    assert limiter.current == 2
+
+
+def test_limiter_backs_off_once_per_cooldown() -> None:
+    limiter = AdaptiveLimiter(8, 10, cooldown=60)
+    for _ in range(5):
+        limiter.record(0.1, overload=True)
+    assert (limiter.current, limiter.decreases) == (4, 1)
+
+
+def test_limiter_split_and_join() -> None:
+    limiter = AdaptiveLimiter(5, 10)
+    parts = limiter.split(2)
+    assert [(p.current, p.maximum) for p in parts] == [(3, 5), (2, 5)]
+    parts[0].record(0.1, overload=True)
+    limiter.join(pickle.loads(pickle.dumps(parts)))
+    assert (limiter.current, limiter.decreases) == (3, 1)
+
+
+def test_limiter_slot_respects_limit() -> None:
+    limiter = AdaptiveLimiter(3, 3)
+    peak = 0
+
+    async def task() -> None:
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run_all() -> None:
+        await asyncio.gather(*(task() for _ in range(10)))
+
+    asyncio.run(run_all())
+    assert peak == 3
+    assert limiter.in_flight == 0
+
+
+def test_memory_budget_applies_backpressure() -> None:
+    budget = MemoryBudget(limit=100)
+
+    async def task() -> None:
+        async with budget.reserve(40):
+            await asyncio.sleep(0.01)
+
+    async def run_all() -> None:
+        await asyncio.gather(*(task() for _ in range(5)))
+
+    asyncio.run(run_all())
+    assert budget.peak == 80  # a third reservation would exceed 100
+    assert budget.waits == 3
+    assert budget.used == 0
+
+
+def failing(status_codes: list[int]):
+    """Return a request factory answering with each status code in turn."""
+    codes = iter(status_codes)
+
+    def request():
+        async def respond() -> str:
+            code = next(codes)
+            if code == 200:
+                return 'OK'
+            req = httpx.Request('GET', URL)
+            raise httpx.HTTPStatusError(
+                'error', request=req, response=httpx.Response(code, request=req))
+        return respond()
+    return request
+
+
+def test_retry_until_success() -> None:
+    policy = RetryPolicy(base_delay=0.001)
+    result = asyncio.run(policy.call(URL, failing([503, 502, 200])))
+    assert result == ('OK', 2)
+    assert policy.retries == 2
+
+
+def test_retry_gives_up_after_max_attempts() -> None:
+    policy = RetryPolicy(max_attempts=2, base_delay=0.001)
+    with raises(httpx.HTTPStatusError):
+        asyncio.run(policy.call(URL, failing([503, 503, 200])))
+
+
+def test_no_retry_on_not_found() -> None:
+    policy = RetryPolicy(base_delay=0.001)
+    with raises(httpx.HTTPStatusError):
+        asyncio.run(policy.call(URL, failing([404, 200])))
+    assert policy.retries == 0
+
+
+def test_circuit_breaker_opens_and_resets() -> None:
+    breaker = CircuitBreaker(threshold=0.5, window=4, min_calls=4,
+                             reset_after=0)
+    for ok in [True, False, True, False]:
+        breaker.record(ok)
+    assert breaker.trips == 1
+    trial = breaker.check()  # reset_after=0: half open at once
+    assert trial
+    breaker.record(True, trial)
+    assert breaker.opened_at is None
+
+
+def test_circuit_breaker_half_open_allows_one_trial() -> None:
+    breaker = CircuitBreaker(min_calls=2, reset_after=0.05)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.check()  # the trial request
+    with raises(CircuitOpenError):
+        breaker.check()  # everyone else waits for its outcome
+    breaker.record(True)  # started before the breaker opened: ignored
+    assert breaker.opened_at is not None
+    breaker.record(False, trial=True)
+    assert breaker.trips == 2
+    with raises(CircuitOpenError):
+        breaker.check()
+    time.sleep(0.06)
+    assert breaker.check()
+    breaker.record(True, trial=True)
+    assert breaker.opened_at is None
+    assert not breaker.check()
+
+
+def test_circuit_breaker_fails_fast() -> None:
+    breaker = CircuitBreaker(min_calls=2, reset_after=60)
+    breaker.record(False)
+    breaker.record(False)
+    with raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_histogram_buckets_cover_every_value() -> None:
+    for micros in [0, 1, 63, 64, 65, 1000, 123_456, 10**9]:
+        low, high = Histogram.bucket_range(Histogram.bucket(micros))
+        assert low <= micros < high
+        assert high - low <= max(1, micros * 0.04)
+
+
+def test_histogram_percentiles() -> None:
+    hist = Histogram()
+    for ms in range(1, 101):
+        hist.record(ms / 1000)
+    assert abs(hist.percentile(50) - 0.050) < 0.050 * 0.04
+    assert abs(hist.percentile(99) - 0.099) < 0.099 * 0.04
+    assert hist.percentile(100) == hist.max == 0.1
+    assert hist.count_below(0.020) == 19  # 20 ms is in a bucket up to 20.48
+
+
+def test_request_metrics() -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith('xx.gif'):
+            return httpx.Response(404)
+        return httpx.Response(200, content=b'GIF89a')
+
+    metrics = RequestMetrics()
+    transport = MetricsTransport(httpx.MockTransport(handler), metrics)
+    with httpx.Client(transport=transport) as client:
+        client.get(URL)
+        client.get(URL.replace('br', 'xx'))
+    assert metrics.statuses == {'200': 1, '404': 1}
+    assert metrics.bytes == 6
+    assert metrics.requests[URL]['bytes'] == 6
+    assert metrics.phases['total'].count == 2
+    text = metrics.prometheus()
+    assert 'flags_request_phase_seconds_count{phase="ttfb"} 2' in text
+    assert 'flags_responses_total{status="404"} 1' in text
+
+
+@fixture
+def dest_dir(tmp_path: Path, monkeypatch) -> Path:
+    monkeypatch.chdir(tmp_path)  # flags are saved to DEST_DIR, a relative path
+    (tmp_path / DEST_DIR).mkdir()
+    return tmp_path / DEST_DIR
+
+
+def test_limiter_grows_against_delay_server(dest_dir: Path) -> None:
+    server = start_server(delay=0.05, codes=30)
+    try:
+        cc_list = sorted(server.flags)
+        limiter = AdaptiveLimiter(1, len(cc_list))
+        counter = flags2_asyncio.download_many(
+            cc_list, server.base_url, True, 1, limiter=limiter)
+    finally:
+        server.shutdown()
+    assert counter[DownloadStatus.OK] == len(cc_list)
+    assert limiter.peak > 1  # -m is only the starting limit
+    assert len(list(dest_dir.glob('*.gif'))) == len(cc_list)
+
+
+def test_limiter_shrinks_against_error_server(dest_dir: Path) -> None:
+    server = start_server(error_rate=0.5, codes=20)
+    try:
+        cc_list = sorted(server.flags)
+        limiter = AdaptiveLimiter(8, 8, cooldown=0)
+        retry = RetryPolicy(max_attempts=10, base_delay=0.001, deadline=5)
+        counter = flags2_asyncio.download_many(
+            cc_list, server.base_url, True, 8, limiter=limiter, retry=retry)
+    finally:
+        server.shutdown()
+    assert sum(counter.values()) == len(cc_list)
+    assert limiter.decreases > 0
+    assert retry.retries > 0
+
+
+def mark_not_found(cc_list: list[str], base_url: str, verbose: bool,
+                   concur_req: int, *, cache: FlagCache,
+                   **options) -> Counter[DownloadStatus]:
+    """download_many stand-in for worker processes: fails on code XX."""
+    for cc in cc_list:
+        if cc == 'XX':
+            raise ValueError('shard failed')
+        cache.store_not_found(f'{base_url}/{cc}')
+    return Counter({DownloadStatus.NOT_FOUND: len(cc_list)})
+
+
+def test_sharded_keeps_finished_shards_when_one_fails(tmp_path: Path) -> None:
+    cache = FlagCache(tmp_path)
+    download_many = sharded(mark_not_found, 2)
+    with raises(ValueError, match='shard failed'):
+        download_many(['AA', 'BB', 'XX', 'CC'], 'http://x', False, 2,
+                      cache=cache)
+    saved = FlagCache(tmp_path)  # reloaded from disk
+    assert saved.not_found('http://x/BB') and saved.not_found('http://x/CC')
+    assert not saved.not_found('http://x/AA')  # its shard failed
@@ -14,7 +14,10 @@ from pathlib import Path
 import httpx
 import tqdm  # type: ignore
 
-from flags2_common import main, DownloadStatus, save_flag
+from flags2_common import (main, AdaptiveLimiter, CircuitOpenError,
+                           Download, DownloadStatus, FlagCache, MemoryBudget,
+                           RequestMetrics, RetryPolicy, flag_url, limited,
+                           make_client, stream_flag)
 
 # low concurrency default to avoid errors from remote site,
 # such as 503 - Service Temporarily Unavailable
@@ -23,66 +26,188 @@ MAX_CONCUR_REQ = 1000
 
 async def get_flag(client: httpx.AsyncClient,  # <1>
                    base_url: str,
-                   cc: str) -> bytes:
-    url = f'{base_url}/{cc}/{cc}.gif'.lower()
-    resp = await client.get(url, timeout=3.1, follow_redirects=True)   # <2>
-    resp.raise_for_status()
-    return resp.content
+                   cc: str,
+                   headers: dict[str, str] | None = None,
+                   budget: MemoryBudget | None = None) -> Download:
+    url = flag_url(base_url, cc)
+    return await stream_flag(client, url, headers,  # <2>
+                             budget or MemoryBudget())
 
 # tag::FLAGS3_ASYNCIO_GET_COUNTRY[]
 async def get_country(client: httpx.AsyncClient,
                       base_url: str,
                       cc: str) -> str:    # <1>
-    url = f'{base_url}/{cc}/metadata.json'.lower()
+    url = metadata_url(base_url, cc)
     resp = await client.get(url, timeout=3.1, follow_redirects=True)
     resp.raise_for_status()
     metadata = resp.json()  # <2>
     return metadata['country']  # <3>
 # end::FLAGS3_ASYNCIO_GET_COUNTRY[]
 
+def metadata_url(base_url: str, cc: str) -> str:
+    return f'{base_url}/{cc}/metadata.json'.lower()
+
+async def get_flag_and_country(client: httpx.AsyncClient,
+                               base_url: str,
+                               cc: str,
+                               headers: dict[str, str],
+                               budget: MemoryBudget
+                               ) -> tuple[Download, str]:
+    """Send both requests at once: one round trip instead of two."""
+    download, country = await asyncio.gather(
+        get_flag(client, base_url, cc, headers, budget),
+        get_country(client, base_url, cc),
+        return_exceptions=True)
+    if isinstance(download, Download) and isinstance(country, BaseException):
+        download.discard()
+    for outcome in (download, country):  # the flag error matters most
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return download, country  # type: ignore[return-value]
+
+async def load_countries(client: httpx.AsyncClient,
+                         base_url: str,
+                         cc_list: list[str],
+                         limiter: AdaptiveLimiter,
+                         retry: RetryPolicy,
+                         countries: dict[str, str],
+                         cache: FlagCache | None = None) -> None:
+    """Fill countries with the names of cc_list in one concurrent pass.
+
+    Codes already in countries are skipped; failures are left for
+    download_one to report.
+    """
+    async def load(cc: str) -> None:
+        url = metadata_url(base_url, cc)
+        try:
+            country, _ = await retry.call(url, lambda: limited(
+                limiter, get_country(client, base_url, cc)))
+        except (httpx.HTTPError, CircuitOpenError):
+            return
+        countries[cc] = country
+        if cache:
+            cache.store_metadata(url, {'country': country})
+
+    await asyncio.gather(*(load(cc) for cc in cc_list
+                           if cc not in countries))
+
 # tag::FLAGS3_ASYNCIO_DOWNLOAD_ONE[]
 async def download_one(client: httpx.AsyncClient,
                        cc: str,
                        base_url: str,
-                       semaphore: asyncio.Semaphore,
-                       verbose: bool) -> DownloadStatus:
+                       limiter: AdaptiveLimiter,
+                       verbose: bool,
+                       cache: FlagCache | None = None,
+                       retry: RetryPolicy | None = None,
+                       budget: MemoryBudget | None = None,
+                       countries: dict[str, str] | None = None
+                       ) -> DownloadStatus:
+    url = flag_url(base_url, cc)
+    headers = cache.validators(url) if cache else {}
+    if cache and cache.not_found(url):
+        status = DownloadStatus.NOT_FOUND
+        msg = f'not found (cached): {url}'
+    elif headers is None:  # complete, and nothing to revalidate it with
+        status = DownloadStatus.CACHED
+        msg = 'cached'
+    else:
+        status, msg = await fetch_one(client, cc, base_url, limiter,
+                                      headers, cache, retry or RetryPolicy(),
+                                      budget or MemoryBudget(),
+                                      {} if countries is None else countries)
+    if verbose and msg:
+        print(cc, msg)
+    return status
+
+async def fetch_one(client: httpx.AsyncClient,
+                    cc: str,
+                    base_url: str,
+                    limiter: AdaptiveLimiter,
+                    headers: dict[str, str],
+                    cache: FlagCache | None,
+                    retry: RetryPolicy,
+                    budget: MemoryBudget,
+                    countries: dict[str, str]) -> tuple[DownloadStatus, str]:
+    url = flag_url(base_url, cc)
+    filename = cache.filename(url) if cache and headers else None
     try:
-        async with semaphore:  # <1>
-            image = await get_flag(client, base_url, cc)
-        async with semaphore:  # <2>
-            country = await get_country(client, base_url, cc)
+        if filename or cc in countries:  # <1>
+            download, retries = await retry.call(url, lambda: limited(
+                limiter, get_flag(client, base_url, cc, headers, budget)))
+        else:  # <2>
+            (download, country), retries = await retry.call(
+                url, lambda: limited(limiter, get_flag_and_country(
+                    client, base_url, cc, headers, budget)))
+            countries[cc] = country
+            if cache:
+                cache.store_metadata(metadata_url(base_url, cc),
+                                     {'country': country})
+    except CircuitOpenError:
+        return DownloadStatus.CIRCUIT_OPEN, 'skipped: circuit breaker open'
     except httpx.HTTPStatusError as exc:
         res = exc.response
         if res.status_code == HTTPStatus.NOT_FOUND:
-            status = DownloadStatus.NOT_FOUND
-            msg = f'not found: {res.url}'
+            if cache and res.url == url:
+                cache.store_not_found(url)
+            return DownloadStatus.NOT_FOUND, f'not found: {res.url}'
         else:
             raise
-    else:
-        filename = country.replace(' ', '_')  # <3>
-        await asyncio.to_thread(save_flag, image, f'{filename}.gif')
-        status = DownloadStatus.OK
-        msg = 'OK'
-    if verbose and msg:
-        print(cc, msg)
-    return status
+    if download.status_code == HTTPStatus.NOT_MODIFIED:
+        return DownloadStatus.CACHED, 'not modified'
+    filename = filename or countries[cc].replace(' ', '_') + '.gif'  # <3>
+    download.save(filename)
+    if cache:
+        cache.store_digest(url, filename, download.size, download.sha256,
+                           download.headers)
+    if retries:
+        return DownloadStatus.RETRIED, f'OK after {retries} retries'
+    return DownloadStatus.OK, 'OK'
 # end::FLAGS3_ASYNCIO_DOWNLOAD_ONE[]
 
+def known_countries(cc_list: list[str],
+                    base_url: str,
+                    cache: FlagCache | None) -> dict[str, str]:
+    """Country names for cc_list saved in the cache by earlier runs."""
+    countries = {}
+    for cc in cc_list:
+        metadata = cache.metadata(metadata_url(base_url, cc)) if cache else None
+        if metadata:
+            countries[cc] = metadata['country']
+    return countries
+
 # tag::FLAGS2_ASYNCIO_START[]
 async def supervisor(cc_list: list[str],
                      base_url: str,
                      verbose: bool,
-                     concur_req: int) -> Counter[DownloadStatus]:  # <1>
+                     concur_req: int,
+                     cache: FlagCache | None = None,
+                     limiter: AdaptiveLimiter | None = None,
+                     retry: RetryPolicy | None = None,
+                     budget: MemoryBudget | None = None,
+                     metrics: RequestMetrics | None = None,
+                     http2: bool = False,
+                     batch_metadata: bool = False
+                     ) -> Counter[DownloadStatus]:  # <1>
     counter: Counter[DownloadStatus] = Counter()
-    semaphore = asyncio.Semaphore(concur_req)  # <2>
-    async with httpx.AsyncClient() as client:
-        to_do = [download_one(client, cc, base_url, semaphore, verbose)
+    if limiter is None:  # fixed limit, like a semaphore
+        limiter = AdaptiveLimiter(concur_req, concur_req)  # <2>
+    budget = budget or MemoryBudget()
+    retry = retry or RetryPolicy()
+    countries = known_countries(cc_list, base_url, cache)
+    # each limiter slot may hold a flag and a metadata request at once
+    async with make_client(2 * limiter.maximum, http2,
+                           metrics) as client:
+        if batch_metadata:
+            await load_countries(client, base_url, cc_list, limiter, retry,
+                                 countries, cache)
+        to_do = [download_one(client, cc, base_url, limiter, verbose,
+                              cache, retry, budget, countries)
                  for cc in sorted(cc_list)]  # <3>
         to_do_iter = asyncio.as_completed(to_do)  # <4>
         if not verbose:
             to_do_iter = tqdm.tqdm(to_do_iter, total=len(cc_list))  # <5>
-        error: httpx.HTTPError | None = None  # <6>
         for coro in to_do_iter:  # <7>
+            error: httpx.HTTPError | None = None  # <6>
             try:
                 status = await coro  # <8>
             except httpx.HTTPStatusError as exc:
@@ -102,18 +227,30 @@ async def supervisor(cc_list: list[str],
                     cc = Path(url).stem.upper()   # <13>
                     print(f'{cc} error: {error_msg}')
             counter[status] += 1
+            if not verbose:
+                to_do_iter.set_postfix(limit=limiter.current)
 
     return counter
 
 def download_many(cc_list: list[str],
                   base_url: str,
                   verbose: bool,
-                  concur_req: int) -> Counter[DownloadStatus]:
-    coro = supervisor(cc_list, base_url, verbose, concur_req)
+                  concur_req: int,
+                  *,
+                  cache: FlagCache | None = None,
+                  limiter: AdaptiveLimiter | None = None,
+                  retry: RetryPolicy | None = None,
+                  budget: MemoryBudget | None = None,
+                  metrics: RequestMetrics | None = None,
+                  http2: bool = False,
+                  batch_metadata: bool = False
+                  ) -> Counter[DownloadStatus]:
+    coro = supervisor(cc_list, base_url, verbose, concur_req,
+                      cache, limiter, retry, budget, metrics, http2, batch_metadata)
     counts = asyncio.run(coro)  # <14>
 
     return counts
 
 if __name__ == '__main__':
-    main(download_many, DEFAULT_CONCUR_REQ, MAX_CONCUR_REQ)
+    main(download_many, DEFAULT_CONCUR_REQ, MAX_CONCUR_REQ, metadata=True)
 # end::FLAGS2_ASYNCIO_START[]
@@ -16,6 +16,7 @@ import asyncio
 from httpx import AsyncClient  # <1>
 
 from flags import BASE_URL, save_flag, main  # <2>
+from flags2_common import make_client
 
 async def download_one(client: AsyncClient, cc: str):  # <3>
     image = await get_flag(client, cc)
@@ -35,7 +36,7 @@ def download_many(cc_list: list[str]) -> int:    # <1>
     return asyncio.run(supervisor(cc_list))      # <2>
 
 async def supervisor(cc_list: list[str]) -> int:
-    async with AsyncClient() as client:          # <3>
+    async with make_client(len(cc_list)) as client:  # <3>
         to_do = [download_one(client, cc)
                  for cc in sorted(cc_list)]      # <4>
         res = await asyncio.gather(*to_do)       # <5>
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""Benchmark the flag downloaders against a local flags_server.
+
+Starts ``flags_server.py`` with the given latency, error rate and
+bandwidth, then runs each downloader in a fresh process for every
+``--max_req`` value, and reports throughput, latency percentiles and
+peak RSS::
+
+    $ ./flags_bench.py --delay .1 --codes 100 -m 1 10 50 --csv bench.csv
+    variant         max_req  flags  flags/s   p50 ms   p95 ms   p99 ms  RSS MiB
+    sequential            0    100      9.6    102.1    103.0    110.3     35.1
+    threadpool            1    100      9.5    102.2    106.9    108.7     35.2
+    threadpool           10    100     76.3    105.5    113.6    118.7     35.6
+    threadpool           50    100    165.1    136.0    175.8    198.7     37.5
+    ...
+
+Latencies are measured by the clients built with ``make_client`` and
+``make_sync_client``, from sending each request to reading its body,
+so time spent waiting for a worker or a concurrency slot is not
+included. ``sequential`` and ``asyncio`` have no concurrency setting:
+they run once, and their rows show ``max_req`` as 0.
+"""
+
+import argparse
+import csv
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from flags2_common import LATENCY_LOG_VAR
+from flags_server import country_codes
+
+HERE = Path(__file__).parent
+FIELDS = ['variant', 'max_req', 'flags', 'requests', 'errors', 'elapsed',
+          'flags_per_s', 'req_per_s', 'p50_ms', 'p95_ms', 'p99_ms',
+          'peak_rss_mib']
+
+
+def run_sequential(base_url: str, cc_list: list[str], max_req: int) -> int:
+    import flags
+    flags.BASE_URL = base_url
+    return flags.download_many(cc_list)
+
+
+def run_threadpool(base_url: str, cc_list: list[str], max_req: int) -> int:
+    import flags
+    import flags_threadpool
+    flags.BASE_URL = base_url
+    return flags_threadpool.download_many(cc_list, max_req)
+
+
+def run_processpool(base_url: str, cc_list: list[str], max_req: int) -> int:
+    import flags
+    import flags_processpool
+    flags.BASE_URL = base_url
+    return flags_processpool.download_many(cc_list, max_req)
+
+
+def run_asyncio(base_url: str, cc_list: list[str], max_req: int) -> int:
+    import flags_asyncio
+    flags_asyncio.BASE_URL = base_url
+    return flags_asyncio.download_many(cc_list)
+
+
+def run_flags2_asyncio(base_url: str, cc_list: list[str],
+                       max_req: int) -> int:
+    import flags2_asyncio
+    counter = flags2_asyncio.download_many(cc_list, base_url, False, max_req)
+    return sum(counter.values())
+
+
+def run_flags3_asyncio(base_url: str, cc_list: list[str],
+                       max_req: int) -> int:
+    import flags3_asyncio
+    counter = flags3_asyncio.download_many(cc_list, base_url, False, max_req)
+    return sum(counter.values())
+
+
+VARIANTS: dict[str, Callable[[str, list[str], int], int]] = {
+    'sequential': run_sequential,
+    'threadpool': run_threadpool,
+    'processpool': run_processpool,
+    'asyncio': run_asyncio,
+    'flags2_asyncio': run_flags2_asyncio,
+    'flags3_asyncio': run_flags3_asyncio,
+}
+UNBOUNDED = {'sequential', 'asyncio'}  # no max_req setting
+
+
+def worker(variant: str, base_url: str, max_req: int,
+           cc_list: list[str]) -> None:
+    """Run one downloader; called in the child process."""
+    sys.path.insert(0, str(HERE))
+    Path('downloaded').mkdir()  # the child runs in an empty directory
+    t0 = time.perf_counter()
+    count = VARIANTS[variant](base_url, cc_list, max_req)
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({'flags': count, 'elapsed': elapsed}), file=sys.stderr)
+
+
+def wait_for_port(port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(data: list[float], pct: int) -> float:
+    if len(data) < 2:
+        return data[0] if data else float('nan')
+    return statistics.quantiles(data, n=100)[pct - 1]
+
+
+def measure(variant: str, base_url: str, max_req: int,
+            cc_list: list[str]) -> dict:
+    """Run variant in a new process; return a row of FIELDS."""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = Path(tmp) / 'latency.log'
+        err_path = Path(tmp) / 'stderr.txt'
+        env = dict(os.environ, **{LATENCY_LOG_VAR: str(log_path)})
+        cmd = [sys.executable, str(HERE / 'flags_bench.py'), '--worker',
+               variant, base_url, str(max_req), *cc_list]
+        with open(err_path, 'w') as err:
+            proc = subprocess.Popen(cmd, cwd=tmp, env=env, stderr=err,
+                                    stdout=subprocess.DEVNULL)
+            # wait4 gives the peak RSS of the child and its own children
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        stderr = err_path.read_text().splitlines()
+        latencies = ([float(line) for line in log_path.read_text().split()]
+                     if log_path.exists() else [])
+    row = {'variant': variant, 'max_req': max_req, 'flags': 0,
+           'errors': 0, 'elapsed': float('nan')}
+    if proc.returncode == 0 and stderr:
+        row.update(json.loads(stderr[-1]))
+    else:
+        row['errors'] = len(cc_list)
+        print(f'*** {variant} failed:', *stderr[-3:], sep='\n',
+              file=sys.stderr)
+    row['requests'] = len(latencies)
+    row['flags_per_s'] = row['flags'] / row['elapsed']
+    row['req_per_s'] = len(latencies) / row['elapsed']
+    for pct in (50, 95, 99):
+        row[f'p{pct}_ms'] = percentile(latencies, pct) * 1000
+    row['peak_rss_mib'] = usage.ru_maxrss / 1024  # Linux: KiB
+    return row
+
+
+def print_row(row: dict) -> None:
+    print(f'{row["variant"]:15} {row["max_req"]:7} {row["flags"]:6} '
+          f'{row["flags_per_s"]:8.1f} {row["p50_ms"]:8.1f} '
+          f'{row["p95_ms"]:8.1f} {row["p99_ms"]:8.1f} '
+          f'{row["peak_rss_mib"]:8.1f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark the flag downloaders on a local server.')
+    parser.add_argument('--delay', type=float, default=0.1,
+                        help='server latency in seconds (default=0.1)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests answered with 503')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='bytes per second for each response body')
+    parser.add_argument('--size', type=int, default=2000,
+                        help='bytes in each flag image (default=2000)')
+    parser.add_argument('--codes', type=int, default=100,
+                        help='number of flags to download (default=100)')
+    parser.add_argument('-m', '--max_req', type=int, nargs='+',
+                        default=[1, 10, 50], metavar='N',
+                        help='concurrency values to try (default=1 10 50)')
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS,
+                        default=list(VARIANTS), metavar='NAME',
+                        help=f'downloaders to run: {", ".join(VARIANTS)}')
+    parser.add_argument('--csv', type=Path, help='write results as CSV')
+    parser.add_argument('--json', type=Path, help='write results as JSON')
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, str(HERE / 'flags_server.py'), str(port),
+         '--delay', str(args.delay), '--error-rate', str(args.error_rate),
+         '--bandwidth', str(args.bandwidth), '--size', str(args.size),
+         '--codes', str(args.codes)],
+        stdout=subprocess.DEVNULL)
+    base_url = f'http://localhost:{port}/flags'
+    cc_list = country_codes(args.codes)
+    rows = []
+    try:
+        wait_for_port(port)
+        print(f'{"variant":15} {"max_req":>7} {"flags":>6} {"flags/s":>8} '
+              f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"RSS MiB":>8}')
+        for variant in args.variants:
+            grid = [0] if variant in UNBOUNDED else args.max_req
+            for max_req in grid:
+                row = measure(variant, base_url, max_req, cc_list)
+                print_row(row)
+                rows.append(row)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as fp:
+            writer = csv.DictWriter(fp, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.json:
+        settings = {name: getattr(args, name) for name in
+                    ('delay', 'error_rate', 'bandwidth', 'size', 'codes')}
+        args.json.write_text(json.dumps(
+            {'settings': settings, 'results': rows}, indent=2))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        variant, base_url, max_req, *codes = sys.argv[2:]
+        worker(variant, base_url, int(max_req), codes)
+    else:
+        main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Compare a new connection per request with the pooled client.
+
+Downloads every flag from a local ``flags_server`` ``ROUNDS`` times with
+``max_req`` concurrent requests, first opening a fresh ``AsyncClient``
+for each request, then sharing one client from ``make_client``.
+
+Usage::
+
+    $ ./flags_pool_bench.py [MAX_REQ ...]
+    max_req  client       req/s  mean ms   p95 ms
+          1  per-request    ...
+          1  pooled         ...
+
+Pass ``--http2`` to also time the pooled client with HTTP/2 enabled (needs
+the ``h2`` package; against the HTTP/1.1 local server this only shows the
+negotiation overhead, since multiplexing needs an HTTP/2 server).
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable
+
+import httpx
+
+from flags2_common import flag_url, make_client
+from flags_server import start_server
+
+ROUNDS = 5
+
+Fetch = Callable[[str], Awaitable[httpx.Response]]
+
+
+async def timed_run(urls: list[str], max_req: int,
+                    fetch: Fetch) -> list[float]:
+    semaphore = asyncio.Semaphore(max_req)
+    latencies: list[float] = []
+
+    async def one(url: str) -> None:
+        async with semaphore:
+            t0 = time.perf_counter()
+            resp = await fetch(url)
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one(url) for url in urls))
+    return latencies
+
+
+async def per_request(urls: list[str], max_req: int) -> list[float]:
+    async def fetch(url: str) -> httpx.Response:
+        async with httpx.AsyncClient() as client:  # new connection each time
+            return await client.get(url)
+    return await timed_run(urls, max_req, fetch)
+
+
+async def pooled(urls: list[str], max_req: int,
+                 http2: bool = False) -> list[float]:
+    async with make_client(max_req, http2) as client:
+        return await timed_run(urls, max_req, client.get)
+
+
+def report(max_req: int, label: str, elapsed: float,
+           latencies: list[float]) -> None:
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(f'{max_req:7}  {label:12} {len(latencies) / elapsed:8.0f} '
+          f'{statistics.mean(latencies) * 1000:8.2f} {p95 * 1000:8.2f}')
+
+
+def main(max_reqs: list[int], http2: bool) -> None:
+    server = start_server()
+    urls = [flag_url(server.base_url, cc) for cc in server.flags] * ROUNDS
+    variants: dict[str, Callable] = {'per-request': per_request,
+                                     'pooled': pooled}
+    if http2:
+        variants['pooled-h2'] = lambda urls, n: pooled(urls, n, http2=True)
+    print(f'{"max_req":>7}  {"client":12} {"req/s":>8} '
+          f'{"mean ms":>8} {"p95 ms":>8}')
+    try:
+        for max_req in max_reqs:
+            for label, variant in variants.items():
+                t0 = time.perf_counter()
+                latencies = asyncio.run(variant(urls, max_req))
+                report(max_req, label, time.perf_counter() - t0, latencies)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    use_http2 = '--http2' in args
+    counts = [int(arg) for arg in args if arg != '--http2']
+    main(counts or [1, 10, 50], use_http2)
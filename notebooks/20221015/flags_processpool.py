@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+"""Download flags of top 20 countries by population
+
+ProcessPoolExecutor version
+
+Sample run::
+
+    $ python3 flags_processpool.py
+    BR CN ID IN US BD NG PK RU JP EG ET MX PH VN CD DE FR IR TR
+    20 downloads in 0.61s
+
+"""
+
+# tag::FLAGS_PROCESSPOOL[]
+import os
+from concurrent import futures
+
+import httpx
+
+import flags
+from flags import save_flag, get_flag, main
+from flags2_common import make_sync_client
+
+client: httpx.Client | None = None  # one per worker process
+
+def init_worker(base_url: str) -> None:
+    global client
+    flags.BASE_URL = base_url  # in case the worker did not fork
+    client = make_sync_client()
+
+def download_one(cc: str) -> str:
+    assert client is not None, 'init_worker was not called'
+    image = get_flag(client, cc).content
+    save_flag(image, f'{cc}.gif')
+    print(cc, end=' ', flush=True)
+    return cc
+
+def download_many(cc_list: list[str],
+                  max_workers: int | None = None) -> int:
+    workers = min(max_workers or os.cpu_count() or 1, len(cc_list))
+    with futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                     initargs=(flags.BASE_URL,)) as executor:
+        res = executor.map(download_one, sorted(cc_list))
+
+    return len(list(res))
+
+if __name__ == '__main__':
+    main(download_many)
+# end::FLAGS_PROCESSPOOL[]
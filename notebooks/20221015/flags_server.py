@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""Local stand-in for the flags server, for testing and benchmarking.
+
+Serves ``/flags/<cc>/<cc>.gif`` and ``/flags/<cc>/metadata.json`` for every
+code in ``country_codes.txt`` (or the 20 most populous countries if that
+file is missing), or for the first N two-letter codes with ``--codes N``.
+Flag images are synthetic, ``--size`` bytes each, so
+nothing needs to be downloaded first. Connections use HTTP/1.1 keep-alive.
+
+Sample run::
+
+    $ ./flags_server.py --delay .5 --error-rate .25 8001
+    Serving 20 flags on http://localhost:8001/flags (Ctrl-C to stop)
+
+``--delay`` is added to every response, ``--error-rate`` answers that
+fraction of requests with 503, and ``--bandwidth`` (bytes/s) throttles
+each response body.
+"""
+
+import argparse
+import hashlib
+import json
+import itertools
+import random
+import string
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+POP20_CC = ('CN IN US ID BR PK NG BD RU JP '
+            'MX PH VN ET EG DE IR TR CD FR').split()
+COUNTRY_CODES_FILE = Path(__file__).with_name('country_codes.txt')
+DEFAULT_SIZE = 2_000
+CHUNK_SIZE = 1024
+
+
+def country_codes(count: int | None = None) -> list[str]:
+    """Codes to serve: the first count of AA...ZZ, if count is given."""
+    if count is not None:
+        pairs = itertools.product(string.ascii_uppercase, repeat=2)
+        return [a + b for a, b in itertools.islice(pairs, count)]
+    if COUNTRY_CODES_FILE.exists():
+        return COUNTRY_CODES_FILE.read_text().split()
+    return POP20_CC
+
+
+def fake_gif(cc: str, size: int) -> bytes:
+    header = b'GIF89a' + cc.encode()
+    return (header * (size // len(header) + 1))[:size]
+
+
+class FlagsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections open
+    disable_nagle_algorithm = True  # headers and body are separate writes
+    server: 'FlagsServer'
+
+    def log_message(self, format: str, *args: object) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self) -> None:
+        srv = self.server
+        if srv.delay:
+            time.sleep(srv.delay)
+        if random.random() < srv.error_rate:
+            return self.reply(HTTPStatus.SERVICE_UNAVAILABLE, b'busy')
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'flags':
+            cc = parts[1].upper()
+            if cc in srv.flags:
+                if parts[2] == 'metadata.json':
+                    body = json.dumps({'country': cc, 'cc': cc}).encode()
+                    return self.reply(HTTPStatus.OK, body,
+                                      'application/json')
+                if parts[2] == f'{cc.lower()}.gif':
+                    return self.reply_flag(srv.flags[cc])
+        self.reply(HTTPStatus.NOT_FOUND, b'not found')
+
+    def reply_flag(self, body: bytes) -> None:
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self.reply(HTTPStatus.NOT_MODIFIED, b'', etag=etag)
+        self.reply(HTTPStatus.OK, body, 'image/gif', etag)
+
+    def reply(self, status: HTTPStatus, body: bytes,
+              content_type: str = 'text/plain',
+              etag: str | None = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for i in range(0, len(body), CHUNK_SIZE):
+            chunk = body[i:i + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / bandwidth)
+
+
+class FlagsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default of 5 drops bursts of connects
+
+    def __init__(self, port: int = 8000, *, delay: float = 0,
+                 error_rate: float = 0, bandwidth: float = 0,
+                 size: int = DEFAULT_SIZE, codes: int | None = None,
+                 verbose: bool = False) -> None:
+        super().__init__(('localhost', port), FlagsHandler)
+        self.delay = delay
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.verbose = verbose
+        self.flags = {cc: fake_gif(cc, size) for cc in country_codes(codes)}
+
+    @property
+    def base_url(self) -> str:
+        return f'http://localhost:{self.server_port}/flags'
+
+
+def start_server(port: int = 0, **options) -> FlagsServer:
+    """Serve in a daemon thread; port 0 picks a free port.
+
+    Call ``.shutdown()`` on the result to stop it.
+    """
+    server = FlagsServer(port, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('port', type=int, nargs='?', default=8000)
+    parser.add_argument('--delay', type=float, default=0,
+                        help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests answered with 503')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='bytes per second for each response body')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE,
+                        help='bytes in each flag image')
+    parser.add_argument('--codes', metavar='N', type=int,
+                        help='serve the first N codes from AA to ZZ')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    server = FlagsServer(args.port, delay=args.delay,
+                         error_rate=args.error_rate,
+                         bandwidth=args.bandwidth, size=args.size,
+                         codes=args.codes, verbose=args.verbose)
+    print(f'Serving {len(server.flags)} flags on {server.base_url} '
+          '(Ctrl-C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
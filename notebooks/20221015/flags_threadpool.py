@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+"""Download flags of top 20 countries by population
+
+ThreadPoolExecutor version
+
+Sample run::
+
+    $ python3 flags_threadpool.py
+    DE FR BD CN EG RU IN TR VN ID JP BR NG MX PK ET PH CD US IR
+    20 downloads in 0.35s
+
+"""
+
+# tag::FLAGS_THREADPOOL[]
+from concurrent import futures
+from functools import partial
+
+import httpx
+
+from flags import save_flag, get_flag, main
+from flags2_common import make_sync_client
+
+MAX_WORKERS = 20
+
+def download_one(client: httpx.Client, cc: str) -> str:
+    image = get_flag(client, cc).content
+    save_flag(image, f'{cc}.gif')
+    print(cc, end=' ', flush=True)
+    return cc
+
+def download_many(cc_list: list[str], max_workers: int = MAX_WORKERS) -> int:
+    workers = min(max_workers, len(cc_list))
+    # httpx.Client is thread safe: the threads share its connection pool
+    with make_sync_client(workers) as client, \
+         futures.ThreadPoolExecutor(workers) as executor:
+        res = executor.map(partial(download_one, client),
+                           sorted(cc_list))
+
+        return len(list(res))
+
+if __name__ == '__main__':
+    main(download_many)
+# end::FLAGS_THREADPOOL[]
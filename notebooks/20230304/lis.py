@@ -10,11 +10,25 @@
 ################ Imports and Types
 
 # tag::IMPORTS[]
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import marshal
 import math
 import operator as op
-from collections import ChainMap
+import os
+import re
+import sys
+import time
+from array import array
+from collections import ChainMap, Counter, OrderedDict, defaultdict
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from itertools import chain
-from typing import Any, TypeAlias, NoReturn
+from pathlib import Path
+from typing import Any, TextIO, TypeAlias, NoReturn
 
 Symbol: TypeAlias = str
 Atom: TypeAlias = float | int | Symbol
@@ -26,7 +40,9 @@ Expression: TypeAlias = Atom | list
 
 def parse(program: str) -> Expression:
     "Read a Scheme expression from a string."
-    return read_from_tokens(tokenize(program))
+    for exp in read_exps(program):
+        return exp
+    raise SyntaxError('unexpected EOF while reading')
 
 def tokenize(s: str) -> list[str]:
     "Convert a string into a list of tokens."
@@ -59,6 +75,46 @@ def parse_atom(token: str) -> Atom:
             return Symbol(token)
 
 
+################ Streaming reader
+
+# ``read_exps`` scans the source one line at a time and yields each
+# top-level expression as soon as it is complete, so a large program can
+# start running before it is fully read. Open lists are kept on an explicit
+# stack instead of recursing, and every token is visited once.
+
+TOKEN_RE = re.compile(r'[()]|[^\s()]+')
+
+def read_exps(source: str | TextIO) -> Iterator[Expression]:
+    "Yield the top-level expressions in a string or text file."
+    lines = io.StringIO(source) if isinstance(source, str) else source
+    filename = getattr(lines, 'name', '<string>')
+    stack: list[tuple[list, int, int, str]] = []  # open lists and locations
+    lineno = 0
+    for lineno, line in enumerate(lines, 1):
+        for match in TOKEN_RE.finditer(line):
+            token = match.group()
+            if token == '(':
+                stack.append(([], lineno, match.start() + 1, line))
+                continue
+            if token == ')':
+                if not stack:
+                    raise SyntaxError('unexpected )',
+                                      (filename, lineno, match.start() + 1,
+                                       line))
+                exp: Expression = stack.pop()[0]
+            else:
+                exp = parse_atom(token)
+            if stack:
+                stack[-1][0].append(exp)
+            else:
+                yield exp
+    if stack:
+        _, open_lineno, col, line = stack[-1]
+        raise SyntaxError(f'unexpected EOF while reading: ( at line '
+                          f'{open_lineno}, column {col} is not closed',
+                          (filename, open_lineno, col, line))
+
+
 ################ Global Environment
 
 # tag::ENV_CLASS[]
@@ -69,7 +125,10 @@ class Environment(ChainMap[Symbol, Any]):
         "Find where key is defined and change the value there."
         for map in self.maps:
             if key in map:
-                map[key] = value  # type: ignore[index]
+                if isinstance(map, Environment):  # parent of a local env
+                    map.change(key, value)
+                else:
+                    map[key] = value  # type: ignore[index]
                 return
         raise KeyError(key)
 # end::ENV_CLASS[]
@@ -113,25 +172,169 @@ def standard_env() -> Environment:
             'round': round,
             'symbol?': lambda x: isinstance(x, Symbol),
     })
+    env.update(vector_procedures())
+    env.update({
+            'memoize': Memoized,
+            'memo-stats': lambda proc: proc.stats(),
+    })
     return env
 
 
+################ Memoization
+
+# ``(define fib (memoize fib))`` rebinds a global name, so the recursive
+# calls in the body of ``fib`` go through the cache too. List arguments are
+# frozen into tuples to make them usable as keys; calls with arguments that
+# are still unhashable, such as vectors, bypass the cache.
+
+DEFAULT_MEMO_SIZE = 1024
+
+class Memoized:
+    "A procedure wrapper caching up to maxsize results, evicting the LRU."
+
+    def __init__(self, proc: Callable, maxsize: int = DEFAULT_MEMO_SIZE):
+        if maxsize < 1:
+            raise ValueError('memoize: maxsize must be >= 1')
+        self.proc = proc
+        self.maxsize = maxsize
+        self.cache: OrderedDict[tuple, Any] = OrderedDict()
+        self.hits = self.misses = self.bypasses = 0
+
+    def __call__(self, *args: Any) -> Any:
+        key = freeze(args)
+        try:
+            result = self.cache[key]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable argument
+            self.bypasses += 1
+            return self.proc(*args)
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return result
+        self.misses += 1
+        result = self.proc(*args)
+        self.cache[key] = result
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return result
+
+    def stats(self) -> list[int]:
+        "Return (hits misses bypasses size maxsize) as a Scheme list."
+        return [self.hits, self.misses, self.bypasses,
+                len(self.cache), self.maxsize]
+
+def freeze(args: tuple) -> tuple:
+    "Replace lists with tuples, recursively."
+    return tuple(freeze(x) if isinstance(x, list) else x for x in args)
+
+
+################ Numeric vectors
+
+# Vectors are ``array('d')`` buffers of floats. Whole-vector procedures run
+# in C. The elementwise operators use NumPy views of the same buffer when
+# NumPy is installed, otherwise ``map`` over ``operator`` functions: each
+# element is one rounded operation, so both give the same result. The sums
+# in ``vector-sum`` and ``dot`` always use ``math.fsum``, which is exactly
+# rounded, where NumPy's pairwise sums would depend on NumPy being there.
+# NumPy is imported on the first elementwise operation, not at startup.
+# The elementwise operators are ``vector+`` and ``vector*`` because ``+``
+# on two arrays concatenates them, and ``+`` must stay fast for numbers.
+
+Vector: TypeAlias = array
+
+def make_vector(size: int, fill: float = 0.0) -> Vector:
+    return array('d', [fill]) * size
+
+def vector_set(vec: Vector, index: int, value: float) -> None:
+    vec[index] = value
+
+def vector_map(proc: Callable, *vecs: Vector) -> Vector:
+    return array('d', map(proc, *vecs))
+
+def vector_sum(vec: Vector) -> float:
+    return math.fsum(vec)
+
+def dot(a: Vector, b: Vector) -> float:
+    check_lengths(a, b)
+    return math.fsum(map(op.mul, a, b))
+
+@functools.cache
+def load_numpy() -> Any:
+    "Import NumPy on first use; None if it is not installed."
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def elementwise(scalar_op: Callable, numpy_op: str) -> Callable:
+    "Build a vector operator that also takes a number on either side."
+    def vector_op(a: Vector | float, b: Vector | float) -> Vector:
+        size = len(a) if isinstance(a, array) else len(b)  # type: ignore
+        if isinstance(a, array) and isinstance(b, array):
+            check_lengths(a, b)
+        numpy = load_numpy()
+        if numpy is not None:
+            result = make_vector(size)
+            getattr(numpy, numpy_op)(as_numpy(numpy, a), as_numpy(numpy, b),
+                                     out=numpy.frombuffer(result))
+            return result
+        if not isinstance(a, array):
+            return array('d', map(scalar_op, [a] * size, b))  # type: ignore
+        if not isinstance(b, array):
+            return array('d', map(scalar_op, a, [b] * size))
+        return array('d', map(scalar_op, a, b))
+    return vector_op
+
+def as_numpy(numpy: Any, x: Vector | float) -> Any:
+    return numpy.frombuffer(x) if isinstance(x, array) else x
+
+def check_lengths(a: Vector, b: Vector) -> None:
+    if len(a) != len(b):
+        raise ValueError(f'vector lengths differ: {len(a)} != {len(b)}')
+
+def vector_procedures() -> dict[Symbol, Callable]:
+    return {
+        'make-vector': make_vector,
+        'vector': lambda *x: array('d', x),
+        'vector?': lambda x: isinstance(x, array),
+        'vector-length': len,
+        'vector-ref': lambda vec, i: vec[i],
+        'vector-set!': vector_set,
+        'vector-map': vector_map,
+        'vector-sum': vector_sum,
+        'vector->list': lambda vec: vec.tolist(),
+        'list->vector': lambda x: array('d', x),
+        'dot': dot,
+        'vector+': elementwise(op.add, 'add'),
+        'vector*': elementwise(op.mul, 'multiply'),
+    }
+
+
 ################ Interaction: A REPL
 
 # tag::REPL[]
-def repl(prompt: str = 'lis.py> ') -> NoReturn:
+def repl(prompt: str = 'lis.py> ',
+         backend: str = 'eval',
+         profiler: 'Profiler | None' = None) -> NoReturn:
     "A prompt-read-eval-print loop."
-    global_env = Environment({}, standard_env())
-    while True:
-        ast = parse(input(prompt))
-        val = evaluate(ast, global_env)
-        if val is not None:
-            print(lispstr(val))
+    global_env = global_environment(profiler, backend)
+    evaluator = (PROFILED_BACKENDS if profiler else BACKENDS)[backend]
+    with profiling(profiler):
+        while True:
+            ast = parse(input(prompt))
+            val = evaluator(ast, global_env)
+            if val is not None:
+                print(lispstr(val))
 
 def lispstr(exp: object) -> str:
     "Convert a Python object back into a Lisp-readable string."
     if isinstance(exp, list):
         return '(' + ' '.join(map(lispstr, exp)) + ')'
+    elif isinstance(exp, array):
+        return '#(' + ' '.join(map(str, exp)) + ')'
     else:
         return str(exp)
 # end::REPL[]
@@ -144,32 +347,46 @@ KEYWORDS = ['quote', 'if', 'lambda', 'define', 'set!']
 
 def evaluate(exp: Expression, env: Environment) -> Any:
     "Evaluate an expression in an environment."
-    match exp:
-        case int(x) | float(x):
-            return x
-        case Symbol(var):
-            return env[var]
-        case ['quote', x]:
-            return x
-        case ['if', test, consequence, alternative]:
-            if evaluate(test, env):
-                return evaluate(consequence, env)
-            else:
-                return evaluate(alternative, env)
-        case ['lambda', [*parms], *body] if body:
-            return Procedure(parms, body, env)
-        case ['define', Symbol(name), value_exp]:
-            env[name] = evaluate(value_exp, env)
-        case ['define', [Symbol(name), *parms], *body] if body:
-            env[name] = Procedure(parms, body, env)
-        case ['set!', Symbol(name), value_exp]:
-            env.change(name, evaluate(value_exp, env))
-        case [func_exp, *args] if func_exp not in KEYWORDS:
-            proc = evaluate(func_exp, env)
-            values = [evaluate(arg, env) for arg in args]
-            return proc(*values)
-        case _:
-            raise SyntaxError(lispstr(exp))
+    while True:  # calls in tail position loop here instead of recursing
+        match exp:
+            case int(x) | float(x):
+                return x
+            case Symbol(var):
+                value = env[var]
+                if value is UNASSIGNED:
+                    raise UnassignedError(var)
+                return value
+            case ['quote', x]:
+                return x
+            case ['if', test, consequence, alternative]:
+                if evaluate(test, env):
+                    exp = consequence
+                else:
+                    exp = alternative
+            case ['lambda', [*parms], *body] if body:
+                padding = padding_of(exp, parms, body)
+                return Procedure(parms, body, env, padding=padding)
+            case ['define', Symbol(name), value_exp]:
+                env[name] = evaluate(value_exp, env)
+                return None
+            case ['define', [Symbol(name), *parms], *body] if body:
+                padding = padding_of(exp, parms, body)
+                env[name] = Procedure(parms, body, env, name, padding)
+                return None
+            case ['set!', Symbol(name), value_exp]:
+                env.change(name, evaluate(value_exp, env))
+                return None
+            case [func_exp, *args] if func_exp not in KEYWORDS:
+                proc = evaluate(func_exp, env)
+                values = [evaluate(arg, env) for arg in args]
+                if not isinstance(proc, Procedure):
+                    return proc(*values)
+                env = Environment(proc.local_env(values), proc.env)
+                *init, exp = proc.body
+                for body_exp in init:
+                    evaluate(body_exp, env)
+            case _:
+                raise SyntaxError(lispstr(exp))
 # end::EVALUATE[]
 
 # tag::PROCEDURE[]
@@ -177,38 +394,1092 @@ class Procedure:
     "A user-defined Scheme procedure."
 
     def __init__(  # <1>
-        self, parms: list[Symbol], body: list[Expression], env: Environment
+        self, parms: list[Symbol], body: list[Expression], env: Environment,
+        name: Symbol = 'lambda', padding: dict[Symbol, Any] | None = None,
     ):
         self.parms = parms  # <2>
         self.body = body
         self.env = env
+        self.name = name  # for the profiler
+        if padding is None:
+            padding = local_padding(parms, body)
+        self.padding = padding  # internal defines, not yet run
 
     def __call__(self, *args: Expression) -> Any:  # <3>
-        local_env = dict(zip(self.parms, args))  # <4>
+        local_env = self.local_env(args)  # <4>
         env = Environment(local_env, self.env)  # <5>
         for exp in self.body:  # <6>
             result = evaluate(exp, env)
         return result  # <7>
+
+    def local_env(self, args: Iterable[Any]) -> dict[Symbol, Any]:
+        "Bind the parameters to args, and the internal defines to UNASSIGNED."
+        local_env = dict(zip(self.parms, args))
+        if self.padding:
+            local_env.update(self.padding)
+        return local_env
 # end::PROCEDURE[]
 
+# Internal defines are local variables from the start of the procedure
+# body, as in Scheme's ``letrec*``: all backends give them the UNASSIGNED
+# placeholder until their ``define`` runs, so using one earlier is an
+# error instead of reading a global or None.
+
+class Unassigned:
+    "The value of an internal define before it runs."
+
+    def __repr__(self) -> str:
+        return '<unassigned>'
+
+    def __reduce__(self) -> str:
+        return 'UNASSIGNED'  # unpickle as the same object
+
+UNASSIGNED = Unassigned()
+
+def local_padding(parms: list[Symbol],
+                  body: list[Expression]) -> dict[Symbol, Any]:
+    "The internal defines of a procedure body, bound to UNASSIGNED."
+    return dict.fromkeys(
+        (name for name in local_defines(body) if name not in parms),
+        UNASSIGNED)
+
+# ``evaluate`` finds the internal defines of each lambda form only once,
+# not every time the form makes a new ``Procedure``. The cache is keyed on
+# the id of the form, which is kept alive in the entry so its id is never
+# reused by another list.
+PADDINGS: dict[int, tuple[Expression, dict[Symbol, Any]]] = {}
+
+def padding_of(form: Expression,
+               parms: list[Symbol],
+               body: list[Expression]) -> dict[Symbol, Any]:
+    "Return the local_padding of a lambda or define form, cached."
+    entry = PADDINGS.get(id(form))
+    if entry is None:
+        entry = PADDINGS[id(form)] = (form, local_padding(parms, body))
+    return entry[1]
+
+class UnassignedError(LookupError):
+    "A local variable was used before its define ran."
+
+    def __init__(self, name: Symbol):
+        super().__init__(f'{name}: used before its define')
+        self.name = name
+
+
+################ Analyzer: compile expressions into closures
+
+# ``analyze`` does the pattern matching of ``evaluate`` once per expression,
+# returning a closure that takes a frame and does the actual work.
+# Procedure bodies are analyzed when the ``lambda`` or ``define`` is
+# analyzed, so calling a ``Closure`` never looks at the source lists again.
+#
+# Variables are resolved during analysis too. Parameters and internal
+# defines of each procedure live in a ``Frame``: a list holding the parent
+# frame at index 0 followed by one slot per local name. A local variable
+# compiles to a fixed (depth, index) pair; any other name is looked up in
+# the global ``Environment`` given to ``analyze``.
+#
+# A call to a ``Closure`` in tail position returns a ``TailCall`` instead of
+# calling it; ``Closure.__call__`` runs those in a loop (a trampoline).
+
+Frame: TypeAlias = list
+Analyzed: TypeAlias = Callable[[Frame | None], Any]
+
+class Scope:
+    "The local names of a procedure, known at analysis time."
+
+    def __init__(self,
+                 names: list[Symbol],
+                 parent: 'Scope | None',
+                 arity: int | None = None):
+        self.names = names
+        self.parent = parent
+        self.arity = len(names) if arity is None else arity  # parameters
+
+    def address(self, name: Symbol) -> tuple[int, int] | None:
+        "Return (depth, index) of the frame slot for name, or None if global."
+        scope: Scope | None = self
+        depth = 0
+        while scope is not None:
+            if name in scope.names:
+                return depth, scope.names.index(name) + 1
+            scope = scope.parent
+            depth += 1
+        return None
+
+    def is_define(self, name: Symbol) -> bool:
+        "Is name an internal define, which may be UNASSIGNED when read?"
+        scope: Scope | None = self
+        while scope is not None:
+            if name in scope.names:
+                return scope.names.index(name) >= scope.arity
+            scope = scope.parent
+        return False
+
+def analyze(exp: Expression,
+            env: Environment,
+            scope: Scope | None = None,
+            tail: bool = False,
+            name: Symbol = 'lambda') -> Analyzed:
+    "Compile an expression into a closure that runs in a frame."
+    match exp:
+        case int(x) | float(x):
+            return lambda frame: x
+        case Symbol(var):
+            return analyze_ref(var, env, scope)
+        case ['quote', x]:
+            return lambda frame: x
+        case ['if', test, consequence, alternative]:
+            test_fn = analyze(test, env, scope)
+            then_fn = analyze(consequence, env, scope, tail)
+            else_fn = analyze(alternative, env, scope, tail)
+            def if_(frame: Frame | None) -> Any:
+                if test_fn(frame):
+                    return then_fn(frame)
+                return else_fn(frame)
+            return if_
+        case ['lambda', [*parms], *body] if body:
+            return analyze_lambda(parms, body, env, scope, name)
+        case ['define', Symbol(var), value_exp]:
+            return analyze_define(var, analyze(value_exp, env, scope, name=var),
+                                  env, scope)
+        case ['define', [Symbol(var), *parms], *body] if body:
+            return analyze_define(var,
+                                  analyze_lambda(parms, body, env, scope, var),
+                                  env, scope)
+        case ['set!', Symbol(var), value_exp]:
+            return analyze_set(var, analyze(value_exp, env, scope, name=var),
+                               env, scope)
+        case [func_exp, *args] if func_exp not in KEYWORDS:
+            func_fn = analyze(func_exp, env, scope)
+            arg_fns = [analyze(arg, env, scope) for arg in args]
+            if tail:
+                return analyze_tail_call(func_fn, arg_fns)
+            return analyze_call(func_fn, arg_fns)
+        case _:
+            raise SyntaxError(lispstr(exp))
+
+def analyze_ref(name: Symbol, env: Environment, scope: Scope | None) -> Analyzed:
+    "Read a variable; check internal defines for UNASSIGNED."
+    ref = analyze_slot_ref(name, env, scope)
+    if scope is None or not scope.is_define(name):
+        return ref
+    def checked_ref(frame: Frame | None) -> Any:
+        value = ref(frame)
+        if value is UNASSIGNED:
+            raise UnassignedError(name)
+        return value
+    return checked_ref
+
+def analyze_slot_ref(name: Symbol,
+                     env: Environment,
+                     scope: Scope | None) -> Analyzed:
+    "Specialize variable access for the innermost frames."
+    address = scope.address(name) if scope else None
+    match address:
+        case None:
+            return lambda frame: env[name]
+        case (0, i):
+            return lambda frame: frame[i]  # type: ignore[index]
+        case (1, i):
+            return lambda frame: frame[0][i]  # type: ignore[index]
+        case (depth, i):
+            def ref(frame: Frame | None) -> Any:
+                for _ in range(depth):
+                    frame = frame[0]  # type: ignore[index]
+                return frame[i]  # type: ignore[index]
+            return ref
+
+def analyze_store(name: Symbol,
+                  scope: Scope | None) -> Callable[[Frame | None, Any], None]:
+    "Return a function that stores a value in the frame slot for name."
+    depth, i = scope.address(name)  # type: ignore[union-attr, misc]
+    def store(frame: Frame | None, value: Any) -> None:
+        for _ in range(depth):
+            frame = frame[0]  # type: ignore[index]
+        frame[i] = value  # type: ignore[index]
+    return store
+
+def analyze_define(name: Symbol,
+                   value_fn: Analyzed,
+                   env: Environment,
+                   scope: Scope | None) -> Analyzed:
+    if scope is None:
+        def define_global(frame: Frame | None) -> None:
+            env[name] = value_fn(frame)
+        return define_global
+    store = analyze_store(name, scope)
+    def define(frame: Frame | None) -> None:
+        store(frame, value_fn(frame))
+    return define
+
+def analyze_set(name: Symbol,
+                value_fn: Analyzed,
+                env: Environment,
+                scope: Scope | None) -> Analyzed:
+    if scope is None or scope.address(name) is None:
+        def set_global(frame: Frame | None) -> None:
+            env.change(name, value_fn(frame))
+        return set_global
+    store = analyze_store(name, scope)
+    def set_(frame: Frame | None) -> None:
+        store(frame, value_fn(frame))
+    return set_
+
+def analyze_lambda(parms: list[Symbol],
+                   body: list[Expression],
+                   env: Environment,
+                   scope: Scope | None,
+                   name: Symbol = 'lambda') -> Analyzed:
+    local_names = [name for name in local_defines(body) if name not in parms]
+    inner = Scope(parms + local_names, scope, len(parms))
+    *init, last = body
+    init_fns = [analyze(exp, env, inner) for exp in init]
+    last_fn = analyze(last, env, inner, tail=True)
+    if init_fns:
+        def body_fn(frame: Frame | None) -> Any:
+            for fn in init_fns:
+                fn(frame)
+            return last_fn(frame)
+    else:
+        body_fn = last_fn
+    arity = len(parms)
+    padding = [UNASSIGNED] * len(local_names)
+    closure_type = Closure if PROFILER is None else ProfiledClosure
+    return lambda frame: closure_type(arity, padding, body_fn, frame, name)
+
+def local_defines(body: list[Expression]) -> list[Symbol]:
+    "Names defined in a procedure body, not counting nested procedures."
+    names: list[Symbol] = []
+    for exp in body:
+        match exp:
+            case ['define', Symbol(name) | [Symbol(name), *_], *rest]:
+                if name not in names:
+                    names.append(name)
+                if isinstance(exp[1], Symbol):
+                    names.extend(n for n in local_defines(rest)
+                                 if n not in names)
+            case ['quote' | 'lambda', *_]:
+                pass
+            case [*subexps]:
+                names.extend(n for n in local_defines(subexps)
+                             if n not in names)
+    return names
+
+def analyze_call(func_fn: Analyzed, arg_fns: list[Analyzed]) -> Analyzed:
+    "Specialize calls with up to 3 arguments to avoid building a list."
+    match arg_fns:
+        case []:
+            return lambda frame: func_fn(frame)()
+        case [a]:
+            return lambda frame: func_fn(frame)(a(frame))
+        case [a, b]:
+            return lambda frame: func_fn(frame)(a(frame), b(frame))
+        case [a, b, c]:
+            return lambda frame: func_fn(frame)(a(frame), b(frame), c(frame))
+        case _:
+            return lambda frame: func_fn(frame)(*[f(frame) for f in arg_fns])
+
+def analyze_tail_call(func_fn: Analyzed, arg_fns: list[Analyzed]) -> Analyzed:
+    "Defer calls to a Closure to the trampoline in ``Closure.__call__``."
+    closure_type = Closure if PROFILER is None else ProfiledClosure
+    def tail_call(frame: Frame | None) -> Any:
+        proc = func_fn(frame)
+        args = [f(frame) for f in arg_fns]
+        if type(proc) is closure_type:
+            return TailCall(proc, args)
+        return proc(*args)
+    return tail_call
+
+class Closure:
+    "A user-defined Scheme procedure with an analyzed body."
+
+    __slots__ = ('arity', 'padding', 'body', 'frame', 'name')
+
+    def __init__(self,
+                 arity: int,
+                 padding: list[Unassigned],
+                 body: Analyzed,
+                 frame: Frame | None,
+                 name: Symbol = 'lambda'):
+        self.arity = arity      # number of parameters
+        self.padding = padding  # initial values of the internal defines
+        self.body = body
+        self.frame = frame
+        self.name = name        # for the profiler
+
+    def __call__(self, *args: Any) -> Any:
+        proc = self
+        while True:
+            if len(args) != proc.arity:
+                raise TypeError(f'expected {proc.arity} arguments, '
+                                f'got {len(args)}')
+            result = proc.body([proc.frame, *args, *proc.padding])
+            if type(result) is not TailCall:
+                return result
+            proc, args = result.proc, result.args
+
+class TailCall:
+    "A pending call to a Closure, returned from a call in tail position."
+
+    __slots__ = ('proc', 'args')
+
+    def __init__(self, proc: Closure, args: list[Any]):
+        self.proc = proc
+        self.args = args
+
+def execute(exp: Expression, env: Environment) -> Any:
+    "Analyze an expression and run it with env as the global environment."
+    return analyze(exp, env)(None)
+
+
+################ Bytecode VM
+
+# ``compile_scheme`` turns an expression into a ``Code`` object: a flat list
+# of alternating opcodes and arguments for a stack machine. Variables are
+# addressed like in the analyzer, with the same ``Scope`` and ``Frame``.
+# ``VM.run`` executes code on a preallocated value stack; calls between
+# ``VMClosure`` objects save the caller on a list instead of recursing in
+# Python, and ``TAIL_CALL`` replaces the current frame.
+
+(CONST, LOAD_FAST, LOAD_DEREF, LOAD_LOCAL, LOAD_DEFINED, LOAD_GLOBAL,
+ STORE_LOCAL, DEFINE_GLOBAL, SET_GLOBAL, POP, JUMP, JUMP_IF_FALSE, CLOSURE,
+ CALL, TAIL_CALL, RETURN) = range(16)
+
+STACK_EFFECT = {
+    CONST: 1, LOAD_FAST: 1, LOAD_DEREF: 1, LOAD_LOCAL: 1, LOAD_DEFINED: 1,
+    LOAD_GLOBAL: 1,
+    STORE_LOCAL: 0, DEFINE_GLOBAL: 0, SET_GLOBAL: 0, POP: -1, JUMP: 0,
+    JUMP_IF_FALSE: -1, CLOSURE: 1, RETURN: -1,
+}
+
+STACK_SIZE = 10_000
+
+class Code:
+    "Instructions of a procedure body or top-level expression."
+
+    __slots__ = ('ops', 'arity', 'padding', 'name', 'max_stack', '_depth')
+
+    def __init__(self,
+                 arity: int = 0,
+                 nlocals: int = 0,
+                 name: Symbol | None = None):
+        self.ops: list[Any] = []
+        self.arity = arity
+        self.padding = [UNASSIGNED] * nlocals
+        self.name = name  # for the profiler; None for top-level code
+        self.max_stack = 0
+        self._depth = 0  # stack depth while compiling
+
+    def emit(self, op: int, arg: Any = None) -> int:
+        "Append an instruction; return the index of its argument."
+        self.ops.extend((op, arg))
+        if op in (CALL, TAIL_CALL):
+            self._depth -= arg
+        else:
+            self._depth += STACK_EFFECT[op]
+        self.max_stack = max(self.max_stack, self._depth)
+        return len(self.ops) - 1
+
+def compile_scheme(exp: Expression) -> Code:
+    "Compile a top-level expression."
+    code = Code()
+    compile_into(code, exp, None, tail=True)
+    return code
+
+def compile_into(code: Code,
+                 exp: Expression,
+                 scope: Scope | None,
+                 tail: bool = False,
+                 name: Symbol = 'lambda') -> None:
+    "Emit instructions that push the value of exp, or return it if tail."
+    match exp:
+        case int(x) | float(x):
+            code.emit(CONST, x)
+        case Symbol(var):
+            match scope.address(var) if scope else None:
+                case None:
+                    code.emit(LOAD_GLOBAL, var)
+                case (depth, i) if scope.is_define(var):  # type: ignore
+                    code.emit(LOAD_DEFINED, (depth, i, var))
+                case (0, i):
+                    code.emit(LOAD_FAST, i)
+                case (1, i):
+                    code.emit(LOAD_DEREF, i)
+                case address:
+                    code.emit(LOAD_LOCAL, address)
+        case ['quote', x]:
+            code.emit(CONST, x)
+        case ['if', test, consequence, alternative]:
+            compile_into(code, test, scope)
+            else_jump = code.emit(JUMP_IF_FALSE)
+            depth = code._depth
+            compile_into(code, consequence, scope, tail)
+            if not tail:
+                end_jump = code.emit(JUMP)
+            code.ops[else_jump] = len(code.ops)
+            code._depth = depth
+            compile_into(code, alternative, scope, tail)
+            if not tail:
+                code.ops[end_jump] = len(code.ops)
+            return
+        case ['lambda', [*parms], *body] if body:
+            code.emit(CLOSURE, compile_lambda(parms, body, scope, name))
+        case ['define', Symbol(var), value_exp]:
+            compile_into(code, value_exp, scope, name=var)
+            compile_store(code, DEFINE_GLOBAL, var, scope)
+        case ['define', [Symbol(var), *parms], *body] if body:
+            code.emit(CLOSURE, compile_lambda(parms, body, scope, var))
+            compile_store(code, DEFINE_GLOBAL, var, scope)
+        case ['set!', Symbol(var), value_exp]:
+            compile_into(code, value_exp, scope, name=var)
+            compile_store(code, SET_GLOBAL, var, scope)
+        case [func_exp, *args] if func_exp not in KEYWORDS:
+            compile_into(code, func_exp, scope)
+            for arg in args:
+                compile_into(code, arg, scope)
+            code.emit(TAIL_CALL if tail else CALL, len(args))
+            return
+        case _:
+            raise SyntaxError(lispstr(exp))
+    if tail:
+        code.emit(RETURN)
+
+def compile_store(code: Code,
+                  global_op: int,
+                  name: Symbol,
+                  scope: Scope | None) -> None:
+    "Pop a value into a local slot or global; push None as the result."
+    address = scope.address(name) if scope else None
+    if address is None:
+        code.emit(global_op, name)
+    else:
+        code.emit(STORE_LOCAL, address)
+
+def compile_lambda(parms: list[Symbol],
+                   body: list[Expression],
+                   scope: Scope | None,
+                   name: Symbol = 'lambda') -> Code:
+    local_names = [var for var in local_defines(body) if var not in parms]
+    inner = Scope(parms + local_names, scope, len(parms))
+    code = Code(len(parms), len(local_names), name)
+    *init, last = body
+    for exp in init:
+        compile_into(code, exp, inner)
+        code.emit(POP)
+    compile_into(code, last, inner, tail=True)
+    return code
+
+class VMClosure:
+    "A user-defined Scheme procedure compiled to VM code."
+
+    __slots__ = ('code', 'frame', 'vm')
+
+    def __init__(self, code: Code, frame: Frame | None, vm: 'VM'):
+        self.code = code
+        self.frame = frame
+        self.vm = vm
+
+    def __call__(self, *args: Any) -> Any:
+        code = self.code
+        if len(args) != code.arity:
+            raise TypeError(f'expected {code.arity} arguments, '
+                            f'got {len(args)}')
+        return self.vm.run(code, [self.frame, *args, *code.padding])
+
+class VM:
+    "A stack machine running code with env as the global environment."
+
+    def __init__(self, env: Environment, stack_size: int = STACK_SIZE):
+        self.env = env
+        self.stack: list[Any] = [None] * stack_size
+        self.sp = 0  # first free slot, saved while a builtin runs
+
+    def run(self, code: Code, frame: Frame | None) -> Any:
+        base = self.sp
+        try:
+            return self._run(code, frame, base)
+        finally:
+            self.sp = base
+
+    def _run(self, code: Code, frame: Frame | None, sp: int) -> Any:
+        stack = self.stack
+        env = self.env
+        limit = len(stack)
+        if sp + code.max_stack > limit:
+            raise RecursionError('VM stack overflow')
+        calls: list[tuple[list[Any], int, Frame | None]] = []
+        ops = code.ops
+        pc = 0
+        profiler = PROFILER
+        own_base = profiler is not None and code.name is not None
+        if own_base:
+            profiler.enter(code.name)  # type: ignore[union-attr, arg-type]
+        try:
+            while True:
+                op = ops[pc]
+                arg = ops[pc + 1]
+                pc += 2
+                if op == LOAD_FAST:
+                    stack[sp] = frame[arg]  # type: ignore[index]
+                    sp += 1
+                elif op == LOAD_GLOBAL:
+                    stack[sp] = env[arg]
+                    sp += 1
+                elif op == CONST:
+                    stack[sp] = arg
+                    sp += 1
+                elif op == CALL or op == TAIL_CALL:
+                    sp -= arg
+                    args = stack[sp:sp + arg]
+                    sp -= 1
+                    proc = stack[sp]
+                    if type(proc) is VMClosure:
+                        callee = proc.code
+                        if len(args) != callee.arity:
+                            raise TypeError(f'expected {callee.arity} arguments, '
+                                            f'got {len(args)}')
+                        if sp + callee.max_stack > limit:
+                            raise RecursionError('VM stack overflow')
+                        if op == CALL:
+                            calls.append((ops, pc, frame))
+                            if profiler is not None:
+                                profiler.enter(callee.name)
+                        elif profiler is not None:
+                            if calls or own_base:
+                                profiler.replace(callee.name)
+                            else:  # a tail call from top-level code
+                                profiler.enter(callee.name)
+                                own_base = True
+                        frame = [proc.frame, *args, *callee.padding]
+                        ops = callee.ops
+                        pc = 0
+                        continue
+                    self.sp = sp
+                    stack[sp] = proc(*args)
+                    sp += 1
+                    if op == CALL:
+                        continue
+                    if not calls:  # tail call to a builtin: return its result
+                        return stack[sp - 1]
+                    if profiler is not None:
+                        profiler.exit()
+                    ops, pc, frame = calls.pop()
+                elif op == JUMP_IF_FALSE:
+                    sp -= 1
+                    if not stack[sp]:
+                        pc = arg
+                elif op == RETURN:
+                    if not calls:
+                        return stack[sp - 1]
+                    if profiler is not None:
+                        profiler.exit()
+                    ops, pc, frame = calls.pop()
+                elif op == LOAD_DEREF:
+                    stack[sp] = frame[0][arg]  # type: ignore[index]
+                    sp += 1
+                elif op == LOAD_LOCAL:
+                    depth, i = arg
+                    target = frame
+                    for _ in range(depth):
+                        target = target[0]  # type: ignore[index]
+                    stack[sp] = target[i]  # type: ignore[index]
+                    sp += 1
+                elif op == LOAD_DEFINED:
+                    depth, i, name = arg
+                    target = frame
+                    for _ in range(depth):
+                        target = target[0]  # type: ignore[index]
+                    value = target[i]  # type: ignore[index]
+                    if value is UNASSIGNED:
+                        raise UnassignedError(name)
+                    stack[sp] = value
+                    sp += 1
+                elif op == JUMP:
+                    pc = arg
+                elif op == POP:
+                    sp -= 1
+                elif op == CLOSURE:
+                    stack[sp] = VMClosure(arg, frame, self)
+                    sp += 1
+                elif op == STORE_LOCAL:
+                    depth, i = arg
+                    target = frame
+                    for _ in range(depth):
+                        target = target[0]  # type: ignore[index]
+                    target[i] = stack[sp - 1]  # type: ignore[index]
+                    stack[sp - 1] = None
+                elif op == DEFINE_GLOBAL:
+                    env[arg] = stack[sp - 1]
+                    stack[sp - 1] = None
+                elif op == SET_GLOBAL:
+                    env.change(arg, stack[sp - 1])
+                    stack[sp - 1] = None
+                else:
+                    raise ValueError(f'unknown opcode: {op}')
+        finally:  # leave the profiler frames of this run
+            if profiler is not None:
+                for _ in range(len(calls) + own_base):
+                    profiler.exit()
+
+def execute_vm(exp: Expression, env: Environment) -> Any:
+    "Compile an expression and run it on a VM with env as globals."
+    return VM(env).run(compile_scheme(exp), None)
+
+
+################ Parse cache
+
+# ``load_program`` keeps the parsed top-level expressions of each source
+# file in a ``__lispycache__`` directory next to it, written with
+# ``marshal``. The cache file name includes a hash of the source, of
+# ``CACHE_VERSION`` and of the Python version (which defines the marshal
+# format), so any change to them is a cache miss. Older cache files for the
+# same source file name are removed when a new one is written.
+#
+# On a miss the expressions are yielded as they are parsed, so the program
+# starts as soon as its first expression is read, as with ``--no-cache``;
+# the cache is written only after the last expression was read.
+
+CACHE_VERSION = 1  # increment when the reader or the parsed form changes
+CACHE_DIR_NAME = '__lispycache__'
+
+def cache_path(path: Path, source: bytes) -> Path:
+    "Where the parsed form of source, read from path, is cached."
+    key = hashlib.sha256(source)
+    key.update(f'{CACHE_VERSION}:{sys.implementation.cache_tag}'.encode())
+    return path.parent / CACHE_DIR_NAME / f'{path.name}.{key.hexdigest()}.bin'
+
+def load_program(path: str | Path) -> Iterator[Expression]:
+    "Yield the expressions of a source file, parsed or from the cache."
+    path = Path(path)
+    source = path.read_bytes()
+    cached = cache_path(path, source)
+    try:
+        program = marshal.loads(cached.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        pass  # missing or unreadable: parse again
+    else:
+        yield from program
+        return
+    program = []
+    with open(path) as fp:
+        for exp in read_exps(fp):
+            program.append(exp)
+            yield exp
+    try:
+        save_program(cached, program)
+    except OSError:
+        pass  # a read-only directory just means no caching
+
+def save_program(cached: Path, program: list[Expression]) -> None:
+    cached.parent.mkdir(exist_ok=True)
+    name = cached.name.rsplit('.', 2)[0]  # the source file name
+    for stale in cached.parent.glob(f'{name}.*.bin'):
+        if stale.name.rsplit('.', 2)[0] == name:
+            stale.unlink(missing_ok=True)
+    temp = cached.with_suffix(f'.{os.getpid()}.tmp')
+    temp.write_bytes(marshal.dumps(program))
+    os.replace(temp, cached)  # readers never see a partial file
+
+
+################ Profiler
+
+# While a program runs under ``profiling(profiler)``, each backend reports
+# the calls to its own procedures to ``PROFILER`` where it makes them:
+# ``enter`` on a call, ``exit`` on return, and ``replace`` on a tail call,
+# which takes over the frame of the caller, so tail calls still run in
+# constant space. A procedure is named after the variable its ``lambda``
+# is bound to by ``define`` or ``set!``, global or local; others are named
+# ``lambda``. The builtins are wrapped in timing functions when the global
+# environment is created.
+#
+# Profiling is turned on by swapping in profiled code, so ``evaluate``,
+# ``Procedure`` and ``Closure`` never check for a profiler: ``run`` and
+# ``repl`` use ``evaluate_profiled`` for the eval backend, which makes
+# ``ProfiledProcedure`` objects, and ``analyze`` makes ``ProfiledClosure``
+# objects when it runs under ``profiling``. The VM tests its ``profiler``
+# local on calls and returns.
+
+PROFILER: 'Profiler | None' = None
+
+@contextlib.contextmanager
+def profiling(profiler: 'Profiler | None') -> Iterator[None]:
+    "Report calls to profiler while the block runs, if it is not None."
+    global PROFILER
+    saved, PROFILER = PROFILER, profiler
+    try:
+        yield
+    finally:
+        PROFILER = saved
+
+def evaluate_profiled(exp: Expression,
+                      env: Environment,
+                      tail: bool = False) -> Any:
+    """Like ``evaluate``, but make procedures that report to PROFILER.
+
+    tail is True for the last expression of a ``ProfiledProcedure`` body:
+    a call to another one there replaces the profiler frame of the caller.
+    """
+    while True:
+        match exp:
+            case int(x) | float(x):
+                return x
+            case Symbol(var):
+                value = env[var]
+                if value is UNASSIGNED:
+                    raise UnassignedError(var)
+                return value
+            case ['quote', x]:
+                return x
+            case ['if', test, consequence, alternative]:
+                if evaluate_profiled(test, env):
+                    exp = consequence
+                else:
+                    exp = alternative
+            case ['lambda', [*parms], *body] if body:
+                padding = padding_of(exp, parms, body)
+                return ProfiledProcedure(parms, body, env, padding=padding)
+            case ['define', Symbol(name), ['lambda', [*parms], *body]] if body:
+                padding = padding_of(exp, parms, body)
+                env[name] = ProfiledProcedure(parms, body, env, name, padding)
+                return None
+            case ['define', Symbol(name), value_exp]:
+                env[name] = evaluate_profiled(value_exp, env)
+                return None
+            case ['define', [Symbol(name), *parms], *body] if body:
+                padding = padding_of(exp, parms, body)
+                env[name] = ProfiledProcedure(parms, body, env, name, padding)
+                return None
+            case ['set!', Symbol(name), ['lambda', [*parms], *body]] if body:
+                padding = padding_of(exp, parms, body)
+                proc = ProfiledProcedure(parms, body, env, name, padding)
+                env.change(name, proc)
+                return None
+            case ['set!', Symbol(name), value_exp]:
+                env.change(name, evaluate_profiled(value_exp, env))
+                return None
+            case [func_exp, *args] if func_exp not in KEYWORDS:
+                proc = evaluate_profiled(func_exp, env)
+                values = [evaluate_profiled(arg, env) for arg in args]
+                if not tail or type(proc) is not ProfiledProcedure:
+                    return proc(*values)  # in a new profiler frame, if any
+                PROFILER.replace(proc.name)  # type: ignore[union-attr]
+                env = Environment(proc.local_env(values), proc.env)
+                *init, exp = proc.body
+                for body_exp in init:
+                    evaluate_profiled(body_exp, env)
+            case _:
+                raise SyntaxError(lispstr(exp))
+
+class ProfiledProcedure(Procedure):
+    "A Procedure that times its calls in a new PROFILER frame."
+
+    def __call__(self, *args: Expression) -> Any:
+        profiler = PROFILER
+        if profiler is None:  # called after the profiled run
+            return super().__call__(*args)
+        profiler.enter(self.name)
+        try:
+            env = Environment(self.local_env(args), self.env)
+            *init, last = self.body
+            for exp in init:
+                evaluate_profiled(exp, env)
+            return evaluate_profiled(last, env, tail=True)
+        finally:
+            profiler.exit()
+
+class ProfiledClosure(Closure):
+    "A Closure that times its calls, and its tail calls, in PROFILER."
+
+    __slots__ = ()
+
+    def __call__(self, *args: Any) -> Any:
+        profiler = PROFILER
+        if profiler is None:  # called after the profiled run
+            return super().__call__(*args)
+        proc: Closure = self
+        profiler.enter(proc.name)
+        try:
+            while True:
+                if len(args) != proc.arity:
+                    raise TypeError(f'expected {proc.arity} arguments, '
+                                    f'got {len(args)}')
+                result = proc.body([proc.frame, *args, *proc.padding])
+                if type(result) is not TailCall:
+                    return result
+                proc, args = result.proc, result.args
+                profiler.replace(proc.name)
+        finally:
+            profiler.exit()
+
+class Profiler:
+    "Call counts, cumulative and self times of named procedures."
+
+    def __init__(self) -> None:
+        self.calls: Counter[str] = Counter()
+        self.cumulative: defaultdict[str, float] = defaultdict(float)
+        self.self_time: defaultdict[str, float] = defaultdict(float)
+        self.stacks: defaultdict[str, float] = defaultdict(float)
+        self.max_depth = 0
+        self._active: Counter[str] = Counter()  # recursive calls in progress
+        # [name, stack key, start time, time in callees]
+        self._stack: list[list[Any]] = []
+
+    def environment(self) -> Environment:
+        "A global environment with all the builtins wrapped."
+        builtins = {name: self.wrap(name, value) if callable(value) else value
+                    for name, value in standard_env().items()}
+        return Environment({}, builtins)
+
+    def wrap(self, name: Symbol, proc: Callable) -> Callable:
+        def profiled(*args: Any) -> Any:
+            self.enter(name)
+            try:
+                return proc(*args)
+            finally:
+                self.exit()
+        return profiled
+
+    def enter(self, name: Symbol) -> None:
+        "Start timing a call to name."
+        stack = self._stack
+        key = f'{stack[-1][1]};{name}' if stack else name
+        self._active[name] += 1
+        self.max_depth = max(self.max_depth, len(stack) + 1)
+        stack.append([name, key, time.perf_counter(), 0.0])
+
+    def exit(self) -> None:
+        "Stop timing the innermost call."
+        name, key, t0, in_callees = self._stack.pop()
+        elapsed = time.perf_counter() - t0
+        self._active[name] -= 1
+        self.calls[name] += 1
+        self.self_time[name] += elapsed - in_callees
+        self.stacks[key] += elapsed - in_callees
+        if not self._active[name]:  # count recursion only once
+            self.cumulative[name] += elapsed
+        if self._stack:
+            self._stack[-1][3] += elapsed
+
+    def replace(self, name: Symbol) -> None:
+        "The innermost call made a tail call to name."
+        self.exit()
+        self.enter(name)
+
+    def report(self, file: TextIO | None = None, limit: int = 20) -> None:
+        "Print the procedures with the highest cumulative time."
+        file = file or sys.stderr
+        ranking = sorted(self.calls, key=self.cumulative.__getitem__,
+                         reverse=True)
+        print(f'{"calls":>10} {"cumtime":>10} {"selftime":>10}  procedure',
+              file=file)
+        for name in ranking[:limit]:
+            print(f'{self.calls[name]:10} {self.cumulative[name]:10.4f} '
+                  f'{self.self_time[name]:10.4f}  {name}', file=file)
+        print(f'maximum depth: {self.max_depth}', file=file)
+
+    def write_collapsed(self, path: str | Path) -> None:
+        "Write self times in microseconds in the flamegraph.pl input format."
+        with open(path, 'w') as fp:
+            for key, seconds in sorted(self.stacks.items()):
+                fp.write(f'{key} {round(seconds * 1e6)}\n')
+
+def global_environment(profiler: Profiler | None = None,
+                       backend: str = 'eval') -> Environment:
+    if profiler is None:
+        env = Environment({}, standard_env())
+    else:
+        env = profiler.environment()
+    if backend == 'eval':  # only a Procedure can be sent to a worker
+        builtins = builtins_of(env)
+        par_map_proc = functools.partial(par_map, builtins=builtins)
+        if profiler is not None:
+            par_map_proc = profiler.wrap('par-map', par_map_proc)
+        builtins['par-map'] = par_map_proc
+    return env
+
+
+################ Parallel map
+
+# ``(par-map proc list [workers])`` splits the list in batches and maps each
+# batch in a worker process. A ``Procedure`` can't be pickled because its
+# environment holds the builtins, so ``export_procedure`` encodes the
+# procedure as its source plus the variables it can reach: every
+# dictionary in its environment chain, except the builtins, which are
+# referred to by name and rebuilt in the worker. Each batch carries one
+# copy of the encoded procedure. Only procedures from the ``eval`` backend
+# can be exported, so ``par-map`` is only defined there; other values that
+# can't be encoded become ``Unavailable`` placeholders, which fail only if
+# the worker actually calls them.
+
+PAR_MAP_BATCHES_PER_WORKER = 4
+
+def par_map(proc: Callable,
+            items: list,
+            workers: int | None = None,
+            *,
+            builtins: dict[Symbol, Any]) -> list:
+    "Map proc over items in a pool of worker processes, keeping the order."
+    workers = workers or os.cpu_count() or 1
+    if not items:
+        return []
+    encoded = export_procedure(proc, builtins)
+    size = -(-len(items) // (workers * PAR_MAP_BATCHES_PER_WORKER))
+    batches = [items[i:i + size] for i in range(0, len(items), size)]
+    with ProcessPoolExecutor(workers) as pool:
+        results = pool.map(par_map_batch, [encoded] * len(batches), batches)
+        return list(chain.from_iterable(results))
+
+def par_map_batch(encoded: tuple, batch: list) -> list:
+    proc = import_procedure(encoded)
+    return [proc(item) for item in batch]
+
+class Unavailable:
+    "Stands for a value that could not be sent to a worker process."
+
+    def __init__(self, description: str):
+        self.description = description
+
+    def __call__(self, *args: Any) -> NoReturn:
+        raise TypeError(f'not available in par-map worker: {self.description}')
+
+def builtins_of(env: Environment) -> dict:
+    "Find the dictionary of builtins at the root of an environment chain."
+    root = env.maps[-1]
+    while isinstance(root, Environment):
+        root = root.maps[-1]
+    return root
+
+def export_procedure(proc: Callable, builtins: dict[Symbol, Any]) -> tuple:
+    "Encode proc as picklable data: (procedure, {dict id: variables})."
+    builtin_names = {id(value): name for name, value in builtins.items()
+                     if callable(value)}
+    pending: dict[int, dict] = {}
+    tables: dict[int, dict] = {}
+
+    def export_env(env: Environment) -> list:
+        chain = []
+        for map in env.maps:
+            if isinstance(map, Environment):
+                chain.append(('env', export_env(map)))
+            elif map is builtins:
+                chain.append(('builtins',))
+            else:
+                if id(map) not in tables:
+                    pending[id(map)] = map  # type: ignore[assignment]
+                chain.append(('dict', id(map)))
+        return chain
+
+    def export_value(value: Any) -> tuple:
+        if isinstance(value, Procedure):
+            return ('proc', value.parms, value.body, export_env(value.env))
+        if isinstance(value, list):
+            return ('list', [export_value(x) for x in value])
+        if id(value) in builtin_names:
+            return ('builtin', builtin_names[id(value)])
+        if callable(value):
+            return ('unavailable', lispstr(value))
+        return ('atom', value)
+
+    encoded = export_value(proc)
+    if encoded[0] == 'unavailable':
+        raise TypeError('par-map needs a builtin or a procedure '
+                        'from the eval backend')
+    while pending:
+        key, map = pending.popitem()
+        tables[key] = {}  # mark as exported before visiting the values
+        tables[key] = {name: export_value(v) for name, v in map.items()}
+    return encoded, tables
+
+def import_procedure(encoded: tuple) -> Callable:
+    "Rebuild a procedure encoded by export_procedure."
+    proc, tables = encoded
+    builtins = builtins_of(global_environment())
+    dicts: dict[int, dict] = {key: {} for key in tables}
+
+    def import_env(chain: list) -> Environment:
+        maps: list[dict] = []
+        for kind, *args in chain:
+            if kind == 'env':
+                maps.append(import_env(args[0]))  # type: ignore[arg-type]
+            elif kind == 'builtins':
+                maps.append(builtins)
+            else:
+                maps.append(dicts[args[0]])
+        return Environment(*maps)
+
+    def import_value(value: tuple) -> Any:
+        match value:
+            case ('proc', parms, body, chain):
+                return Procedure(parms, body, import_env(chain))
+            case ('list', items):
+                return [import_value(x) for x in items]
+            case ('builtin', name):
+                return builtins[name]
+            case ('unavailable', description):
+                return Unavailable(description)
+            case ('atom', atom):
+                return atom
+
+    for key, variables in tables.items():
+        dicts[key].update((name, import_value(v))
+                          for name, v in variables.items())
+    return import_value(proc)
+
 
 ################ command-line interface
 
-def run(source: str) -> Any:
-    global_env = Environment({}, standard_env())
-    tokens = tokenize(source)
-    while tokens:
-        exp = read_from_tokens(tokens)
-        result = evaluate(exp, global_env)
+BACKENDS: dict[str, Callable[[Expression, Environment], Any]] = {
+    'eval': evaluate,
+    'closure': execute,
+    'vm': execute_vm,
+}
+
+PROFILED_BACKENDS = {**BACKENDS, 'eval': evaluate_profiled}
+
+def run(source: str | TextIO,
+        backend: str = 'eval',
+        profiler: Profiler | None = None) -> Any:
+    return run_exps(read_exps(source), backend, profiler)
+
+def run_exps(exps: Iterable[Expression],
+             backend: str = 'eval',
+             profiler: Profiler | None = None) -> Any:
+    global_env = global_environment(profiler, backend)
+    evaluator = (PROFILED_BACKENDS if profiler else BACKENDS)[backend]
+    result = None
+    with profiling(profiler):
+        for exp in exps:
+            result = evaluator(exp, global_env)
     return result
 
 def main(args: list[str]) -> None:
-    if len(args) == 1:
-        with open(args[0]) as fp:
-            run(fp.read())
-    else:
-        repl()
+    parser = argparse.ArgumentParser(description='Lispy Scheme interpreter.')
+    parser.add_argument('path', nargs='?',
+                        help='Scheme source file to run (default: REPL)')
+    parser.add_argument('-b', '--backend', choices=BACKENDS, default='eval',
+                        help='how expressions are run (default: eval)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f'do not read or write {CACHE_DIR_NAME}')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='print call counts and times to stderr')
+    parser.add_argument('--collapsed', metavar='FILE',
+                        help='write collapsed stacks to FILE (implies -p)')
+    opts = parser.parse_args(args)
+    profiler = Profiler() if opts.profile or opts.collapsed else None
+    try:
+        if not opts.path:
+            repl(backend=opts.backend, profiler=profiler)
+        elif opts.no_cache:
+            with open(opts.path) as fp:
+                run(fp, opts.backend, profiler)
+        else:
+            run_exps(load_program(opts.path), opts.backend, profiler)
+    finally:  # also when the REPL ends or the program fails
+        if profiler:
+            profiler.report()
+            if opts.collapsed:
+                profiler.write_collapsed(opts.collapsed)
 
 if __name__ == '__main__':
-    import sys
     main(sys.argv[1:])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Compare the speed of the lis.py backends on Scheme microbenchmarks.
+
+Sample run::
+
+    $ ./lis_bench.py
+    program           eval   closure        vm
+    fib              0.554     0.069     0.135
+    ackermann        1.663     0.384     0.369
+    list-build       0.049     0.012     0.012
+    tak              1.663     0.242     0.526
+    loop             3.748     0.533     0.660
+
+Each time is the best of ``REPEAT`` runs, in seconds. Pass backend names
+as arguments to time only those.
+"""
+
+import sys
+import time
+
+from lis import BACKENDS, run
+
+REPEAT = 3
+
+PROGRAMS = {
+    'fib': """
+        (define (fib n)
+            (if (< n 2)
+                n
+                (+ (fib (- n 1)) (fib (- n 2)))))
+        (fib 20)
+    """,
+    'ackermann': """
+        (define (ack m n)
+            (if (= m 0)
+                (+ n 1)
+                (if (= n 0)
+                    (ack (- m 1) 1)
+                    (ack (- m 1) (ack m (- n 1))))))
+        (ack 3 5)
+    """,
+    'list-build': """
+        (define (range a b)
+            (if (>= a b)
+                (quote ())
+                (cons a (range (+ a 1) b))))
+        (define (sum xs)
+            (if (null? xs)
+                0
+                (+ (car xs) (sum (cdr xs)))))
+        (sum (map (lambda (n) (* n n)) (range 0 400)))
+    """,
+    'tak': """
+        (define (tak x y z)
+            (if (not (< y x))
+                z
+                (tak (tak (- x 1) y z)
+                     (tak (- y 1) z x)
+                     (tak (- z 1) x y))))
+        (tak 18 12 6)
+    """,
+    'loop': """
+        (define (loop i acc)
+            (if (= i 0)
+                acc
+                (loop (- i 1) (+ acc i))))
+        (loop 100000 0)
+    """,
+}
+
+
+def best_time(source: str, backend: str) -> float:
+    times = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        run(source, backend)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(backends: list[str]) -> None:
+    sys.setrecursionlimit(100_000)
+    print(f'{"program":12}', *(f'{b:>9}' for b in backends))
+    for name, source in PROGRAMS.items():
+        times = (best_time(source, b) for b in backends)
+        print(f'{name:12}', *(f'{t:9.3f}' for t in times))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or list(BACKENDS))
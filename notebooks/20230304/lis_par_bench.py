@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""Measure how par-map in lis.py scales with the number of worker processes.
+
+Each item of the list is a CPU-bound call to a naive ``fib``, run with
+``map`` for the baseline and with ``par-map`` for 1 to N workers.
+
+Usage::
+
+    $ ./lis_par_bench.py [MAX_WORKERS]
+
+MAX_WORKERS defaults to the number of CPUs.
+"""
+
+import os
+import sys
+import time
+
+from lis import run
+
+SETUP = """
+(define (fib n)
+    (if (< n 2)
+        n
+        (+ (fib (- n 1)) (fib (- n 2)))))
+(define (range a b)
+    (if (>= a b) (quote ()) (cons a (range (+ a 1) b))))
+(define items (map (lambda (i) 16) (range 0 32)))
+"""
+
+
+def timed(source: str) -> float:
+    t0 = time.perf_counter()
+    run(SETUP + source)
+    return time.perf_counter() - t0
+
+
+def main(max_workers: int) -> None:
+    baseline = timed('(map fib items)')
+    print(f'{"workers":>7} {"seconds":>8} {"speedup":>8}')
+    print(f'{"map":>7} {baseline:8.2f} {1:8.2f}')
+    for workers in range(1, max_workers + 1):
+        elapsed = timed(f'(par-map fib items {workers})')
+        print(f'{workers:7} {elapsed:8.2f} {baseline / elapsed:8.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count() or 1)
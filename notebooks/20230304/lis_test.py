@@ -0,0 +1,423 @@
+from pytest import importorskip, mark, raises
+
+import lis
+from lis import (BACKENDS, CACHE_DIR_NAME, Memoized, Profiler, UnassignedError,
+                 builtins_of, evaluate, export_procedure, global_environment,
+                 load_program, read_exps, run, run_exps)
+
+backends = mark.parametrize('backend', sorted(BACKENDS))
+
+
+@backends
+@mark.parametrize('source, expected', [
+    ('7', 7),
+    ('(quote (1 2 3))', [1, 2, 3]),
+    ('(+ 1 2)', 3),
+    ('(if (< 1 2) 10 20)', 10),
+    ('(if (> 1 2) 10 20)', 20),
+    ('((lambda (x y) (* x y)) 6 7)', 42),
+    ('(define x 3) (set! x 4) x', 4),
+    ('(define (double n) (* 2 n)) (double 21)', 42),
+    ('(map (lambda (n) (* n n)) (list 1 2 3))', [1, 4, 9]),
+    ('(define (f) (define y 5) (+ y 1)) (f)', 6),
+])
+def test_run(backend: str, source: str, expected: object) -> None:
+    assert run(source, backend) == expected
+
+
+fib_src = """
+(define (fib n)
+    (if (< n 2)
+        n
+        (+ (fib (- n 1)) (fib (- n 2)))))
+(fib 15)
+"""
+
+counter_src = """
+(define (make-counter)
+    (define count 0)
+    (lambda () (set! count (+ count 1)) count))
+(define c1 (make-counter))
+(define c2 (make-counter))
+(c1) (c1) (c2)
+(list (c1) (c2))
+"""
+
+
+@backends
+def test_fib(backend: str) -> None:
+    assert run(fib_src, backend) == 610
+
+
+@backends
+def test_closures_keep_own_state(backend: str) -> None:
+    assert run(counter_src, backend) == [3, 2]
+
+
+@backends
+def test_set_undefined(backend: str) -> None:
+    with raises(KeyError):
+        run('(set! nope 1)', backend)
+
+
+@backends
+def test_bad_syntax(backend: str) -> None:
+    with raises(SyntaxError):
+        run('(lambda (x))', backend)
+
+
+loop_src = """
+(define (count-down n acc)
+    (if (= n 0)
+        acc
+        (count-down (- n 1) (+ acc 1))))
+(count-down 20000 0)
+"""
+
+mutual_src = """
+(define (even? n) (if (= n 0) 1 (odd? (- n 1))))
+(define (odd? n) (if (= n 0) 0 (even? (- n 1))))
+(even? 20001)
+"""
+
+
+@backends
+def test_tail_calls_run_in_constant_stack(backend: str) -> None:
+    assert run(loop_src, backend) == 20000
+
+
+@backends
+def test_mutual_tail_recursion(backend: str) -> None:
+    assert run(mutual_src, backend) == 0
+
+
+nested_src = """
+(define n 100)
+(define (adder a)
+    (lambda (b)
+        (lambda (c)
+            (set! a (+ a 1))
+            (+ (+ n a) (+ b c)))))
+(define add (adder 1))
+(list ((add 10) 100) ((add 10) 100))
+"""
+
+
+@backends
+def test_nested_scopes(backend: str) -> None:
+    assert run(nested_src, backend) == [212, 213]
+
+
+@backends
+def test_local_define_shadows_global(backend: str) -> None:
+    source = '(define x 1) (define (f) (define x 2) x) (list (f) x)'
+    assert run(source, backend) == [2, 1]
+
+
+@backends
+def test_local_define_used_before_it_runs(backend: str) -> None:
+    source = '(define x 1) (define (f) (define y x) (define x 2) y) (f)'
+    with raises(UnassignedError, match='x: used before its define'):
+        run(source, backend)
+
+
+@backends
+def test_inner_procedure_reads_later_define(backend: str) -> None:
+    source = '''
+        (define (f) (define (g) n) (define n 7) (g))
+        (f)
+    '''
+    assert run(source, backend) == 7
+
+
+def test_eval_finds_internal_defines_once_per_lambda(monkeypatch) -> None:
+    bodies = []
+    local_defines = lis.local_defines
+    def counting(body: list) -> list:
+        bodies.append(body)
+        return local_defines(body)
+    monkeypatch.setattr(lis, 'local_defines', counting)
+    source = '''
+        (define (loop n acc)
+            (if (= n 0)
+                acc
+                (loop (- n 1) ((lambda (x) (define y (* x 2)) y) acc))))
+        (loop 10 1)
+    '''
+    assert run(source, 'eval') == 1024
+    assert len(bodies) < 10  # not once per closure made in the loop
+
+
+def test_read_exps_is_incremental() -> None:
+    lines_read = []
+    def lines():
+        for line in ['(define x 1)\n', '(+ x\n', '  2)\n', ')']:
+            lines_read.append(line)
+            yield line
+    reader = read_exps(lines())  # type: ignore[arg-type]
+    assert next(reader) == ['define', 'x', 1]
+    assert len(lines_read) == 1  # the reader did not look ahead
+    assert next(reader) == ['+', 'x', 2]
+    assert len(lines_read) == 3
+
+
+@mark.parametrize('source, lineno, offset', [
+    ('(+ 1 2)\n  (* 3 4))', 2, 10),
+    ('(+ 1 2)\n(list\n  (* 3 4)', 2, 1),
+])
+def test_read_exps_syntax_error_location(
+    source: str, lineno: int, offset: int
+) -> None:
+    with raises(SyntaxError) as excinfo:
+        list(read_exps(source))
+    assert excinfo.value.lineno == lineno
+    assert excinfo.value.offset == offset
+
+
+def test_run_file(tmp_path) -> None:
+    path = tmp_path / 'fib.scm'
+    path.write_text(fib_src)
+    with open(path) as fp:
+        assert run(fp) == 610
+
+
+@backends
+def test_deep_recursion_is_an_error(backend: str) -> None:
+    source = """
+    (define (depth n) (if (= n 0) 0 (+ 1 (depth (- n 1)))))
+    (depth 100000)
+    """
+    with raises(RecursionError):
+        run(source, backend)
+
+
+def test_load_program_uses_cache(tmp_path, monkeypatch) -> None:
+    path = tmp_path / 'fib.scm'
+    path.write_text(fib_src)
+    program = list(load_program(path))
+    assert len(list((tmp_path / CACHE_DIR_NAME).iterdir())) == 1
+
+    def fail(source):
+        raise AssertionError('source was parsed again')
+    monkeypatch.setattr(lis, 'read_exps', fail)
+    assert list(load_program(path)) == program
+    assert run_exps(program) == 610
+
+
+def test_load_program_invalidates_cache(tmp_path) -> None:
+    path = tmp_path / 'prog.scm'
+    path.write_text('(+ 1 2)')
+    assert list(load_program(path)) == [['+', 1, 2]]
+    path.write_text('(* 3 4)')
+    assert list(load_program(path)) == [['*', 3, 4]]
+    assert len(list((tmp_path / CACHE_DIR_NAME).iterdir())) == 1
+
+
+def test_load_program_keys_cache_on_file_name(tmp_path, monkeypatch) -> None:
+    (tmp_path / 'prog.scm').write_text('(+ 1 2)')
+    (tmp_path / 'prog.lisp').write_text('(* 3 4)')
+    list(load_program(tmp_path / 'prog.scm'))
+    list(load_program(tmp_path / 'prog.lisp'))
+    assert len(list((tmp_path / CACHE_DIR_NAME).iterdir())) == 2
+
+    def fail(source):
+        raise AssertionError('source was parsed again')
+    monkeypatch.setattr(lis, 'read_exps', fail)
+    assert list(load_program(tmp_path / 'prog.scm')) == [['+', 1, 2]]
+    assert list(load_program(tmp_path / 'prog.lisp')) == [['*', 3, 4]]
+
+
+def test_load_program_streams_on_cache_miss(tmp_path) -> None:
+    path = tmp_path / 'prog.scm'
+    path.write_text('(+ 1 2)\n(* 3 4)\n(oops')
+    exps = load_program(path)
+    assert next(exps) == ['+', 1, 2]  # runs before the error is found
+    assert next(exps) == ['*', 3, 4]
+    with raises(SyntaxError):
+        next(exps)
+    assert not list(tmp_path.glob(f'{CACHE_DIR_NAME}/*'))
+
+
+@backends
+@mark.parametrize('source, expected', [
+    ('(vector-ref (make-vector 3 1.5) 2)', 1.5),
+    ('(vector-length (make-vector 4))', 4),
+    ('(vector->list (vector+ (vector 1 2) (vector 10 20)))', [11.0, 22.0]),
+    ('(vector->list (vector* 2 (vector 1 2)))', [2.0, 4.0]),
+    ('(vector->list (vector-map (lambda (x) (* x x)) (vector 1 2 3)))',
+     [1.0, 4.0, 9.0]),
+    ('(vector-sum (list->vector (list 1 2 3.5)))', 6.5),
+    ('(dot (vector 1 2 3) (vector 4 5 6))', 32.0),
+    ('(define v (make-vector 2)) (vector-set! v 1 7) (vector->list v)',
+     [0.0, 7.0]),
+])
+def test_vectors(backend: str, source: str, expected: object) -> None:
+    assert run(source, backend) == expected
+
+
+def test_vector_lengths_must_match() -> None:
+    with raises(ValueError):
+        run('(dot (vector 1 2) (vector 1 2 3))')
+
+
+@mark.parametrize('use_numpy', [False, True])
+def test_vectors_same_with_or_without_numpy(use_numpy: bool,
+                                            monkeypatch) -> None:
+    if use_numpy:
+        importorskip('numpy')
+    else:
+        monkeypatch.setattr(lis, 'load_numpy', lambda: None)
+    source = '''
+        (define v (vector 1e16 1 -1e16 0.1))
+        (list (vector-sum v) (dot v (vector 1 1 1 1))
+              (vector->list (vector+ v 0.2)) (vector->list (vector* 3 v)))
+    '''
+    assert run(source) == [1.1, 1.1,
+                           [1e16 + 0.2, 1.2, -1e16 + 0.2, 0.1 + 0.2],
+                           [3e16, 3.0, -3e16, 3 * 0.1]]
+
+
+@backends
+def test_profiler(backend: str, tmp_path) -> None:
+    profiler = Profiler()
+    assert run(fib_src, backend, profiler) == 610
+    assert profiler.calls['fib'] == 1973
+    assert profiler.calls['+'] == 986
+    assert profiler.max_depth == 16  # 15 nested fib calls, then a builtin
+    assert profiler.self_time['fib'] <= profiler.cumulative['fib']
+    path = tmp_path / 'fib.collapsed'
+    profiler.write_collapsed(path)
+    stacks = dict(line.rsplit(' ', 1) for line in path.read_text().splitlines())
+    assert 'fib;fib;fib;<' in stacks
+
+
+@backends
+def test_profiler_keeps_tail_calls(backend: str) -> None:
+    source = '''
+        (define (count-down n) (if (= n 0) 0 (count-down (- n 1))))
+        (count-down 5000)
+    '''
+    profiler = Profiler()
+    assert run(source, backend, profiler) == 0
+    assert profiler.calls['count-down'] == 5001
+    assert profiler.max_depth == 2  # each tail call replaces the caller
+
+
+@backends
+def test_profiler_names_set_and_local_procedures(backend: str) -> None:
+    source = '''
+        (define f 0)
+        (set! f (lambda (n) (define (inner m) (* m 2)) (inner n)))
+        (define g (lambda (n) (define twice (lambda (m) (* m 2))) (twice n)))
+        (list (f 1) (f 2) (g 3) ((lambda (x) x) 3))
+    '''
+    profiler = Profiler()
+    assert run(source, backend, profiler) == [2, 4, 6, 3]
+    assert profiler.calls['f'] == 2
+    assert profiler.calls['inner'] == 2
+    assert profiler.calls['g'] == 1
+    assert profiler.calls['twice'] == 1
+    assert profiler.calls['lambda'] == 1
+
+
+@mark.parametrize('backend, plain, profiled', [
+    ('eval', lis.Procedure, lis.ProfiledProcedure),
+    ('closure', lis.Closure, lis.ProfiledClosure),
+])
+def test_profiled_procedures_only_when_profiling(backend: str, plain: type,
+                                                 profiled: type) -> None:
+    assert type(run('(lambda (x) (* x 2))', backend)) is plain
+    proc = run('(lambda (x) (* x 2))', backend, Profiler())
+    assert type(proc) is profiled
+    assert proc(21) == 42  # also after the profiled run
+
+
+def test_collapsed_in_repl_mode(tmp_path, monkeypatch, capsys) -> None:
+    lines = iter(['(define (sq n) (* n n))', '(sq 7)'])
+    def fake_input(prompt: str) -> str:
+        try:
+            return next(lines)
+        except StopIteration:
+            raise EOFError from None
+    monkeypatch.setattr('builtins.input', fake_input)
+    path = tmp_path / 'repl.collapsed'
+    with raises(EOFError):
+        lis.main(['--collapsed', str(path)])
+    captured = capsys.readouterr()
+    assert captured.out == '49\n'
+    assert 'maximum depth: 2' in captured.err
+    stacks = dict(line.rsplit(' ', 1) for line in path.read_text().splitlines())
+    assert set(stacks) == {'sq', 'sq;*'}
+
+
+memo_fib_src = """
+(define (fib n)
+    (if (< n 2)
+        n
+        (+ (fib (- n 1)) (fib (- n 2)))))
+(define fib (memoize fib 10))
+(fib 60)
+"""
+
+
+@backends
+def test_memoize(backend: str) -> None:
+    assert run(memo_fib_src, backend) == 1548008755920
+    hits, misses, bypasses, size, maxsize = run(
+        memo_fib_src + '(memo-stats fib)', backend)
+    assert (misses, bypasses, size, maxsize) == (61, 0, 10, 10)
+    assert hits == 58
+
+
+def test_memoize_lru_eviction() -> None:
+    memo = Memoized(lambda x: x * 2, maxsize=2)
+    for x in [1, 2, 1, 3, 1, 2]:  # 2 is evicted by 3, then called again
+        memo(x)
+    assert memo.stats() == [2, 4, 0, 2, 2]
+
+
+def test_memoize_unhashable_arguments() -> None:
+    source = """
+    (define total (memoize (lambda (xs) (apply + xs))))
+    (define sum-vec (memoize vector-sum))
+    (list (total (list 1 2)) (total (list 1 2))
+          (sum-vec (vector 1 2)) (memo-stats total) (memo-stats sum-vec))
+    """
+    assert run(source) == [3, 3, 3.0, [1, 1, 0, 1, 1024], [0, 0, 1, 0, 1024]]
+
+
+par_map_src = """
+(define (square x) (* x x))
+(define (make-scaled-square k)
+    (lambda (x) (* k (square x))))
+(par-map (make-scaled-square 10) (list 1 2 3 4 5) 2)
+"""
+
+
+def test_par_map() -> None:
+    assert run(par_map_src) == [10, 40, 90, 160, 250]
+
+
+def test_par_map_builtin() -> None:
+    assert run('(par-map car (list (list 1) (list 2 3)) 2)') == [1, 2]
+
+
+@mark.parametrize('backend', ['closure', 'vm'])
+def test_par_map_only_in_eval(backend: str) -> None:
+    with raises(KeyError, match='par-map'):
+        run(par_map_src, backend)
+
+
+def test_export_procedure_names_only_builtin_procedures() -> None:
+    env = global_environment()
+    source = '(define s (quote math)) (define (f x) (+ x 1))'
+    for exp in read_exps(source):
+        evaluate(exp, env)
+    _, tables = export_procedure(env['f'], builtins_of(env))
+    variables, = tables.values()
+    assert variables['s'] == ('atom', 'math')  # not vars(math)['__name__']
+    assert variables['f'][0] == 'proc'
+
+
+def test_par_map_with_profiler() -> None:
+    assert run(par_map_src, profiler=Profiler()) == [10, 40, 90, 160, 250]